@@ -0,0 +1,2 @@
+# Lets pytest import the rm_tools package from a checkout (this directory
+# is put on sys.path, as the one holding the root conftest.py).
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+#
+# Persistent SQLite catalog of a (raw) xochitl directory: documents,
+# folders, their pages and the page files.
+#
+# refresh() stats the files of the tree, and only parses the .metadata
+# and .content files whose mtime or size changed since the last refresh.
+# The typed text of the version=6 pages goes into a full-text index
+# (SQLite FTS5), updated the same way: only the page files that changed are
+# read again.
+import os
+import json
+import mmap
+import sqlite3
+import datetime
+
+try:
+    from . import lines_v6
+except ImportError:
+    import lines_v6
+
+
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS items (
+    uuid TEXT PRIMARY KEY,
+    parent TEXT,
+    type TEXT,
+    visible_name TEXT,
+    last_modified INTEGER,
+    file_type TEXT,
+    page_count INTEGER,
+    metadata TEXT,
+    metadata_mtime INTEGER,
+    metadata_size INTEGER,
+    content_mtime INTEGER,
+    content_size INTEGER
+);
+CREATE TABLE IF NOT EXISTS pages (
+    uuid TEXT,
+    page_index INTEGER,
+    page_uuid TEXT,
+    rm_size INTEGER,
+    rm_mtime INTEGER,
+    PRIMARY KEY (uuid, page_index)
+);
+CREATE INDEX IF NOT EXISTS items_parent ON items (parent);
+CREATE VIRTUAL TABLE IF NOT EXISTS page_text USING fts5 (
+    text,
+    uuid UNINDEXED,
+    page_uuid UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# query() types: item types and file types
+ITEM_TYPES = {
+    'folder': 'CollectionType',
+    'document': 'DocumentType',
+}
+
+
+def content_page_uuids(content):
+    """returns the page uuids of a document .content, in order"""
+    # (older .content files have no formatVersion, and a pages list)
+    format_version = content.get('formatVersion', 1)
+    if format_version == 1:
+        return content['pages']
+    elif format_version == 2:
+        return [page['id'] for page in content['cPages']['pages']
+                if 'deleted' not in page]
+    raise ValueError('unknown .content formatVersion: %r' % format_version)
+
+
+def file_stat(path):
+    # (mtime in ns, size), or (None, None) if the file does not exist
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None, None
+    return st.st_mtime_ns, st.st_size
+
+
+def page_text(path):
+    """returns the typed text of a page file (only version=6 pages have any)"""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return ''
+    with f:
+        if f.read(len(lines_v6.header_v6)) != lines_v6.header_v6:
+            return ''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                return '\n'.join(lines_v6.read_text(data))
+            except (lines_v6.FormatError, UnicodeDecodeError):
+                # index what can be read: nothing
+                return ''
+
+
+def match_expression(text):
+    """
+    the FTS query of a search: all the words (in any order), a word
+    ending with * matching any word starting with it
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            terms.append('"%s"%s' % (word.replace('"', '""'), '*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def parse_date(text):
+    """parses a date (YYYYMMDD, YYYY-MM-DD, or an ISO date and time)"""
+    if len(text) == 8 and text.isdigit():
+        text = '%s-%s-%s' % (text[:4], text[4:6], text[6:])
+    return datetime.datetime.fromisoformat(text)
+
+
+class Catalog():
+    """A SQLite catalog of a xochitl directory (see refresh)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        version = self.get_info('schema_version')
+        if version is not None and int(version) == 1:
+            # version 1 had no page text: read all the pages again
+            self.db.execute('UPDATE pages SET rm_mtime = NULL, rm_size = NULL')
+        elif version is not None and int(version) != SCHEMA_VERSION:
+            raise ValueError('%s: unsupported catalog version %s' % (
+                path, version))
+        self.set_info('schema_version', SCHEMA_VERSION)
+        self.db.commit()
+
+    def get_info(self, key):
+        row = self.db.execute('SELECT value FROM info WHERE key = ?',
+                              (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_info(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO info VALUES (?, ?)',
+                        (key, str(value)))
+
+    @property
+    def rootdir(self):
+        return self.get_info('rootdir')
+
+    def refresh(self, rootdir, debug=0):
+        """
+        updates the catalog from rootdir. Returns the number of items
+        (re)read, and the number of items removed.
+        """
+        rootdir = os.path.abspath(rootdir)
+        if self.rootdir not in (None, rootdir):
+            # another tree: start again
+            self.db.execute('DELETE FROM items')
+            self.db.execute('DELETE FROM pages')
+            self.db.execute('DELETE FROM page_text')
+        self.set_info('rootdir', rootdir)
+
+        # list the directory once, and stat the (json) files
+        found = {}
+        with os.scandir(rootdir) as it:
+            for entry in it:
+                uuid, ext = os.path.splitext(entry.name)
+                if ext == '.metadata' and entry.is_file():
+                    st = entry.stat()
+                    found[uuid] = (st.st_mtime_ns, st.st_size)
+        known = {row[0]: row[1:] for row in self.db.execute(
+            'SELECT uuid, metadata_mtime, metadata_size, content_mtime, '
+            'content_size FROM items')}
+
+        updated = 0
+        for uuid, metadata_stat in found.items():
+            content_stat = file_stat(os.path.join(rootdir, uuid + '.content'))
+            if known.get(uuid) == metadata_stat + content_stat:
+                # only the page files may have changed
+                self.refresh_pages(rootdir, uuid, None)
+                continue
+            self.read_item(rootdir, uuid, metadata_stat, content_stat)
+            updated += 1
+            if debug > 1:
+                print('..indexed %s' % uuid)
+
+        removed = [uuid for uuid in known if uuid not in found]
+        self.db.executemany('DELETE FROM items WHERE uuid = ?',
+                            [(uuid,) for uuid in removed])
+        self.db.executemany('DELETE FROM pages WHERE uuid = ?',
+                            [(uuid,) for uuid in removed])
+        self.db.executemany('DELETE FROM page_text WHERE uuid = ?',
+                            [(uuid,) for uuid in removed])
+        self.db.commit()
+        return updated, len(removed)
+
+    def read_item(self, rootdir, uuid, metadata_stat, content_stat):
+        with open(os.path.join(rootdir, uuid + '.metadata')) as f:
+            metadata = json.load(f)
+        file_type = None
+        page_uuid_list = None
+        if content_stat[0] is not None:
+            with open(os.path.join(rootdir, uuid + '.content')) as f:
+                content = json.load(f)
+            file_type = content.get('fileType')
+            if metadata['type'] == 'DocumentType':
+                page_uuid_list = content_page_uuids(content)
+        self.db.execute(
+            'INSERT OR REPLACE INTO items VALUES '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                uuid, metadata['parent'], metadata['type'],
+                metadata['visibleName'], int(metadata['lastModified']),
+                file_type,
+                len(page_uuid_list) if page_uuid_list is not None else None,
+                json.dumps(metadata)) + metadata_stat + content_stat)
+        self.refresh_pages(rootdir, uuid, page_uuid_list)
+
+    def refresh_pages(self, rootdir, uuid, page_uuid_list):
+        # page_uuid_list: the new page list (None: same pages as before)
+        rows = self.db.execute(
+            'SELECT page_index, page_uuid, rm_mtime, rm_size FROM pages '
+            'WHERE uuid = ?', (uuid,)).fetchall()
+        if page_uuid_list is None:
+            for page_index, page_uuid, rm_mtime, rm_size in rows:
+                rm_path = os.path.join(rootdir, uuid, page_uuid + '.rm')
+                rm_stat = file_stat(rm_path)
+                if rm_stat != (rm_mtime, rm_size):
+                    self.db.execute(
+                        'UPDATE pages SET rm_mtime = ?, rm_size = ? '
+                        'WHERE uuid = ? AND page_index = ?',
+                        rm_stat + (uuid, page_index))
+                    self.index_text(uuid, page_uuid, rm_path)
+            return
+        # the text of the pages kept (and unchanged) is kept
+        known = {page_uuid: (rm_mtime, rm_size)
+                 for _, page_uuid, rm_mtime, rm_size in rows}
+        for page_uuid in set(known) - set(page_uuid_list):
+            self.db.execute('DELETE FROM page_text WHERE uuid = ? AND '
+                            'page_uuid = ?', (uuid, page_uuid))
+        self.db.execute('DELETE FROM pages WHERE uuid = ?', (uuid,))
+        rows = []
+        for page_index, page_uuid in enumerate(page_uuid_list):
+            rm_path = os.path.join(rootdir, uuid, page_uuid + '.rm')
+            rm_mtime, rm_size = file_stat(rm_path)
+            if known.get(page_uuid) != (rm_mtime, rm_size):
+                self.index_text(uuid, page_uuid, rm_path)
+            rows.append((uuid, page_index, page_uuid, rm_size, rm_mtime))
+        self.db.executemany('INSERT INTO pages VALUES (?, ?, ?, ?, ?)', rows)
+
+    def index_text(self, uuid, page_uuid, rm_path):
+        # (re)index the text of a page
+        self.db.execute('DELETE FROM page_text WHERE uuid = ? AND '
+                        'page_uuid = ?', (uuid, page_uuid))
+        text = page_text(rm_path)
+        if text:
+            self.db.execute('INSERT INTO page_text VALUES (?, ?, ?)',
+                            (text, uuid, page_uuid))
+
+    def get_metadata(self):
+        """returns the (uuid, metadata) of all the items"""
+        return [(uuid, json.loads(metadata)) for uuid, metadata in
+                self.db.execute('SELECT uuid, metadata FROM items')]
+
+    def get_page_uuids(self, uuid):
+        """returns the page uuids of a document, in order"""
+        return [row[0] for row in self.db.execute(
+            'SELECT page_uuid FROM pages WHERE uuid = ? ORDER BY page_index',
+            (uuid,))]
+
+    def get_paths(self):
+        """returns the folder path ("/a/b/name") of every item"""
+        items = {uuid: (parent, name) for uuid, parent, name in
+                 self.db.execute('SELECT uuid, parent, visible_name FROM items')}
+        paths = {}
+
+        def get_path(uuid):
+            # iterative, as trees can be deep; None if not under the root
+            chain = []
+            while uuid not in paths:
+                if uuid == '':
+                    paths[uuid] = ''
+                    break
+                if uuid not in items or uuid in chain:
+                    # trash, missing parent or loop
+                    paths[uuid] = None
+                    break
+                chain.append(uuid)
+                uuid = items[uuid][0]
+            path = paths[uuid]
+            for uuid in reversed(chain):
+                if path is not None:
+                    path = path + '/' + items[uuid][1]
+                paths[uuid] = path
+            return path
+
+        for uuid in items:
+            get_path(uuid)
+        del paths['']
+        return paths
+
+    def query(self, name=None, folder=None, since=None, until=None,
+              item_type=None):
+        """
+        returns the (uuid, type, file_type, last_modified, page_count,
+        path) of the items (not in the trash) that match all the filters:
+        name (substring of the name, any case), folder (path prefix, e.g.
+        "/Work"), since/until (datetime, on lastModified), item_type
+        ("folder", "document" or a file type like "pdf" or "notebook").
+        The items are sorted by path.
+        """
+        where = []
+        args = []
+        if name is not None:
+            where.append("visible_name LIKE ? ESCAPE '\\'")
+            args.append('%' + name.replace('\\', '\\\\').replace(
+                '%', '\\%').replace('_', '\\_') + '%')
+        if since is not None:
+            where.append('last_modified >= ?')
+            args.append(int(since.timestamp() * 1000))
+        if until is not None:
+            where.append('last_modified < ?')
+            args.append(int(until.timestamp() * 1000))
+        if item_type is not None:
+            if item_type in ITEM_TYPES:
+                where.append('type = ?')
+                args.append(ITEM_TYPES[item_type])
+            else:
+                where.append('file_type = ?')
+                args.append(item_type)
+        sql = ('SELECT uuid, type, file_type, last_modified, page_count '
+               'FROM items')
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        paths = self.get_paths()
+        if folder is not None:
+            folder = '/' + folder.strip('/')
+        results = []
+        for row in self.db.execute(sql, args):
+            path = paths[row[0]]
+            if path is None:
+                continue
+            if folder not in (None, '/') and not path.startswith(folder + '/'):
+                continue
+            results.append(row + (path,))
+        results.sort(key=lambda row: row[-1])
+        return results
+
+    def search(self, text, limit=20):
+        """
+        returns the (uuid, page_index, path, snippet) of the pages (of the
+        items not in the trash) whose typed text has all the words of text
+        (see match_expression), best matches first. The words found are
+        put in [brackets] in the snippets.
+        """
+        expression = match_expression(text)
+        if not expression:
+            return []
+        rows = self.db.execute(
+            "SELECT page_text.uuid, pages.page_index, "
+            "snippet(page_text, 0, '[', ']', '...', 12) "
+            "FROM page_text JOIN pages ON pages.uuid = page_text.uuid AND "
+            "pages.page_uuid = page_text.page_uuid "
+            "WHERE page_text MATCH ? ORDER BY rank", (expression,))
+        paths = None
+        results = []
+        for uuid, page_index, snippet in rows:
+            if paths is None:
+                paths = self.get_paths()
+            path = paths.get(uuid)
+            if path is None:
+                continue
+            results.append((uuid, page_index, path, snippet))
+            if len(results) == limit:
+                break
+        return results
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
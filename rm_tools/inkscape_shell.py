@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+#
+# Converts SVG files to PDF through one long-running "inkscape --shell"
+# session, instead of starting inkscape (about a second) for every file.
+#
+# The line protocol used (that of Inkscape 1.x): the shell prints a "> "
+# prompt when it is ready, reads one line of ";"-separated actions, runs
+# them, and prints the prompt again. Any program speaking this protocol
+# can be used instead of inkscape (see the command argument), e.g. the
+# stand-in tests/fake_inkscape.py.
+import os
+import sys
+import time
+import shlex
+import select
+import argparse
+import subprocess
+
+
+__prog_name__ = "inkscape_shell"
+__version__ = "0.0.1"
+
+
+PROMPT = b'> '
+
+
+class InkscapeError(Exception):
+    pass
+
+
+class InkscapeShell():
+    """
+    An "inkscape --shell" session. The session is started on the first
+    export, and restarted if it dies or does not answer in time.
+    """
+    def __init__(self, command='inkscape', timeout=60):
+        # command is a string (split like a shell would) or a list
+        if isinstance(command, str):
+            command = shlex.split(command)
+        self.command = list(command) + ['--shell']
+        self.timeout = timeout
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        self.read_until_prompt()
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def read_until_prompt(self):
+        """returns the output of the shell up to (without) the next prompt"""
+        fd = self.process.stdout.fileno()
+        deadline = time.monotonic() + self.timeout
+        out = b''
+        while not out.endswith(PROMPT):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise InkscapeError('%s: no answer in %s s' % (self.command[0], self.timeout))
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            data = os.read(fd, 4096)
+            if not data:
+                raise InkscapeError('%s: the shell exited (%s)' % (self.command[0], self.process.poll()))
+            out += data
+        return out[:-len(PROMPT)]
+
+    def execute(self, actions):
+        """runs a list of actions (in one line) and returns their output"""
+        line = '; '.join(actions) + '\n'
+        try:
+            self.process.stdin.write(line.encode('utf-8'))
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise InkscapeError('%s: the shell exited (%s)' % (self.command[0], e))
+        return self.read_until_prompt()
+
+    def export(self, infile, outfile, retries=1):
+        """converts infile (svg) into outfile (the type is the extension)"""
+        for path in (infile, outfile):
+            # ";" separates actions, a newline ends the command
+            if ';' in path or '\n' in path:
+                raise ValueError('invalid file name for inkscape: %r' % path)
+        if os.path.exists(outfile):
+            os.remove(outfile)
+        actions = ['file-open:%s' % infile, 'export-filename:%s' % outfile,
+                   'export-do', 'file-close']
+        for attempt in range(retries + 1):
+            try:
+                if not self.running():
+                    self.start()
+                out = self.execute(actions)
+                break
+            except InkscapeError:
+                # start again with a fresh session
+                self.close(wait=0)
+                if attempt == retries:
+                    raise
+        if not os.path.exists(outfile):
+            raise InkscapeError('%s: cannot export %s: %s' % (
+                self.command[0], infile, out.decode('utf-8', 'replace').strip()))
+
+    def close(self, wait=5):
+        # wait: seconds to let the shell quit before killing it
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            if process.poll() is None:
+                process.stdin.write(b'quit\n')
+                process.stdin.flush()
+            process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        try:
+            process.wait(wait)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=__prog_name__)
+    parser.add_argument("-i",
+                        "--input",
+                        help="svg input files",
+                        required=True,
+                        nargs='+',
+                        metavar="FILENAME",
+                        )
+    parser.add_argument("--command",
+                        help="inkscape command (default: inkscape)",
+                        default='inkscape',
+                        )
+    parser.add_argument("--timeout",
+                        help="seconds to wait for one export (default: 60)",
+                        type=float,
+                        default=60,
+                        )
+    parser.add_argument('--version',
+                        action='version',
+                        version='%(prog)s {version}'.format(version=__version__))
+    args = parser.parse_args()
+
+    with InkscapeShell(args.command, args.timeout) as shell:
+        for infile in args.input:
+            outfile = os.path.splitext(infile)[0] + '.pdf'
+            try:
+                shell.export(infile, outfile)
+            except InkscapeError as e:
+                print('error: %s' % e, file=sys.stderr)
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+#
+# Reader for reMarkable ".rm" files, version=6 (firmware 3.x).
+#
+# A version=6 file is the 43-byte header followed by a sequence of blocks
+# (see version6.md). Every block starts with an 8-byte header (payload
+# length, an unknown byte, the minimum and current block versions and the
+# block type), and its payload is a sequence of tagged values: every value
+# is preceded by a varuint tag, (index << 4) | type.
+#
+# The blocks are walked one at a time (a block is only looked at when it
+# is reached), and the point records of every line are decoded with NumPy
+# into the same columns (and units) as the version=3/5 segments.
+import heapq
+import bisect
+import struct
+import argparse
+
+import numpy as np
+
+
+__prog_name__ = "lines_v6"
+__version__ = "0.0.1"
+
+
+header_v6 = b'reMarkable .lines file, version=6          '
+
+# Block types
+BLOCK_MIGRATION_INFO = 0x00
+BLOCK_SCENE_TREE = 0x01
+BLOCK_TREE_NODE = 0x02
+BLOCK_SCENE_GLYPH_ITEM = 0x03
+BLOCK_SCENE_GROUP_ITEM = 0x04
+BLOCK_SCENE_LINE_ITEM = 0x05
+BLOCK_SCENE_TEXT_ITEM = 0x06
+BLOCK_ROOT_TEXT = 0x07
+BLOCK_SCENE_TOMBSTONE_ITEM = 0x08
+BLOCK_AUTHOR_IDS = 0x09
+BLOCK_PAGE_INFO = 0x0A
+
+# Tag types
+TAG_ID = 0xF
+TAG_LENGTH4 = 0xC
+TAG_BYTE8 = 0x8
+TAG_BYTE4 = 0x4
+TAG_BYTE1 = 0x1
+
+# Scene item types (first byte of an item value)
+ITEM_GROUP = 0x02
+ITEM_LINE = 0x03
+
+# version=6 x coordinates are centered on the page: add half the page
+# width to get version=3/5 coordinates
+x_offset = 702
+
+# Point records (block version 1): the version=3/5 segment layout
+point_v1_dtype = np.dtype([
+    ('xpos', '<f4'),
+    ('ypos', '<f4'),
+    ('speed', '<f4'),
+    ('tilt', '<f4'),
+    ('width', '<f4'),
+    ('pressure', '<f4'),
+])
+
+# Point records (block version 2): quantized values
+point_v2_dtype = np.dtype([
+    ('xpos', '<f4'),
+    ('ypos', '<f4'),
+    ('speed', '<u2'),
+    ('width', '<u2'),
+    ('tilt', 'u1'),
+    ('pressure', 'u1'),
+])
+
+
+class FormatError(ValueError):
+    pass
+
+
+class Line():
+    """A line (stroke) item, with its points in version=3/5 columns."""
+    __slots__ = ('layer_id', 'item_id', 'tool', 'color', 'thickness', 'points')
+
+    def __init__(self, layer_id, item_id, tool, color, thickness, points):
+        self.layer_id = layer_id
+        self.item_id = item_id
+        self.tool = tool
+        self.color = color
+        self.thickness = thickness
+        self.points = points
+
+
+class TaggedReader():
+    """Reads the tagged values of data[offset:end]."""
+
+    def __init__(self, data, offset, end):
+        self.data = data
+        self.offset = offset
+        self.end = end
+
+    def check(self, size, name):
+        if self.offset + size > self.end:
+            raise FormatError(f'<{name}> needs {size} bytes at offset {self.offset}, '
+                              f'but only {self.end - self.offset} are left')
+
+    def unpack(self, fmt, name):
+        size = struct.calcsize(fmt)
+        self.check(size, name)
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += size
+        return values
+
+    def read_varuint(self):
+        result = 0
+        shift = 0
+        while True:
+            self.check(1, 'varuint')
+            byte = self.data[self.offset]
+            self.offset += 1
+            result |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+
+    def peek_tag(self):
+        """returns the (index, type) of the next tag, or None at the end"""
+        if self.offset >= self.end:
+            return None
+        offset = self.offset
+        tag = self.read_varuint()
+        self.offset = offset
+        return tag >> 4, tag & 0xf
+
+    def read_tag(self, index, tag_type):
+        tag = self.read_varuint()
+        if (tag >> 4, tag & 0xf) != (index, tag_type):
+            raise FormatError(f'expected tag ({index}, {tag_type:#x}) at offset {self.offset}, '
+                              f'found ({tag >> 4}, {tag & 0xf:#x})')
+
+    def has_tag(self, index, tag_type):
+        return self.peek_tag() == (index, tag_type)
+
+    def read_crdt_id(self):
+        (part1,) = self.unpack('<B', 'id')
+        return (part1, self.read_varuint())
+
+    def read_id(self, index):
+        self.read_tag(index, TAG_ID)
+        return self.read_crdt_id()
+
+    def read_int(self, index):
+        self.read_tag(index, TAG_BYTE4)
+        return self.unpack('<I', 'int')[0]
+
+    def read_float(self, index):
+        self.read_tag(index, TAG_BYTE4)
+        return self.unpack('<f', 'float')[0]
+
+    def read_double(self, index):
+        self.read_tag(index, TAG_BYTE8)
+        return self.unpack('<d', 'double')[0]
+
+    def read_subblock(self, index):
+        """returns the end offset of the subblock that starts here"""
+        self.read_tag(index, TAG_LENGTH4)
+        (length,) = self.unpack('<I', 'subblock length')
+        self.check(length, 'subblock')
+        return self.offset + length
+
+    def skip_value(self):
+        """skips a tagged value (of any type)"""
+        tag = self.read_varuint()
+        tag_type = tag & 0xf
+        if tag_type == TAG_ID:
+            self.read_crdt_id()
+        elif tag_type == TAG_LENGTH4:
+            (length,) = self.unpack('<I', 'length')
+            self.check(length, 'value')
+            self.offset += length
+        elif tag_type in (TAG_BYTE8, TAG_BYTE4, TAG_BYTE1):
+            self.check(tag_type, 'value')
+            self.offset += tag_type
+        else:
+            raise FormatError(f'unknown tag type {tag_type:#x} at offset {self.offset}')
+
+
+def iter_blocks(data):
+    """
+    yields the (block_type, version, start, end) of the blocks of a
+    version=6 file held in data (bytes or mmap): data[start:end] is the
+    block payload
+    """
+    if bytes(data[:len(header_v6)]) != header_v6:
+        raise FormatError(f'not a version=6 file: <header={bytes(data[:len(header_v6)])}>')
+    offset = len(header_v6)
+    while offset < len(data):
+        if offset + 8 > len(data):
+            raise FormatError(f'truncated block header at offset {offset}')
+        length, _, min_version, version, block_type = struct.unpack_from('<IBBBB', data, offset)
+        start = offset + 8
+        end = start + length
+        if end > len(data):
+            raise FormatError(f'<block length={length}> at offset {offset}, but only '
+                              f'{len(data) - start} bytes are left')
+        yield block_type, version, start, end
+        offset = end
+
+
+def read_points(data, offset, end, version):
+    """decodes the point records of data[offset:end] into point_v1_dtype columns"""
+    dtype = point_v1_dtype if version == 1 else point_v2_dtype
+    if (end - offset) % dtype.itemsize != 0:
+        raise FormatError(f'<points length={end - offset}> at offset {offset} is not a '
+                          f'multiple of {dtype.itemsize}')
+    raw = np.frombuffer(data, dtype=dtype, count=(end - offset) // dtype.itemsize, offset=offset)
+    points = np.empty(len(raw), dtype=point_v1_dtype)
+    points['xpos'] = raw['xpos'] + x_offset
+    points['ypos'] = raw['ypos']
+    if version == 1:
+        for name in ('speed', 'tilt', 'width', 'pressure'):
+            points[name] = raw[name]
+    else:
+        points['speed'] = raw['speed'] / 4
+        points['width'] = raw['width'] / 4
+        points['tilt'] = raw['tilt'] * (2 * np.pi / 255)
+        points['pressure'] = raw['pressure'] / 255
+    return points
+
+
+def read_line_item(data, start, end, version):
+    """
+    returns the layer id of a line item block, and its item in the
+    sequence of lines of the layer (see order_items): (item_id, left_id,
+    right_id, 1, Line), the Line being None for a deleted line
+    """
+    reader = TaggedReader(data, start, end)
+    layer_id = reader.read_id(1)
+    item_id = reader.read_id(2)
+    left_id = reader.read_id(3)
+    right_id = reader.read_id(4)
+    reader.read_int(5)  # deleted_length
+    if not reader.has_tag(6, TAG_LENGTH4):
+        # deleted item: no value (but still a place in the sequence)
+        return layer_id, (item_id, left_id, right_id, 1, None)
+    reader.end = reader.read_subblock(6)
+    (item_type,) = reader.unpack('<B', 'item type')
+    if item_type != ITEM_LINE:
+        raise FormatError(f'line item of type {item_type} at offset {start}')
+    tool = reader.read_int(1)
+    color = reader.read_int(2)
+    thickness = reader.read_double(3)
+    reader.read_float(4)  # starting_length
+    points_end = reader.read_subblock(5)
+    points = read_points(data, reader.offset, points_end, version)
+    # the rest (timestamp, move id, ...) is not needed
+    line = Line(layer_id, item_id, tool, color, thickness, points)
+    return layer_id, (item_id, left_id, right_id, 1, line)
+
+
+def read_group_item(data, start, end):
+    """
+    returns the parent id of a group item block, and its item in the
+    sequence of children of the parent (see order_items): (item_id,
+    left_id, right_id, 1, the layer (tree node) id the item adds, or None)
+    """
+    reader = TaggedReader(data, start, end)
+    parent_id = reader.read_id(1)
+    item_id = reader.read_id(2)
+    left_id = reader.read_id(3)
+    right_id = reader.read_id(4)
+    reader.read_int(5)  # deleted_length
+    item = (item_id, left_id, right_id, 1, None)
+    if not reader.has_tag(6, TAG_LENGTH4):
+        return parent_id, item
+    reader.end = reader.read_subblock(6)
+    (item_type,) = reader.unpack('<B', 'item type')
+    if item_type != ITEM_GROUP:
+        return parent_id, item
+    return parent_id, item[:4] + (reader.read_id(2),)
+
+
+def read_layers(data):
+    """
+    reads the lines of a version=6 file held in data (bytes or mmap).
+    Returns a list of (layer_id, [Line]) in layer order; the lines of a
+    layer are in sequence (drawing) order, whatever the order of their
+    blocks (see order_items).
+    """
+    # the group and line items, by parent (sequence)
+    groups = {}
+    lines = {}
+    for block_type, version, start, end in iter_blocks(data):
+        if block_type == BLOCK_SCENE_GROUP_ITEM:
+            parent_id, item = read_group_item(data, start, end)
+            groups.setdefault(parent_id, []).append(item)
+        elif block_type == BLOCK_SCENE_LINE_ITEM:
+            layer_id, item = read_line_item(data, start, end, version)
+            lines.setdefault(layer_id, []).append(item)
+    layers = {layer_id: [] for items in groups.values() for layer_id in order_items(items)}
+    for layer_id, items in lines.items():
+        layers.setdefault(layer_id, []).extend(order_items(items))
+    return list(layers.items())
+
+
+def read_text_items(reader):
+    """
+    reads the items of a text (a CRDT sequence) at the reader offset.
+    Returns (item_id, left_id, right_id, length, text) per item: text is
+    None for deleted characters and formatting marks. The characters of an
+    item have the ids (part1, part2 + i)
+    """
+    items = []
+    for _ in range(reader.read_varuint()):
+        item_end = reader.read_subblock(0)
+        end, reader.end = reader.end, item_end
+        item_id = reader.read_id(2)
+        left_id = reader.read_id(3)
+        right_id = reader.read_id(4)
+        length = reader.read_int(5)
+        text = None
+        if reader.has_tag(6, TAG_LENGTH4):
+            string_end = reader.read_subblock(6)
+            size = reader.read_varuint()
+            reader.unpack('<B', 'is_ascii')
+            reader.check(size, 'string')
+            text = bytes(reader.data[reader.offset:reader.offset + size]).decode('utf-8')
+            reader.offset += size
+            length = len(text)
+            if reader.offset != string_end:
+                # an empty string followed by an int is a formatting mark
+                text = None
+                length = 1
+        if length > 0:
+            items.append((item_id, left_id, right_id, length, text))
+        reader.offset, reader.end = item_end, end
+    return items
+
+
+def order_text(items):
+    """returns the text of read_text_items items (see order_items)"""
+    return ''.join(order_items(items))
+
+
+def order_items(items):
+    """
+    returns the values of the (item_id, left_id, right_id, length, value)
+    items of a CRDT sequence, in sequence order: every element comes after
+    its left neighbour and before its right one. Items are split where
+    others were inserted (their values sliced), and ordered as runs of
+    elements (ties by id). Deleted items (value None) are only places.
+    """
+    # item starts, by id part1, to find the item of a character id
+    starts = {}
+    lengths = {}
+    for item_id, _, _, length, _ in items:
+        starts.setdefault(item_id[0], []).append(item_id[1])
+        lengths[item_id] = length
+    for start_list in starts.values():
+        start_list.sort()
+
+    def find(char_id):
+        # (item id, offset) of a character, or None
+        start_list = starts.get(char_id[0])
+        if not start_list:
+            return None
+        index = bisect.bisect_right(start_list, char_id[1]) - 1
+        if index < 0:
+            return None
+        item_id = (char_id[0], start_list[index])
+        offset = char_id[1] - item_id[1]
+        return (item_id, offset) if offset < lengths[item_id] else None
+
+    # cut the items where other items refer to a character inside them
+    cuts = {item[0]: set() for item in items}
+    for _, left_id, right_id, _, _ in items:
+        hit = find(left_id)
+        if hit is not None and hit[1] < lengths[hit[0]] - 1:
+            cuts[hit[0]].add(hit[1] + 1)
+        hit = find(right_id)
+        if hit is not None and hit[1] > 0:
+            cuts[hit[0]].add(hit[1])
+    # runs: (first id, last id, left id, right id, value)
+    runs = []
+    for item_id, left_id, right_id, length, value in items:
+        part1, part2 = item_id
+        bounds = [0] + sorted(cuts[item_id]) + [length]
+        for first, last in zip(bounds, bounds[1:]):
+            runs.append(((part1, part2 + first), (part1, part2 + last - 1),
+                         left_id if first == 0 else (part1, part2 + first - 1),
+                         right_id if last == length else (part1, part2 + last),
+                         value[first:last] if value is not None and len(bounds) > 2 else value))
+
+    by_first = {run[0]: index for index, run in enumerate(runs)}
+    by_last = {run[1]: index for index, run in enumerate(runs)}
+    after = [[] for _ in runs]
+    before_count = [0] * len(runs)
+    for index, (_, _, left_id, right_id, _) in enumerate(runs):
+        if left_id in by_last:
+            after[by_last[left_id]].append(index)
+            before_count[index] += 1
+        if right_id in by_first:
+            after[index].append(by_first[right_id])
+            before_count[by_first[right_id]] += 1
+    ready = [(runs[index][0], index) for index, count in enumerate(before_count) if count == 0]
+    heapq.heapify(ready)
+    values = []
+    while ready:
+        _, index = heapq.heappop(ready)
+        if runs[index][4] is not None:
+            values.append(runs[index][4])
+        for next_index in after[index]:
+            before_count[next_index] -= 1
+            if before_count[next_index] == 0:
+                heapq.heappush(ready, (runs[next_index][0], next_index))
+    # (runs in a cycle, in a broken file: keep their values, by id)
+    stuck = sorted((runs[index][0], index) for index, count in enumerate(before_count) if count > 0)
+    values.extend(runs[index][4] for _, index in stuck if runs[index][4] is not None)
+    return values
+
+
+def read_root_text(data, start, end):
+    """returns the text of a root text block"""
+    reader = TaggedReader(data, start, end)
+    reader.read_id(1)  # block_id
+    reader.end = reader.read_subblock(2)
+    # the text items (then the formatting, not needed)
+    reader.end = reader.read_subblock(1)
+    reader.end = reader.read_subblock(1)
+    return order_text(read_text_items(reader))
+
+
+def read_text(data):
+    """
+    returns the typed text blocks of a version=6 file held in data (bytes
+    or mmap). Only the block headers are read, but for the text blocks.
+    """
+    return [read_root_text(data, start, end)
+            for block_type, version, start, end in iter_blocks(data)
+            if block_type == BLOCK_ROOT_TEXT]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=__prog_name__)
+    parser.add_argument("-i",
+                        "--input",
+                        help="version=6 .rm input file",
+                        required=True,
+                        metavar="FILENAME",
+                        )
+    parser.add_argument('--version',
+                        action='version',
+                        version='%(prog)s {version}'.format(version=__version__))
+    args = parser.parse_args()
+
+    with open(args.input, 'rb') as f:
+        data = f.read()
+    for block_type, version, start, end in iter_blocks(data):
+        print(f'block type={block_type:#04x} version={version} offset={start} length={end - start}')
+    for layer_id, lines in read_layers(data):
+        print(f'layer {layer_id}: {len(lines)} lines')
+        for line in lines:
+            print(f'  line {line.item_id}: tool={line.tool} color={line.color} '
+                  f'thickness={line.thickness} points={len(line.points)}')
+    for text in read_text(data):
+        print(f'text: {text!r}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+#
+# Content-addressed cache of rendered pages, for incremental conversions.
+#
+# A page is keyed by the hash of its ".rm" bytes and of the render
+# settings, so an unchanged page is never rendered twice (whatever the
+# mtimes say), and a manifest records the pages every output document was
+# built from, so an unchanged document is not written again.
+import os
+import json
+import shutil
+import hashlib
+import zlib
+
+try:
+    from . import rm2pdf
+except ImportError:
+    import rm2pdf
+
+
+CACHE_DIRNAME = '.rmtool-cache'
+MANIFEST_NAME = 'manifest.json'
+# bump when the cached data format (or rendering) changes
+CACHE_VERSION = 2
+
+
+def render_settings(width, height, coloured_annotations, backend,
+                    render_options=None):
+    """the settings a rendered page depends on (part of the page keys)"""
+    settings = 'v%d;width=%s;height=%s;coloured=%d;backend=%s;pdf=%s' % (
+        CACHE_VERSION, width, height, coloured_annotations, backend,
+        rm2pdf.__version__)
+    if render_options is not None and render_options.key():
+        settings += ';' + render_options.key()
+    return settings
+
+
+def page_key(pagerm, settings):
+    """hashes the page file contents and the render settings"""
+    h = hashlib.sha256(settings.encode('utf-8') + b'\0')
+    with open(pagerm, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PageCache():
+    """
+    The rendered pages of an output directory, and its manifest. Pages
+    are stored as "<key>.page" (a rm2pdf.PdfPage) or "<key>.pdf" (a
+    one-page PDF, as written by inkscape).
+    """
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.cachedir = os.path.join(outdir, CACHE_DIRNAME)
+        os.makedirs(self.cachedir, exist_ok=True)
+        self.manifest_path = os.path.join(self.cachedir, MANIFEST_NAME)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == CACHE_VERSION:
+                self.manifest = manifest['documents']
+
+    def path(self, key, ext):
+        return os.path.join(self.cachedir, key + ext)
+
+    def get(self, key):
+        """returns the cached page (a PdfPage or a pdf path), or None"""
+        pdf_path = self.path(key, '.pdf')
+        if os.path.exists(pdf_path):
+            return pdf_path
+        try:
+            with open(self.path(key, '.page'), 'rb') as f:
+                header = json.loads(f.readline())
+                content = zlib.decompress(f.read())
+        except FileNotFoundError:
+            return None
+        return rm2pdf.PdfPage(header['width'], header['height'], content,
+                              set(header['opacities']))
+
+    def put(self, key, page):
+        """
+        stores a page (a PdfPage, or a one-page pdf as bytes or a file),
+        and returns its cached version (see get)
+        """
+        if isinstance(page, rm2pdf.PdfPage):
+            header = {
+                'width': page.width,
+                'height': page.height,
+                'opacities': sorted(page.opacities),
+            }
+            data = (json.dumps(header).encode('utf-8') + b'\n' +
+                    zlib.compress(page.content))
+            self.write(self.path(key, '.page'), data)
+            return page
+        pdf_path = self.path(key, '.pdf')
+        if isinstance(page, bytes):
+            self.write(pdf_path, page)
+            return pdf_path
+        tmp_path = pdf_path + '.tmp'
+        shutil.copyfile(page, tmp_path)
+        os.replace(tmp_path, pdf_path)
+        return pdf_path
+
+    def write(self, path, data):
+        # write atomically: an interrupted run never leaves a partial entry
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def document_name(self, outfile):
+        # relative to outdir, so the output tree can be moved or copied
+        return os.path.relpath(outfile, self.outdir)
+
+    def is_current(self, outfile, keys):
+        """whether outfile exists and was built from the pages keys"""
+        entry = self.manifest.get(self.document_name(outfile))
+        return (entry is not None and entry['pages'] == keys and
+                os.path.exists(outfile))
+
+    def record(self, outfile, uuid, keys):
+        self.manifest[self.document_name(outfile)] = {
+            'uuid': uuid,
+            'pages': keys,
+        }
+
+    def save(self):
+        data = json.dumps({'version': CACHE_VERSION,
+                           'documents': self.manifest}, indent=1)
+        self.write(self.manifest_path, data.encode('utf-8'))
+
+    def prune(self, outfiles=None):
+        """
+        removes the pages no document of the manifest is built from. The
+        documents not in outfiles (if any: deleted, renamed or moved) are
+        removed from the manifest first
+        """
+        if outfiles is not None:
+            names = set(self.document_name(outfile) for outfile in outfiles)
+            for name in list(self.manifest):
+                if name not in names:
+                    del self.manifest[name]
+        used = set()
+        for entry in self.manifest.values():
+            used.update(entry['pages'])
+        removed = 0
+        for name in os.listdir(self.cachedir):
+            key, ext = os.path.splitext(name)
+            if ext in ('.page', '.pdf', '.tmp') and key not in used:
+                os.remove(os.path.join(self.cachedir, name))
+                removed += 1
+        return removed
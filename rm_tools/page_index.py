@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+#
+# Spatial index of a parsed page, for rendering a part of it (a viewport,
+# or a zoomed tile) without going through all its strokes.
+#
+# Every stroke is cut into chunks of consecutive points, and the bounding
+# box of every chunk (padded with half the widest line of the stroke) is
+# put in the cells of a uniform grid it overlaps. A query only looks at the
+# chunks of the cells under the view, and returns the strokes it hits, in
+# drawing order.
+import numpy as np
+
+try:
+    from . import rm2svg
+except ImportError:
+    import rm2svg
+
+
+# points per chunk (consecutive chunks share a point)
+CHUNK_LENGTH = 32
+# grid cell size, in page units
+CELL_SIZE = 128
+
+
+class PageIndex():
+    """
+    A grid of the stroke chunk bounding boxes of a page (padded with the
+    line widths, as rounded by quantize: see rm2svg.stroke_runs).
+    """
+
+    def __init__(self, page, chunk_length=CHUNK_LENGTH, cell_size=CELL_SIZE, quantize=None):
+        self.page = page
+        self.cell_size = cell_size
+        # strokes, in drawing order: (layer number, stroke)
+        self.strokes = []
+        stroke_boxes = []
+        chunk_boxes = []
+        chunk_strokes = []
+        for layer_number, layer in enumerate(page.layers):
+            for stroke in layer.strokes:
+                boxes = chunk_bounds(stroke, chunk_length, quantize)
+                if len(boxes) == 0:
+                    continue
+                chunk_strokes.append(np.full(len(boxes), len(self.strokes)))
+                chunk_boxes.append(boxes)
+                stroke_boxes.append((boxes[:, 0].min(), boxes[:, 1].min(),
+                                     boxes[:, 2].max(), boxes[:, 3].max()))
+                self.strokes.append((layer_number, stroke))
+        self.stroke_boxes = np.array(stroke_boxes, dtype=np.float64).reshape(-1, 4)
+        self.chunk_boxes = (np.concatenate(chunk_boxes) if chunk_boxes
+                            else np.empty((0, 4), dtype=np.float64))
+        self.chunk_strokes = (np.concatenate(chunk_strokes) if chunk_strokes
+                              else np.empty(0, dtype=np.int64))
+        self.build_grid()
+
+    def build_grid(self):
+        # every chunk goes into all the cells its box overlaps; the cells
+        # are stored as sorted (cell, chunk) pairs, found by bisection
+        cells = self.cell_ranges(self.chunk_boxes)
+        x0, y0, x1, y1 = cells.T
+        ncols = x1 - x0 + 1
+        counts = ncols * (y1 - y0 + 1)
+        chunk = np.repeat(np.arange(len(counts)), counts)
+        rank = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_x = x0[chunk] + rank % ncols[chunk]
+        cell_y = y0[chunk] + rank // ncols[chunk]
+        if len(chunk):
+            self.origin = (int(cell_x.min()), int(cell_y.min()))
+            self.grid_width = int(cell_x.max()) - self.origin[0] + 1
+            self.grid_height = int(cell_y.max()) - self.origin[1] + 1
+        else:
+            self.origin = (0, 0)
+            self.grid_width = self.grid_height = 1
+        keys = self.cell_key(cell_x, cell_y)
+        order = np.argsort(keys, kind='stable')
+        self.cell_keys = keys[order]
+        self.cell_chunks = chunk[order]
+
+    def cell_ranges(self, boxes):
+        """the (x0, y0, x1, y1) cells (inclusive) every box overlaps"""
+        return np.floor(np.asarray(boxes, dtype=np.float64) / self.cell_size).astype(np.int64)
+
+    def cell_key(self, cell_x, cell_y):
+        return (cell_y - self.origin[1]) * self.grid_width + (cell_x - self.origin[0])
+
+    def query(self, rect):
+        """
+        returns the numbers of the strokes (in self.strokes, in drawing
+        order) with a chunk overlapping rect, (x0, y0, x1, y1) in page units
+        """
+        if len(self.cell_keys) == 0:
+            return np.empty(0, dtype=np.int64)
+        x0, y0, x1, y1 = self.cell_ranges(rect).tolist()
+        x0 = max(x0, self.origin[0])
+        x1 = min(x1, self.origin[0] + self.grid_width - 1)
+        # one run of keys per grid row of the view
+        rows = np.arange(max(y0, self.origin[1]), min(y1, self.origin[1] + self.grid_height - 1) + 1)
+        if x0 > x1 or len(rows) == 0:
+            return np.empty(0, dtype=np.int64)
+        starts = np.searchsorted(self.cell_keys, self.cell_key(x0, rows), 'left')
+        ends = np.searchsorted(self.cell_keys, self.cell_key(x1, rows), 'right')
+        if (ends - starts).sum() == 0:
+            return np.empty(0, dtype=np.int64)
+        chunks = np.unique(np.concatenate([self.cell_chunks[start:end]
+                                           for start, end in zip(starts, ends)]))
+        boxes = self.chunk_boxes[chunks]
+        hit = ((boxes[:, 0] <= rect[2]) & (boxes[:, 2] >= rect[0]) &
+               (boxes[:, 1] <= rect[3]) & (boxes[:, 3] >= rect[1]))
+        return np.unique(self.chunk_strokes[chunks[hit]])
+
+    def crop_page(self, rect):
+        """returns a rm2svg.Page of the strokes overlapping rect (see query)"""
+        page = rm2svg.Page()
+        layers = {}
+        for number in self.query(rect).tolist():
+            layer_number, stroke = self.strokes[number]
+            if layer_number not in layers:
+                layers[layer_number] = rm2svg.Layer(self.page.layers[layer_number].id)
+                page.append_layer(layers[layer_number])
+            layers[layer_number].append_stroke(stroke)
+        return page
+
+
+def chunk_bounds(stroke, chunk_length, quantize=None):
+    """
+    returns the (x0, y0, x1, y1) boxes of the chunks of chunk_length
+    segments of a stroke, padded with half its widest line
+    """
+    segments = stroke.segments
+    npoints = len(segments)
+    if npoints == 0:
+        return np.empty((0, 4), dtype=np.float64)
+    xpos = segments['xpos'].astype(np.float64)
+    ypos = segments['ypos'].astype(np.float64)
+    starts = np.arange(0, max(npoints - 1, 1), chunk_length)
+    boxes = np.column_stack((np.minimum.reduceat(xpos, starts), np.minimum.reduceat(ypos, starts),
+                             np.maximum.reduceat(xpos, starts), np.maximum.reduceat(ypos, starts)))
+    # a chunk ends at the first point of the next one
+    nexts = starts[1:]
+    boxes[:-1, 0] = np.minimum(boxes[:-1, 0], xpos[nexts])
+    boxes[:-1, 1] = np.minimum(boxes[:-1, 1], ypos[nexts])
+    boxes[:-1, 2] = np.maximum(boxes[:-1, 2], xpos[nexts])
+    boxes[:-1, 3] = np.maximum(boxes[:-1, 3], ypos[nexts])
+    runs = rm2svg.stroke_runs(stroke, quantize)
+    pad = max(abs(width) for _, _, _, width, _ in runs) / 2 if runs else 0
+    boxes[:, :2] -= pad
+    boxes[:, 2:] += pad
+    return boxes
+
+
+def view_rect(transform):
+    """the (x0, y0, x1, y1) page rectangle a ViewTransform shows"""
+    a, b, c, d, e, f = transform.matrix
+    inverse = np.linalg.inv(np.array([[a, c], [b, d]]))
+    corners = np.array([(0, 0), (transform.width, 0), (0, transform.height),
+                        (transform.width, transform.height)], dtype=np.float64)
+    points = (corners - (e, f)) @ inverse.T
+    return (*points.min(axis=0).tolist(), *points.max(axis=0).tolist())
+
+
+def render_viewport(index, output_name, transform, options=None):
+    """
+    writes the SVG of the part of an indexed page a ViewTransform shows
+    (see rm2svg.ViewTransform crop), only styling the strokes in view
+    """
+    page = index.crop_page(view_rect(transform))
+    rm2svg.convert_to_svg(page, output_name, transform.width, transform.height,
+                          transform, options)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+#
+# Timing and profiling of rmtool conversions: the time spent in every
+# stage (scan, hash, parse, render, svg, inkscape, assemble, ...), byte
+# and point counts and peak memory, per page and per document.
+import sys
+import json
+import time
+import pstats
+import cProfile
+import contextlib
+import tracemalloc
+
+
+class StageTimes():
+    """Accumulates the time spent in named stages."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def total(self):
+        return sum(self.stages.values())
+
+
+def reset_memory_peak():
+    # start tracing (the first time), and measure a new peak from here
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+
+
+def memory_peak():
+    """the peak traced memory since reset_memory_peak (or None)"""
+    if not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.get_traced_memory()[1]
+
+
+class Profile():
+    """
+    The timings of a conversion run: run-level stages, and the stages,
+    pages, counts and peak memory of every document.
+    """
+
+    def __init__(self, json_path=None, trace_memory=False,
+                 cprofile_uuid=None, cprofile_path=None):
+        self.json_path = json_path
+        self.trace_memory = trace_memory
+        # the document to run under cProfile, and where to write the
+        # stats (printed to stderr if None)
+        self.cprofile_uuid = cprofile_uuid
+        self.cprofile_path = cprofile_path
+        self.times = StageTimes()
+        self.documents = {}
+        self.start = time.perf_counter()
+
+    def document(self, uuid, outfile=None):
+        if uuid not in self.documents:
+            self.documents[uuid] = {
+                'uuid': uuid,
+                'outfile': outfile,
+                'seconds': 0,
+                'stages': {},
+                'pages': [],
+                'rm_bytes': 0,
+                'points': 0,
+                'output_bytes': 0,
+                'peak_memory': None,
+            }
+        return self.documents[uuid]
+
+    def add_document_stage(self, uuid, name, seconds):
+        record = self.document(uuid)
+        record['stages'][name] = record['stages'].get(name, 0) + seconds
+        record['seconds'] += seconds
+
+    def add_page(self, uuid, page_stats):
+        """adds the stats of a page (see rmtool.convert_page) to a document"""
+        record = self.document(uuid)
+        record['pages'].append(page_stats)
+        record['seconds'] += page_stats['seconds']
+        for name, seconds in page_stats['stages'].items():
+            record['stages'][name] = record['stages'].get(name, 0) + seconds
+        record['rm_bytes'] += page_stats['rm_bytes']
+        record['points'] += page_stats['points']
+        self.add_memory_peak(uuid, page_stats['peak_memory'])
+
+    def add_memory_peak(self, uuid, peak):
+        record = self.document(uuid)
+        if peak is not None:
+            record['peak_memory'] = max(record['peak_memory'] or 0, peak)
+
+    @contextlib.contextmanager
+    def cprofile(self, uuid):
+        """runs the block under cProfile, if uuid is the profiled document"""
+        if self.cprofile_uuid is None or uuid != self.cprofile_uuid:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if self.cprofile_path is not None:
+                profiler.dump_stats(self.cprofile_path)
+            else:
+                stats = pstats.Stats(profiler, stream=sys.stderr)
+                stats.sort_stats('cumulative').print_stats(25)
+
+    def to_dict(self):
+        return {
+            'seconds': time.perf_counter() - self.start,
+            'stages': self.times.stages,
+            'documents': list(self.documents.values()),
+        }
+
+    def write_json(self):
+        if self.json_path is None:
+            return
+        with open(self.json_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    def print_summary(self, count=5, file=sys.stdout):
+        """prints the time per stage, and the slowest documents and pages"""
+        stages = dict(self.times.stages)
+        for record in self.documents.values():
+            for name, seconds in record['stages'].items():
+                stages[name] = stages.get(name, 0) + seconds
+        print('..time per stage: %s' % ', '.join(
+            '%s %.3f s' % (name, seconds) for name, seconds in
+            sorted(stages.items(), key=lambda item: -item[1])), file=file)
+        documents = sorted(self.documents.values(),
+                           key=lambda record: -record['seconds'])[:count]
+        if documents:
+            print('..slowest documents:', file=file)
+        for record in documents:
+            print('  %.3f s %s (%i pages, %i points, %i bytes) %s' % (
+                record['seconds'], record['uuid'], len(record['pages']),
+                record['points'], record['rm_bytes'], record['outfile']),
+                file=file)
+        pages = sorted((page for record in self.documents.values()
+                        for page in record['pages']),
+                       key=lambda page: -page['seconds'])[:count]
+        if pages:
+            print('..slowest pages:', file=file)
+        for page in pages:
+            print('  %.3f s %s (%i points, %i bytes) [%s]' % (
+                page['seconds'], page['page'], page['points'],
+                page['rm_bytes'], ', '.join(
+                    '%s %.3f' % item for item in page['stages'].items())),
+                file=file)
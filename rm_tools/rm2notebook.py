@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+#
+# Script for exporting a whole reMarkable document (all its ".rm" pages,
+# in .content order) as one SVG file, or one self-contained HTML file:
+#
+#   $ rm2notebook.py -i ROOT/<uuid> -o notebook.html
+#
+# Every page is a group, hidden but for the page shown: clicking a page
+# (or the arrow keys, in HTML) goes to the next (previous) one. The pages
+# are parsed and written one at a time, and the definitions they share
+# are written once, before them.
+import os
+import sys
+import json
+import time
+import argparse
+
+try:
+    from . import catalog
+    from . import rm2svg
+except ImportError:
+    import catalog
+    import rm2svg
+
+
+__prog_name__ = "rm2notebook"
+__version__ = "0.0.1"
+
+
+svg_script = '''
+    <script type="application/ecmascript"> <![CDATA[
+        var visiblePage = 'p1';
+        var pageCount = %d;
+        function goToPage(page) {
+            document.getElementById(visiblePage).setAttribute('style', 'display: none');
+            document.getElementById(page).setAttribute('style', 'display: inline');
+            visiblePage = page;
+        }
+        function flipPage(step) {
+            var page = parseInt(visiblePage.substring(1)) + step;
+            if (page >= 1 && page <= pageCount) {
+                goToPage('p' + page);
+            }
+        }
+        document.addEventListener('keydown', function(event) {
+            if (event.key == 'ArrowRight' || event.key == 'PageDown') {
+                flipPage(1);
+            } else if (event.key == 'ArrowLeft' || event.key == 'PageUp') {
+                flipPage(-1);
+            }
+        });
+    ]]>
+    </script>
+'''
+
+svg_defs = '''    <defs>
+        <filter id="blurMe"><feGaussianBlur in="SourceGraphic" stdDeviation="10" /></filter>
+    </defs>
+'''
+
+html_header = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%s</title>
+<style>
+body { margin: 0; background: #888; }
+svg { display: block; margin: 0 auto; background: #fff; max-width: 100%%; height: auto; }
+</style>
+</head>
+<body>
+'''
+
+html_footer = '''
+</body>
+</html>
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=__prog_name__)
+    parser.add_argument("-i",
+                        "--input",
+                        help="document: ROOT/<uuid> (its directory), or ROOT/<uuid>.content",
+                        required=True,
+                        metavar="DOCUMENT",
+                        )
+    parser.add_argument("-o",
+                        "--output",
+                        help="output file (.svg, .svgz, or .html), or - for SVG on stdout",
+                        required=True,
+                        metavar="NAME",
+                        )
+    parser.add_argument("--html",
+                        help="write HTML (the default for .html/.htm outputs)",
+                        action='store_true',
+                        )
+    parser.add_argument("-c",
+                        "--coloured_annotations",
+                        help="Colour annotations for document markup.",
+                        action='store_true',
+                        )
+    parser.add_argument("--width",
+                        help="Desired width of image",
+                        type=int,
+                        default=rm2svg.default_width,
+                        )
+    parser.add_argument("--height",
+                        help="Desired height of image",
+                        type=int,
+                        default=rm2svg.default_height,
+                        )
+    parser.add_argument("--simplify",
+                        help="Drop the points closer than TOLERANCE (page units) to the simplified strokes.",
+                        type=float,
+                        default=0,
+                        metavar="TOLERANCE",
+                        )
+    parser.add_argument("--curves",
+                        help="Draw the strokes as Bezier curves through their points: smoother, but larger (see --simplify).",
+                        action='store_true',
+                        )
+    parser.add_argument("--erase",
+                        help="Remove the erased ink instead of drawing the erasers over it.",
+                        action='store_true',
+                        )
+    parser.add_argument("--palette",
+                        help="Write the stroke styles once, as CSS classes, instead of on every line.",
+                        action='store_true',
+                        )
+    parser.add_argument("--quantize",
+                        help="Round the stroke widths (page units) and opacities to multiples of "
+                             "WIDTH_STEP and OPACITY_STEP, and the colours to COLOUR_LEVELS levels "
+                             "per channel (0: exact), e.g. 0.25,0.05,32.",
+                        type=rm2svg.parse_quantize,
+                        metavar="WIDTH_STEP,OPACITY_STEP,COLOUR_LEVELS",
+                        )
+    parser.add_argument('--version',
+                        action='version',
+                        version='%(prog)s {version}'.format(version=__version__))
+    args = parser.parse_args()
+
+    rootdir, uuid = document_path(args.input)
+    if not os.path.exists(os.path.join(rootdir, uuid + '.content')):
+        parser.error(f'"{args.input}" is not a document (no {uuid}.content)')
+    html = args.html or os.path.splitext(args.output)[1] in ('.html', '.htm')
+    output_name = sys.stdout if args.output == '-' else args.output
+    start = time.perf_counter()
+    npages = rm2notebook(rootdir, uuid, output_name, args.coloured_annotations,
+                         args.width, args.height, html,
+                         rm2svg.RenderOptions(args.simplify, args.curves, args.erase,
+                                              args.palette, args.quantize))
+    elapsed = time.perf_counter() - start
+    if args.output != '-':
+        print(f'{args.output}: {npages} pages, {os.path.getsize(args.output)} bytes '
+              f'in {elapsed:.2f} s')
+
+
+def document_path(name):
+    """returns the (root directory, uuid) of a document directory or file"""
+    name = os.path.normpath(name)
+    uuid = os.path.basename(name).split('.')[0]
+    return os.path.dirname(name), uuid
+
+
+def page_list(rootdir, uuid):
+    """returns the .rm files of the pages of a document, in order"""
+    with open(os.path.join(rootdir, uuid + '.content')) as f:
+        content = json.load(f)
+    return [os.path.join(rootdir, uuid, page_uuid + '.rm')
+            for page_uuid in catalog.content_page_uuids(content)]
+
+
+def document_name(rootdir, uuid):
+    # the visibleName of a document (its uuid without metadata)
+    try:
+        with open(os.path.join(rootdir, uuid + '.metadata')) as f:
+            return json.load(f)['visibleName']
+    except (OSError, ValueError, KeyError):
+        return uuid
+
+
+def rm2notebook(rootdir, uuid, output_name, coloured_annotations=False,
+                width=rm2svg.default_width, height=rm2svg.default_height,
+                html=False, options=None):
+    """
+    writes all the pages of the uuid document of rootdir to output_name
+    (a path or a stream, see rm2svg.open_svg_output), as one SVG (or HTML)
+    file. Returns the number of pages
+    """
+    if coloured_annotations:
+        rm2svg.set_coloured_annots()
+    if options is None:
+        options = rm2svg.default_options
+    transform = rm2svg.ViewTransform(width, height)
+    pagerm_list = page_list(rootdir, uuid)
+    output = rm2svg.open_svg_output(output_name)
+    try:
+        if html:
+            name = document_name(rootdir, uuid)
+            output.write(html_header % name.replace('&', '&amp;').replace('<', '&lt;'))
+        output.write(f'<svg xmlns="http://www.w3.org/2000/svg" height="{height}" width="{width}" '
+                     f'viewBox="0 0 {width} {height}">'
+                     + svg_script % len(pagerm_list) + svg_defs)
+        for number, pagerm in enumerate(pagerm_list, 1):
+            display = 'inline' if number == 1 else 'none'
+            output.write(f'    <g id="p{number}" style="display:{display}">\n')
+            # blank pages have no .rm file
+            if os.path.exists(pagerm):
+                with rm2svg.RmPage.open(pagerm, coloured_annotations) as page:
+                    if options.erase:
+                        page = rm2svg.resolve_erasers(page)
+                    # (the CSS classes of every page have their own names)
+                    rm2svg.write_layers(page, [(output, transform)], options, f'p{number}')
+            output.write('\n'
+                         + '        <!-- clickable rect to flip pages -->\n'
+                         + f'        <rect x="0" y="0" width="{width}" height="{height}" '
+                         + 'fill-opacity="0" onclick="flipPage(1)"/>\n'
+                         + '    </g>\n')
+        output.write('</svg>')
+        if html:
+            output.write(html_footer)
+    finally:
+        output.close()
+    return len(pagerm_list)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+#
+# Script for converting reMarkable tablet ".rm" files to a (vector) PDF
+# document, one page per ".rm" file, without going through SVG.
+# The strokes are styled with the same Pen classes as rm2svg, and written
+# as PDF path operators.
+import sys
+import zlib
+import os.path
+import argparse
+
+import numpy as np
+
+try:
+    from . import rm2svg
+except ImportError:
+    import rm2svg
+
+
+__prog_name__ = "rm2pdf"
+__version__ = "0.0.1"
+
+
+# PDF units (points) per SVG pixel (Inkscape exports SVGs at 96 dpi)
+pt_per_px = 72 / 96
+
+# PDF line cap styles
+line_cap = {
+    'butt': 0,
+    'round': 1,
+    'square': 2,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=__prog_name__)
+    parser.add_argument('--height',
+                        help='Desired height of the pages',
+                        type=float,
+                        default=rm2svg.default_height)
+    parser.add_argument('--width',
+                        help='Desired width of the pages',
+                        type=float,
+                        default=rm2svg.default_width)
+    parser.add_argument("-i",
+                        "--input",
+                        help=".rm input files (one per page)",
+                        required=True,
+                        nargs='+',
+                        metavar="FILENAME",
+                        )
+    parser.add_argument("-o",
+                        "--output",
+                        help="output PDF file (- for stdout)",
+                        required=True,
+                        metavar="NAME",
+                        )
+    parser.add_argument("-c",
+                        "--coloured_annotations",
+                        help="Colour annotations for document markup.",
+                        action='store_true',
+                        )
+    parser.add_argument("--simplify",
+                        help="Drop the points closer than TOLERANCE (page units) to the simplified strokes.",
+                        type=float,
+                        default=0,
+                        metavar="TOLERANCE",
+                        )
+    parser.add_argument("--curves",
+                        help="Draw the strokes as Bezier curves through their points: smoother, but larger (see --simplify).",
+                        action='store_true',
+                        )
+    parser.add_argument("--erase",
+                        help="Remove the erased ink instead of drawing the erasers over it.",
+                        action='store_true',
+                        )
+    parser.add_argument("--quantize",
+                        help="Round the stroke widths (page units) and opacities to multiples of "
+                             "WIDTH_STEP and OPACITY_STEP, and the colours to COLOUR_LEVELS levels "
+                             "per channel (0: exact), e.g. 0.25,0.05,32.",
+                        type=rm2svg.parse_quantize,
+                        metavar="WIDTH_STEP,OPACITY_STEP,COLOUR_LEVELS",
+                        )
+    parser.add_argument('--version',
+                        action='version',
+                        version='%(prog)s {version}'.format(version=__version__))
+    args = parser.parse_args()
+
+    for input_file in args.input:
+        if not os.path.exists(input_file):
+            parser.error(f'The file "{input_file}" does not exist!')
+    output = sys.stdout.buffer if args.output == '-' else args.output
+    rm2pdf(args.input, output, args.coloured_annotations,
+           args.width, args.height, rm2svg.RenderOptions(args.simplify, args.curves, args.erase,
+                                                            quantize=args.quantize))
+
+
+class PdfPage():
+    """A rendered page: its size (in points) and its content stream."""
+    __slots__ = ('width', 'height', 'content', 'opacities')
+
+    def __init__(self, width, height, content, opacities):
+        self.width = width
+        self.height = height
+        # (uncompressed) content stream
+        self.content = content
+        # the opacities used in the content stream: opacity o is set with
+        # the graphics state named by opacity_name(o)
+        self.opacities = opacities
+
+
+def opacity_name(opacity):
+    return 'GS' + ('%.3f' % opacity).replace('.', '_')
+
+
+def render_page(page, transform, options=None):
+    """renders a parsed page (see rm2svg.parse_rm_input) into a PdfPage"""
+    if options is None:
+        options = rm2svg.default_options
+    if options.erase:
+        page = rm2svg.resolve_erasers(page)
+    opacities = set()
+    # draw in (flipped) SVG pixel coordinates
+    parts = ['%.4f 0 0 %.4f 0 %.4f cm 1 j\n' % (pt_per_px, -pt_per_px, transform.height * pt_per_px)]
+    for layer in page.layers:
+        for stroke, runs, index in rm2svg.layer_runs(layer.strokes, options, [transform.scale]):
+            parts.extend(pdf_stroke(stroke, runs, transform, opacities, options, index))
+    return PdfPage(transform.width * pt_per_px, transform.height * pt_per_px,
+                   ''.join(parts).encode('ascii'), opacities)
+
+
+def pdf_stroke(stroke, runs, transform, opacities, options=rm2svg.default_options, index=None):
+    """
+    returns the path operators drawing a stroke, as a list of strings
+    (index: the points to draw, see rm2svg.stroke_points)
+    """
+    xpos, ypos, index = rm2svg.stroke_points(stroke, runs, transform, options, index)
+    if not options.curves:
+        # format all the points of the stroke in one pass
+        points = (('%.3f %.3f ' * len(xpos)) % tuple(np.column_stack((xpos, ypos)).ravel().tolist())).split()
+    cap = line_cap[stroke.pen.stroke_cap]
+    parts = []
+    for (first, last, color, segment_width, segment_opacity), run in zip(
+            runs, rm2svg.run_slices(runs, index)):
+        # like SVG: clamp the opacity, and a single point draws nothing
+        segment_opacity = min(max(segment_opacity, 0), 1)
+        if segment_opacity == 0 or run.stop - run.start < 2:
+            continue
+        segment_opacity = round(segment_opacity, 3)
+        if segment_opacity != 1:
+            opacities.add(segment_opacity)
+            parts.append(f'q /{opacity_name(segment_opacity)} gs\n')
+        parts.append('%.3f %.3f %.3f RG %.3f w %d J\n' % (
+            color[0] / 255, color[1] / 255, color[2] / 255, segment_width * transform.scale, cap))
+        if options.curves:
+            run_x, run_y = xpos[run], ypos[run]
+            curves = rm2svg.bezier_controls(run_x, run_y)
+            parts.append('%.3f %.3f m\n' % (run_x[0], run_y[0]))
+            parts.append(('%.3f %.3f %.3f %.3f %.3f %.3f c\n' * len(curves)) % tuple(curves.ravel().tolist()))
+            parts.append('S\n')
+        else:
+            run_points = points[2 * run.start:2 * run.stop]
+            parts.append(f'{run_points[0]} {run_points[1]} m\n')
+            parts.append(' l\n'.join(' '.join(run_points[i:i + 2]) for i in range(2, len(run_points), 2)))
+            parts.append(' l\nS\n')
+        if segment_opacity != 1:
+            parts.append('Q\n')
+    return parts
+
+
+class PdfWriter():
+    """
+    Writes PdfPages to a PDF file as they come: every page is written out
+    (and can be forgotten) when it is added, only the page references are
+    kept until the document is closed.
+    """
+    def __init__(self, output):
+        # output is a path or a writable binary file-like object
+        if isinstance(output, (str, bytes, os.PathLike)):
+            self.output = open(output, 'wb')
+            self.own_output = True
+            self.path = output
+        else:
+            self.output = output
+            self.own_output = False
+            self.path = None
+        self.position = 0
+        # object number -> byte offset; objects 1 and 2 are the catalog
+        # and the page tree, written last
+        self.offsets = {}
+        self.next_object = 3
+        self.page_objects = []
+        self.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def write(self, data):
+        self.output.write(data)
+        self.position += len(data)
+
+    def write_object(self, number, body):
+        self.offsets[number] = self.position
+        self.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+    def new_object(self):
+        number = self.next_object
+        self.next_object += 1
+        return number
+
+    def add_page(self, pdf_page):
+        page_object = self.new_object()
+        content_object = self.new_object()
+        stream = zlib.compress(pdf_page.content)
+        self.write_object(content_object,
+                          b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream)
+                          + stream + b'\nendstream')
+        gstates = ''.join(f'/{opacity_name(opacity)} << /Type /ExtGState /CA {opacity:.3f} /ca {opacity:.3f} >> '
+                          for opacity in sorted(pdf_page.opacities))
+        self.write_object(page_object, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {pdf_page.width:.3f} {pdf_page.height:.3f}] '
+            f'/Resources << /ExtGState << {gstates}>> >> /Contents {content_object} 0 R >>').encode('ascii'))
+        self.page_objects.append(page_object)
+
+    def close(self):
+        kids = ' '.join(f'{number} 0 R' for number in self.page_objects)
+        self.write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        self.write_object(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_objects)} >>'.encode('ascii'))
+        xref = self.position
+        entries = [b'0000000000 65535 f \n']
+        entries += [b'%010d 00000 n \n' % self.offsets[number] for number in range(1, self.next_object)]
+        self.write(b'xref\n0 %d\n' % self.next_object + b''.join(entries))
+        self.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (self.next_object, xref))
+        if self.own_output:
+            self.output.close()
+
+    def abort(self):
+        # no trailer: a partial document must not look like a valid one
+        if self.own_output:
+            self.output.close()
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def rm2pdf(input_files, output_name, coloured_annotations=False,
+           width=rm2svg.default_width, height=rm2svg.default_height, options=None):
+    """
+    converts the .rm files in input_files (paths, bytes or binary file
+    objects) into the pages of one PDF, written to output_name (a path or
+    a writable binary stream)
+    """
+    with PdfWriter(output_name) as writer:
+        for input_file in input_files:
+            writer.add_page(render_file(input_file, coloured_annotations, width, height, options))
+
+
+def render_file(input_file, coloured_annotations=False,
+                width=rm2svg.default_width, height=rm2svg.default_height, options=None):
+    """renders one .rm file (a path, bytes or a file object) into a PdfPage"""
+    if coloured_annotations:
+        rm2svg.set_coloured_annots()
+
+    with rm2svg.RmPage.open(input_file, coloured_annotations) as page:
+        return render_page(page, rm2svg.ViewTransform(width, height), options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+#
+# Script for converting reMarkable tablet ".rm" files to PNG images.
+# The strokes are styled with the same Pen classes as rm2svg, and drawn
+# into a NumPy pixel buffer (anti-aliased, variable width, with the pen
+# opacities). The PNG file is written with zlib only.
+import zlib
+import struct
+import os.path
+import argparse
+
+import numpy as np
+
+try:
+    from . import rm2svg
+except ImportError:
+    import rm2svg
+
+
+__prog_name__ = "rm2png"
+__version__ = "0.0.1"
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=__prog_name__)
+    parser.add_argument('--height',
+                        help='Desired height of image',
+                        type=float,
+                        default=rm2svg.default_height)
+    parser.add_argument('--width',
+                        help='Desired width of image',
+                        type=float,
+                        default=rm2svg.default_width)
+    parser.add_argument('--scale',
+                        help='Scale the image (e.g. 0.2 for a thumbnail)',
+                        type=float,
+                        default=1)
+    parser.add_argument("-i",
+                        "--input",
+                        help=".rm input file",
+                        required=True,
+                        metavar="FILENAME",
+                        )
+    parser.add_argument("-o",
+                        "--output",
+                        help="output PNG file",
+                        required=True,
+                        metavar="NAME",
+                        )
+    parser.add_argument("-c",
+                        "--coloured_annotations",
+                        help="Colour annotations for document markup.",
+                        action='store_true',
+                        )
+    parser.add_argument("--simplify",
+                        help="Drop the points closer than TOLERANCE (page units) to the simplified strokes.",
+                        type=float,
+                        default=0,
+                        metavar="TOLERANCE",
+                        )
+    parser.add_argument("--curves",
+                        help="Draw the strokes as Bezier curves through their points.",
+                        action='store_true',
+                        )
+    parser.add_argument("--erase",
+                        help="Remove the erased ink instead of drawing the erasers over it.",
+                        action='store_true',
+                        )
+    parser.add_argument("--quantize",
+                        help="Round the stroke widths (page units) and opacities to multiples of "
+                             "WIDTH_STEP and OPACITY_STEP, and the colours to COLOUR_LEVELS levels "
+                             "per channel (0: exact), e.g. 0.25,0.05,32.",
+                        type=rm2svg.parse_quantize,
+                        metavar="WIDTH_STEP,OPACITY_STEP,COLOUR_LEVELS",
+                        )
+    parser.add_argument('--version',
+                        action='version',
+                        version='%(prog)s {version}'.format(version=__version__))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        parser.error(f'The file "{args.input}" does not exist!')
+    rm2png(args.input, args.output, args.coloured_annotations,
+           args.width, args.height, args.scale,
+           rm2svg.RenderOptions(args.simplify, args.curves, args.erase,
+                                quantize=args.quantize))
+
+
+def render_page(page, transform, options=None):
+    """
+    renders a parsed page into an (height, width, 3) uint8 RGB array, as
+    options (a rm2svg.RenderOptions) say
+    """
+    if options is None:
+        options = rm2svg.default_options
+    if options.erase:
+        page = rm2svg.resolve_erasers(page)
+    height = max(int(round(transform.height)), 1)
+    width = max(int(round(transform.width)), 1)
+    # work in [0, 1] floats, on a white page
+    canvas = np.ones((height, width, 3), dtype=np.float32)
+    for layer in page.layers:
+        for stroke, runs, index in rm2svg.layer_runs(layer.strokes, options, [transform.scale]):
+            xpos, ypos, index = rm2svg.stroke_points(stroke, runs, transform, options, index)
+            for (first, last, color, segment_width, segment_opacity), run in zip(
+                    runs, rm2svg.run_slices(runs, index)):
+                run_x, run_y = xpos[run], ypos[run]
+                if options.curves:
+                    run_x, run_y = curve_points(run_x, run_y)
+                draw_polyline(canvas, run_x, run_y,
+                              np.array(color, dtype=np.float32) / 255,
+                              segment_width * transform.scale, segment_opacity,
+                              stroke.pen.stroke_cap)
+    return np.round(canvas * 255).astype(np.uint8)
+
+
+def curve_points(xpos, ypos, steps=8):
+    """
+    returns the points of the curve through xpos, ypos (see
+    rm2svg.bezier_controls), steps points per Bezier segment
+    """
+    if len(xpos) < 3:
+        return xpos, ypos
+    curves = rm2svg.bezier_controls(xpos, ypos)
+    t = np.arange(1, steps + 1) / steps
+    a, b, c, d = (1 - t) ** 3, 3 * (1 - t) ** 2 * t, 3 * (1 - t) * t ** 2, t ** 3
+    x = (np.outer(xpos[:-1], a) + np.outer(curves[:, 0], b) +
+         np.outer(curves[:, 2], c) + np.outer(curves[:, 4], d))
+    y = (np.outer(ypos[:-1], a) + np.outer(curves[:, 1], b) +
+         np.outer(curves[:, 3], c) + np.outer(curves[:, 5], d))
+    return np.concatenate((xpos[:1], x.ravel())), np.concatenate((ypos[:1], y.ravel()))
+
+
+def draw_polyline(canvas, xpos, ypos, color, width, opacity, cap):
+    """
+    composites one polyline of the given (0-1 rgb) color, width and
+    opacity onto canvas. Like an SVG polyline, the line is covered once
+    (overlapping parts do not get darker) and a single point draws nothing.
+    """
+    opacity = min(max(opacity, 0), 1)
+    if opacity == 0 or len(xpos) < 2:
+        return
+    # keep hairlines visible
+    radius = max(width, 1) / 2
+    x0, y0, x1, y1 = xpos[:-1], ypos[:-1], xpos[1:], ypos[1:]
+    if cap == 'square':
+        # extend both ends by half the width
+        x0, y0, x1, y1 = x0.copy(), y0.copy(), x1.copy(), y1.copy()
+        for xa, ya, xb, yb, i in ((x0, y0, x1, y1, 0), (x1, y1, x0, y0, -1)):
+            dx, dy = xa[i] - xb[i], ya[i] - yb[i]
+            length = np.hypot(dx, dy)
+            if length > 0:
+                xa[i] += dx / length * radius
+                ya[i] += dy / length * radius
+
+    # split the segments into pieces no longer than step, so every piece
+    # fits in a fixed size window
+    step = max(radius, 1.)
+    lengths = np.hypot(x1 - x0, y1 - y0)
+    npieces = np.maximum(np.ceil(lengths / step).astype(np.int64), 1)
+    index = np.repeat(np.arange(len(x0)), npieces)
+    piece = np.arange(len(index)) - np.repeat(np.cumsum(npieces) - npieces, npieces)
+    t0 = piece / npieces[index]
+    t1 = (piece + 1) / npieces[index]
+    dx, dy = (x1 - x0)[index], (y1 - y0)[index]
+    ax, ay = x0[index] + t0 * dx, y0[index] + t0 * dy
+    bx, by = x0[index] + t1 * dx, y0[index] + t1 * dy
+
+    # bounding box of the whole polyline, in pixels
+    height, width = canvas.shape[:2]
+    left = max(int(np.floor(min(ax.min(), bx.min()) - radius - 1)), 0)
+    top = max(int(np.floor(min(ay.min(), by.min()) - radius - 1)), 0)
+    right = min(int(np.ceil(max(ax.max(), bx.max()) + radius + 1)), width)
+    bottom = min(int(np.ceil(max(ay.max(), by.max()) + radius + 1)), height)
+    if left >= right or top >= bottom:
+        return
+    coverage = np.zeros((bottom - top, right - left), dtype=np.float32)
+
+    # pixel centers of a window around every piece (in batches, to bound
+    # the memory used)
+    size = int(np.ceil(step + 2 * radius + 2)) + 1
+    offsets = np.arange(size)
+    batch = max(1, 250000 // (size * size))
+    for start in range(0, len(ax), batch):
+        draw_pieces(coverage, left, top, right, bottom, radius, offsets,
+                    ax[start:start + batch], ay[start:start + batch],
+                    bx[start:start + batch], by[start:start + batch])
+
+    alpha = (coverage * opacity)[:, :, np.newaxis]
+    region = canvas[top:bottom, left:right]
+    region *= 1 - alpha
+    region += alpha * color
+
+
+def draw_pieces(coverage, left, top, right, bottom, radius, offsets, ax, ay, bx, by):
+    """adds the coverage of the line pieces a-b to coverage (which starts at left, top)"""
+    wx = np.floor(np.minimum(ax, bx) - radius - 1).astype(np.int64)
+    wy = np.floor(np.minimum(ay, by) - radius - 1).astype(np.int64)
+    px = (wx[:, np.newaxis] + offsets)[:, np.newaxis, :]
+    py = (wy[:, np.newaxis] + offsets)[:, :, np.newaxis]
+    # distance from the pixel centers to each piece
+    sx, sy = (bx - ax)[:, np.newaxis, np.newaxis], (by - ay)[:, np.newaxis, np.newaxis]
+    rx, ry = px + 0.5 - ax[:, np.newaxis, np.newaxis], py + 0.5 - ay[:, np.newaxis, np.newaxis]
+    length2 = sx * sx + sy * sy
+    t = np.clip((rx * sx + ry * sy) / np.where(length2 > 0, length2, 1), 0, 1)
+    distance = np.hypot(rx - t * sx, ry - t * sy)
+    # anti-aliased edge: one pixel wide ramp around the line border
+    piece_coverage = np.clip(radius + 0.5 - distance, 0, 1).astype(np.float32)
+
+    px, py = np.broadcast_arrays(px, py)
+    inside = (px >= left) & (px < right) & (py >= top) & (py < bottom) & (piece_coverage > 0)
+    np.maximum.at(coverage, (py[inside] - top, px[inside] - left), piece_coverage[inside])
+
+
+def write_png(output, image):
+    """writes an (height, width, 3) uint8 RGB array as a PNG file (path or binary file-like)"""
+    height, width = image.shape[:2]
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    # every row starts with its filter type (0: none)
+    rows = np.zeros((height, 1 + width * 3), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, width * 3)
+    data = (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows.tobytes(), 6))
+            + chunk(b'IEND', b''))
+    if isinstance(output, (str, bytes, os.PathLike)):
+        with open(output, 'wb') as f:
+            f.write(data)
+    else:
+        output.write(data)
+
+
+def rm2png(input_file, output_name, coloured_annotations=False,
+           width=rm2svg.default_width, height=rm2svg.default_height, scale=1,
+           options=None):
+
+    if coloured_annotations:
+        rm2svg.set_coloured_annots()
+
+    transform = rm2svg.ViewTransform(width * scale, height * scale)
+    with rm2svg.RmPage.open(input_file, coloured_annotations) as page:
+        write_png(output_name, render_page(page, transform, options))
+
+
+if __name__ == "__main__":
+    main()
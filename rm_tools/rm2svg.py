@@ -4,10 +4,23 @@
 # this works for the new *.rm format, where each page is a seperate file
 # credit for updating to version 5 rm files goes to
 # https://github.com/peerdavid/rmapi/blob/master/tools/rM2svg
+import io
 import sys
+import glob
+import gzip
+import mmap
+import time
 import struct
 import os.path
 import argparse
+import concurrent.futures
+
+import numpy as np
+
+try:
+    from . import lines_v6
+except ImportError:
+    import lines_v6
 
 
 __prog_name__ = "rm2svg"
@@ -18,6 +31,11 @@ __version__ = "0.0.2"
 default_width = 1404
 default_height = 1872
 
+# Headers
+expected_header_v3 = b'reMarkable .lines file, version=3          '
+expected_header_v5 = b'reMarkable .lines file, version=5          '
+expected_header_v6 = lines_v6.header_v6
+
 # Mappings
 stroke_colour = {
     0: [0, 0, 0],
@@ -26,7 +44,34 @@ stroke_colour = {
     # XXX: fix me
     # https://www.color-name.com/highlighter-yellow.color
     3: [251, 247, 25],
+    4: [0, 255, 0],
 }
+# version=6 colours (pink, blue, red, gray overlap, and the highlighter and
+# shader colours of the later firmwares), whatever the annotation colours
+v6_colours = {
+    5: [255, 192, 203],
+    6: [78, 105, 201],
+    7: [179, 62, 57],
+    8: [125, 125, 125],
+    9: [255, 235, 147],
+    10: [161, 216, 125],
+    11: [139, 208, 229],
+    12: [183, 130, 205],
+    13: [247, 232, 81],
+}
+stroke_colour.update(v6_colours)
+
+
+# Point records, as stored in v3/v5 files: one block of nsegments records
+# per stroke, each 6 little-endian float32 values (24 bytes)
+segment_dtype = np.dtype([
+    ('xpos', '<f4'),
+    ('ypos', '<f4'),
+    ('speed', '<f4'),
+    ('tilt', '<f4'),
+    ('width', '<f4'),
+    ('pressure', '<f4'),
+])
 
 
 '''stroke_width={
@@ -48,34 +93,231 @@ def main():
                         default=default_width)
     parser.add_argument("-i",
                         "--input",
-                        help=".rm input file",
+                        help=".rm input files, directories (all the .rm files under them) or "
+                             "globs (- for stdin)",
                         required=True,
+                        nargs='+',
                         metavar="FILENAME",
                         # type=argparse.FileType('r')
                         )
     parser.add_argument("-o",
                         "--output",
-                        help="prefix for output files",
-                        required=True,
+                        help="output SVG file, for a single input (- for stdout)",
                         metavar="NAME",
                         # type=argparse.FileType('w')
                         )
+    parser.add_argument("--outdir",
+                        help="write the SVG files into DIR (see --name)",
+                        metavar="DIR",
+                        )
+    parser.add_argument("--name",
+                        help="output file name template, with {stem} (input file name "
+                             "without .rm), {parent} (its directory name, e.g. the "
+                             "document uuid) and {index} (default: {stem}.svg)",
+                        default='{stem}.svg',
+                        metavar="TEMPLATE",
+                        )
+    parser.add_argument("-j",
+                        "--jobs",
+                        help="convert the files in N processes (default: 1)",
+                        type=int,
+                        default=1,
+                        metavar="N",
+                        )
     parser.add_argument("-c",
                         "--coloured_annotations",
                         help="Colour annotations for document markup.",
                         action='store_true',
                         )
+    parser.add_argument("--rotation",
+                        help="Rotate the page clockwise by ROTATION degrees (90 for landscape pages).",
+                        type=int,
+                        choices=(0, 90, 180, 270),
+                        default=0,
+                        )
+    parser.add_argument("--crop",
+                        help="Only render the X Y WIDTH HEIGHT rectangle of the (rotated) page.",
+                        type=float,
+                        nargs=4,
+                        metavar=('X', 'Y', 'WIDTH', 'HEIGHT'),
+                        )
+    parser.add_argument("--simplify",
+                        help="Drop the points closer than TOLERANCE (page units) to the simplified strokes.",
+                        type=float,
+                        default=0,
+                        metavar="TOLERANCE",
+                        )
+    parser.add_argument("--curves",
+                        help="Write the strokes as Bezier curves (<path>) through their points: smoother, but larger (see --simplify).",
+                        action='store_true',
+                        )
+    parser.add_argument("--erase",
+                        help="Remove the erased ink instead of drawing the erasers over it.",
+                        action='store_true',
+                        )
+    parser.add_argument("--palette",
+                        help="Write the stroke styles once, as CSS classes, instead of on every line.",
+                        action='store_true',
+                        )
+    parser.add_argument("--quantize",
+                        help="Round the stroke widths (page units) and opacities to multiples of "
+                             "WIDTH_STEP and OPACITY_STEP, and the colours to COLOUR_LEVELS levels "
+                             "per channel (0: exact), e.g. 0.25,0.05,32.",
+                        type=parse_quantize,
+                        metavar="WIDTH_STEP,OPACITY_STEP,COLOUR_LEVELS",
+                        )
+    parser.add_argument("--stats",
+                        help="Print the stroke/point counts and memory use of the parsed page.",
+                        action='store_true',
+                        )
     parser.add_argument('--version',
                         action='version',
                         version='%(prog)s {version}'.format(version=__version__))
     args = parser.parse_args()
 
-    if not os.path.exists(args.input):
-        parser.error(f'The file "{args.input}" does not exist!')
-    if args.coloured_annotations:
+    input_files = []
+    for name in args.input:
+        found = expand_input(name)
+        if not found:
+            parser.error(f'The file "{name}" does not exist!')
+        input_files.extend(found)
+    if (args.output is None) == (args.outdir is None):
+        parser.error('give either -o (a single input) or --outdir')
+    if args.output is not None and len(input_files) > 1:
+        parser.error(f'{len(input_files)} input files: use --outdir')
+    if '-' in input_files and args.output is None:
+        parser.error('stdin (-) needs -o')
+    if args.output is not None:
+        outputs = [args.output]
+    else:
+        outputs = [os.path.join(args.outdir, output_file_name(args.name, input_file, index))
+                   for index, input_file in enumerate(input_files)]
+        seen = set()
+        for name in outputs:
+            if name in seen:
+                parser.error(f'--name "{args.name}" gives the same name to several inputs: '
+                             f'{name}')
+            seen.add(name)
+        # the template may put the files in subdirectories
+        for dirname in sorted({os.path.dirname(name) for name in outputs}):
+            os.makedirs(dirname, exist_ok=True)
+
+    transform = ViewTransform(args.width, args.height, args.crop, args.rotation)
+    options = RenderOptions(args.simplify, args.curves, args.erase, args.palette, args.quantize)
+    # the summary and stats go to stderr when the SVG goes to stdout
+    log = sys.stderr if args.output == '-' else sys.stdout
+    start = time.perf_counter()
+    nbytes = 0
+    failed = 0
+    for input_file, output, result, error in convert_batch(
+            input_files, outputs, args.coloured_annotations, args.width, args.height,
+            transform, options, args.stats, args.jobs):
+        if error is not None:
+            failed += 1
+            # abort() already printed why
+            reason = 'invalid file' if isinstance(error, SystemExit) else error
+            print(f'error: {input_file}: {reason}', file=sys.stderr)
+            continue
+        size, usage = result
+        nbytes += size
+        if usage is not None:
+            print(f'{input_file}: {usage["strokes"]} strokes, {usage["points"]} points, '
+                  f'{usage["pens"]} pens, model {usage["model_bytes"]} bytes, '
+                  f'segments {usage["segment_bytes"]} bytes '
+                  f'({(usage["model_bytes"] + usage["segment_bytes"]) / max(usage["points"], 1):.1f} bytes/point)',
+                  file=log)
+    elapsed = time.perf_counter() - start
+    if len(input_files) > 1:
+        npages = len(input_files) - failed
+        print(f'{npages} pages in {elapsed:.2f} s ({npages / elapsed if elapsed > 0 else 0:.1f} pages/s), '
+              f'{nbytes} bytes written, {failed} failed', file=log)
+    if failed:
+        sys.exit(1)
+
+
+def expand_input(name):
+    """the .rm files of an input argument: a file, a directory or a glob"""
+    if name == '-' or os.path.isfile(name):
+        return [name]
+    if os.path.isdir(name):
+        return sorted(glob.glob(os.path.join(glob.escape(name), '**', '*.rm'), recursive=True))
+    return sorted(path for path in glob.glob(name, recursive=True) if os.path.isfile(path))
+
+
+def output_file_name(template, input_file, index):
+    """the output file name of an input (see --name)"""
+    stem = os.path.basename(input_file)
+    if stem.endswith('.rm'):
+        stem = stem[:-len('.rm')]
+    parent = os.path.basename(os.path.dirname(os.path.abspath(input_file)))
+    return template.format(stem=stem, parent=parent, index=index)
+
+
+def convert_one(input_file, output_name, coloured_annotations, width, height, transform,
+                options, stats):
+    """
+    converts one file (the unit of work of a batch). Returns the number of
+    bytes written, and the page memory usage (if stats)
+    """
+    if coloured_annotations:
         set_coloured_annots()
-    rm2svg(args.input, args.output, args.coloured_annotations,
-           args.width, args.height)
+    # stdin is read at once, as it cannot be mapped
+    source = sys.stdin.buffer.read() if input_file == '-' else input_file
+    if output_name == '-':
+        output = CountingOutput(sys.stdout.buffer)
+    else:
+        output = output_name
+    with RmPage.open(source, coloured_annotations) as page:
+        convert_to_svg(page, output, width, height, transform, options)
+        usage = page.memory_usage() if stats else None
+    size = output.count if output_name == '-' else os.path.getsize(output_name)
+    return size, usage
+
+
+def convert_batch(input_files, outputs, coloured_annotations, width, height, transform,
+                  options, stats, jobs):
+    """
+    converts input_files into outputs, in jobs processes. Yields
+    (input_file, output, (size, usage), error) as the files are done.
+    """
+    task_list = [(input_file, output, coloured_annotations, width, height, transform,
+                  options, stats) for input_file, output in zip(input_files, outputs)]
+    if jobs <= 1 or len(task_list) <= 1:
+        for args in task_list:
+            try:
+                yield args[0], args[1], convert_one(*args), None
+            except (Exception, SystemExit) as e:
+                # abort() exits on invalid files
+                yield args[0], args[1], None, e
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        future_list = {executor.submit(convert_one, *args): args for args in task_list}
+        for future in concurrent.futures.as_completed(future_list):
+            args = future_list.pop(future)
+            try:
+                yield args[0], args[1], future.result(), None
+            except (Exception, SystemExit) as e:
+                yield args[0], args[1], None, e
+
+
+class CountingOutput(io.RawIOBase):
+    """A binary stream wrapper counting the bytes written."""
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+        self.count = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.count += len(data)
+        self.stream.write(data)
+        return len(data)
+
+    def flush(self):
+        self.stream.flush()
 
 
 def set_coloured_annots():
@@ -85,76 +327,356 @@ def set_coloured_annots():
         1: [255, 0, 0],
         2: [255, 255, 255],
         3: [150, 0, 0],
-        4: [0, 0, 125]
+        4: [0, 0, 125],
+        **v6_colours,
     }
 
 
+def colour_rgb(colour):
+    # the [r, g, b] of a colour number (black for the unknown ones)
+    return stroke_colour.get(colour, stroke_colour[0])
+
+
 def abort(msg):
     print(msg, file=sys.stderr)
     sys.exit(1)
 
 
-class Segment():
-    def __init__(self, _id, xpos, ypos, speed, tilt, width, pressure):
-        self.id = _id
-        self.xpos = xpos
-        self.ypos = ypos
-        self.speed = speed
-        self.tilt = tilt
-        self.width = width
-        self.pressure = pressure
-
-
 class Stroke():
-    def __init__(self, _id, pen, color, width, opacity):
+    __slots__ = ('id', 'pen', 'color', 'width', 'opacity',
+                 'data', 'offset', 'nsegments', '_segments')
+
+    def __init__(self, _id, pen, color, width, opacity, data, offset, nsegments,
+                 segments=None):
         self.id = _id
         self.pen = pen
         self.color = color
         self.width = width
         self.opacity = opacity
-        self.segments = []
+        # where the stroke's block of segments lives in the page data
+        self.data = data
+        self.offset = offset
+        self.nsegments = nsegments
+        # already decoded segments (version=6 points), if any
+        self._segments = segments
 
-    def append_segment(self, segment):
-        self.segments.append(segment)
+    @property
+    def segments(self):
+        # columnar point data (a segment_dtype array), decoded on first use
+        if self._segments is None and self.data is not None:
+            self._segments = read_segments(self.data, self.offset, self.nsegments)
+        return self._segments
 
 
 class Layer():
+    __slots__ = ('id', 'strokes')
+
     def __init__(self, _id):
         self.id = _id
         self.strokes = []
-        pass
 
     def append_stroke(self, stroke):
         self.strokes.append(stroke)
 
 
 class Page():
+    __slots__ = ('layers',)
+
     def __init__(self):
         self.layers = []
-        pass
 
     def append_layer(self, layer):
         self.layers.append(layer)
 
+    def stroke_count(self):
+        return sum(len(layer.strokes) for layer in self.layers)
+
+    def pen_usage(self):
+        """returns {pen name: number of strokes} (only needs the headers)"""
+        usage = {}
+        for layer in self.layers:
+            for stroke in layer.strokes:
+                usage[stroke.pen.name] = usage.get(stroke.pen.name, 0) + 1
+        return usage
+
+    def memory_usage(self):
+        """
+        returns an estimate of the bytes used by the page model: the
+        layer/stroke records and (shared) pens, and the segment data
+        """
+        model = sys.getsizeof(self) + sys.getsizeof(self.layers)
+        pens = {}
+        npoints = 0
+        for layer in self.layers:
+            model += sys.getsizeof(layer) + sys.getsizeof(layer.strokes)
+            for stroke in layer.strokes:
+                model += sys.getsizeof(stroke)
+                pens[id(stroke.pen)] = stroke.pen
+                npoints += stroke.nsegments
+        for pen in pens.values():
+            model += sys.getsizeof(pen) + sys.getsizeof(pen.__dict__)
+        return {
+            'strokes': self.stroke_count(),
+            'points': npoints,
+            'pens': len(pens),
+            'model_bytes': model,
+            'segment_bytes': npoints * segment_dtype.itemsize,
+        }
+
+
+class RmPage(Page):
+    """
+    A page backed by a memory-mapped .rm file.
+
+    Opening the page only walks the layer and stroke headers; the segments
+    of a stroke are read from the mapping when stroke.segments is used.
+    """
+    __slots__ = ('path', 'mm')
+
+    def __init__(self):
+        super().__init__()
+        self.path = None
+        self.mm = None
+
+    @classmethod
+    def open(cls, source, coloured_annotations=False):
+        """
+        opens a page from source: a path, the bytes of a .rm file, or a
+        binary file object (memory-mapped if it is a whole real file,
+        read otherwise)
+        """
+        page = cls()
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data = source
+        elif isinstance(source, (str, os.PathLike)):
+            page.path = source
+            with open(source, 'rb') as f:
+                data = page.map_file(f)
+        else:
+            data = page.map_file(source)
+        if len(data) < len(expected_header_v5):
+            abort('File too short to be a valid file')
+        parse_rm_data(data, coloured_annotations, page)
+        return page
+
+    def map_file(self, f):
+        # the data of a binary file object: mapped if possible
+        try:
+            fileno = f.fileno()
+            mappable = f.tell() == 0 and os.fstat(fileno).st_size > 0
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            mappable = False
+        if not mappable:
+            return f.read()
+        self.mm = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        return self.mm
+
+    def close(self):
+        if self.mm is None:
+            return
+        for layer in self.layers:
+            for stroke in layer.strokes:
+                if stroke.data is not None:
+                    stroke._segments = None
+        try:
+            self.mm.close()
+        except BufferError:
+            # segment arrays are still referenced somewhere: leave the
+            # mapping to the garbage collector
+            pass
+        self.mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ViewTransform():
+    """
+    Maps page coordinates (a default_width x default_height portrait page)
+    to the coordinates of a width x height output, without touching the
+    parsed page.
+
+    The page is first rotated clockwise by rotation degrees (90 or 270 for
+    landscape pages), then crop, an (x, y, width, height) rectangle of the
+    rotated page (the whole page by default), is scaled to fill the output
+    and moved by offset.
+    """
+    __slots__ = ('width', 'height', 'scale', 'matrix')
+
+    def __init__(self, width=default_width, height=default_height,
+                 crop=None, rotation=0, offset=(0, 0)):
+        rotation = rotation % 360
+        if rotation not in (0, 90, 180, 270):
+            raise ValueError(f'rotation must be a multiple of 90 degrees: {rotation}')
+        self.width = width
+        self.height = height
+        # rotation as a (a, b, c, d, e, f) matrix, x' = a*x + c*y + e and
+        # y' = b*x + d*y + f, keeping the rotated page at the origin
+        a, b, c, d, e, f = {
+            0: (1, 0, 0, 1, 0, 0),
+            90: (0, 1, -1, 0, default_height, 0),
+            180: (-1, 0, 0, -1, default_width, default_height),
+            270: (0, -1, 1, 0, 0, default_width),
+        }[rotation]
+        if crop is None:
+            if rotation in (0, 180):
+                crop = (0, 0, default_width, default_height)
+            else:
+                crop = (0, 0, default_height, default_width)
+        crop_x, crop_y, crop_width, crop_height = crop
+        # fill the output (the same rule as the original ratio code)
+        self.scale = max(width / crop_width, height / crop_height)
+        s = self.scale
+        self.matrix = (s * a, s * b, s * c, s * d,
+                       s * (e - crop_x) + offset[0], s * (f - crop_y) + offset[1])
+
+    def apply(self, xpos, ypos):
+        """returns the transformed (x, y) arrays, in double precision"""
+        a, b, c, d, e, f = self.matrix
+        xpos = np.asarray(xpos, dtype=np.float64)
+        ypos = np.asarray(ypos, dtype=np.float64)
+        if b == 0 and c == 0:
+            return a * xpos + e, d * ypos + f
+        return a * xpos + c * ypos + e, b * xpos + d * ypos + f
+
+
+class RenderOptions():
+    """
+    How the strokes are written out: simplify is the Ramer-Douglas-Peucker
+    tolerance, in page units (0: every point is written), curves writes
+    cubic Bezier curves through the points instead of polylines (three
+    points per segment instead of one: smoother, but larger), erase
+    removes the erased ink (see resolve_erasers) instead of drawing the
+    erasers over it, palette writes the styles of a page once, as CSS
+    classes (see write_layers), and quantize is None, or the (width step,
+    opacity step, colour levels) the styles are rounded to (see
+    quantize_style).
+    """
+    __slots__ = ('simplify', 'curves', 'erase', 'palette', 'quantize')
+
+    def __init__(self, simplify=0, curves=False, erase=False, palette=False, quantize=None):
+        self.simplify = simplify
+        self.curves = curves
+        self.erase = erase
+        self.palette = palette
+        self.quantize = quantize
+
+    def key(self):
+        """the non-default options, as a string (part of the page cache keys)"""
+        parts = []
+        if self.simplify > 0:
+            parts.append(f'simplify={self.simplify:g}')
+        if self.curves:
+            parts.append('curves=1')
+        if self.erase:
+            parts.append('erase=1')
+        if self.palette:
+            parts.append('palette=1')
+        if self.quantize is not None:
+            parts.append('quantize=%g,%g,%d' % self.quantize)
+        return ';'.join(parts)
+
+
+def parse_quantize(text):
+    """parses WIDTH_STEP,OPACITY_STEP,COLOUR_LEVELS (see RenderOptions)"""
+    try:
+        width_step, opacity_step, colour_levels = text.split(',')
+        quantize = (float(width_step), float(opacity_step), int(colour_levels))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected WIDTH_STEP,OPACITY_STEP,COLOUR_LEVELS: "{text}"')
+    if min(quantize) < 0 or quantize[2] == 1:
+        raise argparse.ArgumentTypeError(f'steps must be >= 0, and levels 0 or >= 2: "{text}"')
+    return quantize
+
+
+default_options = RenderOptions()
+
 
 def rm2svg(input_file, output_name, coloured_annotations=False,
-           width=default_width, height=default_height):
+           width=default_width, height=default_height, transform=None,
+           options=None):
+    # input_file: a path, bytes or a binary file object (see RmPage.open);
+    # output_name: a path or a writable stream (see open_svg_output)
 
     if coloured_annotations:
         set_coloured_annots()
 
-    page = parse_rm_input(input_file, coloured_annotations)
-    convert_to_svg(page, output_name, width, height)
+    with RmPage.open(input_file, coloured_annotations) as page:
+        convert_to_svg(page, output_name, width, height, transform, options)
+
+
+def render_svg(page, width=default_width, height=default_height,
+               transform=None, options=None):
+    """renders a page into SVG, returned as (utf-8) bytes"""
+    output = io.BytesIO()
+    convert_to_svg(page, output, width, height, transform, options)
+    return output.getvalue()
+
+
+def read_lines_version(input_file):
+    """returns the version of a .rm (lines) file from its header, or None"""
+    with open(input_file, 'rb') as f:
+        header = f.read(len(expected_header_v5))
+    prefix = b'reMarkable .lines file, version='
+    if len(header) < len(expected_header_v5) or not header.startswith(prefix):
+        return None
+    version = header[len(prefix):].rstrip(b' ')
+    return int(version) if version.isdigit() else None
 
 
 def parse_rm_input(input_file, coloured_annotations):
     with open(input_file, 'rb') as f:
         data = f.read()
+    return parse_rm_data(data, coloured_annotations, Page())
+
+
+def parse_rm_data(data, coloured_annotations, page):
+    """
+    fills page with the layers and strokes of a .rm file held in data
+    (bytes or mmap), using the decoder for the version in its header
+    """
+    header = bytes(data[:len(expected_header_v5)])
+    if header in (expected_header_v3, expected_header_v5):
+        return parse_rm_data_v5(data, coloured_annotations, page)
+    elif header == expected_header_v6:
+        return parse_rm_data_v6(data, coloured_annotations, page)
+    abort(f'Not a valid reMarkable file: <header={header}>')
+
+
+def parse_rm_data_v6(data, coloured_annotations, page):
+    """
+    reads the lines of a version=6 file (see lines_v6), and fills page
+    with them, as version=3/5 layers and strokes
+    """
+    pens = {}
+    try:
+        layer_list = lines_v6.read_layers(data)
+    except lines_v6.FormatError as e:
+        abort(f'Not a valid reMarkable file: {e}')
+    for layer_id, (_, lines) in enumerate(layer_list):
+        layer = Layer(layer_id)
+        for stroke_id, line in enumerate(lines):
+            pen, colour, width, opacity = get_pen(pens, line.tool, line.color, line.thickness,
+                                                  coloured_annotations)
+            stroke = Stroke(stroke_id, pen, colour_rgb(colour), width,
+                            opacity, None, 0, len(line.points), line.points)
+            layer.append_stroke(stroke)
+        page.append_layer(layer)
+    return page
+
+
+def parse_rm_data_v5(data, coloured_annotations, page):
+    """
+    walks the layer and stroke headers of a version=3/5 file held in data
+    (bytes or mmap), jumping over each block of segments, and fills page
+    with them
+    """
     offset = 0
 
     # Is this a reMarkable .lines file?
-    expected_header_v3 = b'reMarkable .lines file, version=3          '
-    expected_header_v5 = b'reMarkable .lines file, version=5          '
     if len(data) < len(expected_header_v5) + 4:
         abort('File too short to be a valid file')
 
@@ -165,17 +687,22 @@ def parse_rm_input(input_file, coloured_annotations):
     if (not is_v3 and not is_v5) or nlayers < 1:
         abort(f'Not a valid reMarkable file: <header={header}><nlayers={nlayers}>')
         return
-
-    page = Page()
+    stroke_fmt = '<IIIfI' if is_v3 else '<IIIffI'
+    check_count(data, offset, nlayers, struct.calcsize('<I'), 'nlayers')
+    # strokes drawn with the same pen/colour/width share one pen object
+    pens = {}
 
     for layer_id in range(nlayers):
         fmt = '<I'
+        check_count(data, offset, 1, struct.calcsize(fmt), 'nstrokes')
         (nstrokes,) = struct.unpack_from(fmt, data, offset); offset += struct.calcsize(fmt)  # noqa: E702
+        check_count(data, offset, nstrokes, struct.calcsize(stroke_fmt), 'nstrokes')
 
         layer = Layer(layer_id)
 
         # Iterate through the strokes in the layer (If there is any)
         for stroke_id in range(nstrokes):
+            check_count(data, offset, 1, struct.calcsize(stroke_fmt), 'stroke')
             if is_v3:
                 fmt = '<IIIfI'
                 pen_nr, colour, i_unk, width, nsegments = struct.unpack_from(fmt, data, offset); offset += struct.calcsize(fmt)  # noqa: E702
@@ -184,53 +711,12 @@ def parse_rm_input(input_file, coloured_annotations):
                 pen_nr, colour, i_unk, width, unknown, nsegments = struct.unpack_from(fmt, data, offset); offset += struct.calcsize(fmt)  # noqa: E702
                 # print(f'Stroke {stroke}: pen_nr={pen_nr}, colour={colour}, width={width}, unknown={unknown}, nsegments={nsgiments}')
 
-            opacity = 1
-            # print(pen_nr)
-            # Brush
-            if (pen_nr == 0 or pen_nr == 12):
-                pen = Brush(width, colour)
-            # caligraphy
-            elif pen_nr == 21:
-                pen = Caligraphy(width, colour)
-            # Marker
-            elif (pen_nr == 3 or pen_nr == 16):
-                pen = Marker(width, colour)
-            # BallPoint
-            elif (pen_nr == 2 or pen_nr == 15):
-                if coloured_annotations:
-                    colour = 4
-                pen = Ballpoint(width, colour)
-            # Fineliner
-            elif (pen_nr == 4 or pen_nr == 17):
-                pen = Fineliner(width, colour)
-            # pencil
-            elif (pen_nr == 1 or pen_nr == 14):
-                pen = Pencil(width, colour)
-            # mech
-            elif (pen_nr == 7 or pen_nr == 13):
-                pen = Mechanical_Pencil(width, colour)
-            # Highlighter
-            elif (pen_nr == 5 or pen_nr == 18):
-                width = 15
-                opacity = 0.2
-                if coloured_annotations:
-                    colour = 3
-                pen = Highlighter(width, colour)
-            elif (pen_nr == 8):  # Erase area
-                pen = Erase_Area(width, colour)
-            elif (pen_nr == 6):  # Eraser
-                colour = 2
-                pen = Eraser(width, colour)
-            else:
-                print(f'Unknown pen_nr: {pen_nr}')
-
-            stroke = Stroke(stroke_id, pen, stroke_colour[colour], width, opacity)
+            pen, colour, width, opacity = get_pen(pens, pen_nr, colour, width, coloured_annotations)
 
-            # Iterate through the segments
-            for segment_id in range(nsegments):
-                fmt = '<ffffff'
-                xpos, ypos, speed, tilt, width, pressure = struct.unpack_from(fmt, data, offset); offset += struct.calcsize(fmt)  # noqa: E702
-                stroke.append_segment(Segment(segment_id, xpos, ypos, speed, tilt, width, pressure))
+            # index the block of segments and jump over it
+            check_count(data, offset, nsegments, segment_dtype.itemsize, 'nsegments')
+            stroke = Stroke(stroke_id, pen, colour_rgb(colour), width, opacity, data, offset, nsegments)
+            offset += nsegments * segment_dtype.itemsize
 
             # store stroke
             layer.append_stroke(stroke)
@@ -241,7 +727,415 @@ def parse_rm_input(input_file, coloured_annotations):
     return page
 
 
-def convert_to_svg(page, output_name, width, height):
+def get_pen(pens, pen_nr, colour, width, coloured_annotations):
+    """make_pen, cached in pens: strokes with the same pen/colour/width share one pen object"""
+    key = (pen_nr, colour, width)
+    if key not in pens:
+        pens[key] = make_pen(pen_nr, colour, width, coloured_annotations)
+    return pens[key]
+
+
+def make_pen(pen_nr, colour, width, coloured_annotations):
+    """returns the pen for a stroke header, and the colour/width/opacity to use"""
+    opacity = 1
+    # print(pen_nr)
+    # Brush
+    if (pen_nr == 0 or pen_nr == 12):
+        pen = Brush(width, colour)
+    # caligraphy
+    elif pen_nr == 21:
+        pen = Caligraphy(width, colour)
+    # Marker
+    elif (pen_nr == 3 or pen_nr == 16):
+        pen = Marker(width, colour)
+    # BallPoint
+    elif (pen_nr == 2 or pen_nr == 15):
+        if coloured_annotations:
+            colour = 4
+        pen = Ballpoint(width, colour)
+    # Fineliner
+    elif (pen_nr == 4 or pen_nr == 17):
+        pen = Fineliner(width, colour)
+    # pencil
+    elif (pen_nr == 1 or pen_nr == 14):
+        pen = Pencil(width, colour)
+    # mech
+    elif (pen_nr == 7 or pen_nr == 13):
+        pen = Mechanical_Pencil(width, colour)
+    # Highlighter
+    elif (pen_nr == 5 or pen_nr == 18):
+        width = 15
+        opacity = 0.2
+        if coloured_annotations:
+            colour = 3
+        pen = Highlighter(width, colour)
+    elif (pen_nr == 8):  # Erase area
+        pen = Erase_Area(width, colour)
+    elif (pen_nr == 6):  # Eraser
+        colour = 2
+        pen = Eraser(width, colour)
+    else:
+        print(f'Unknown pen_nr: {pen_nr}')
+        pen = Pen(width, colour)
+    return pen, colour, width, opacity
+
+
+def check_count(data, offset, count, item_size, name):
+    """fails fast if count items of item_size bytes cannot fit in the data left"""
+    if count * item_size > len(data) - offset:
+        abort(f'Not a valid reMarkable file: <{name}={count}> needs {count * item_size} bytes '
+              f'at offset {offset}, but only {len(data) - offset} are left')
+
+
+def read_segments(data, offset, nsegments):
+    """returns a read-only segment_dtype view of nsegments records at offset"""
+    check_count(data, offset, nsegments, segment_dtype.itemsize, 'nsegments')
+    return np.frombuffer(data, dtype=segment_dtype, count=nsegments, offset=offset)
+
+
+def stroke_runs(stroke, quantize=None, scales=(1,)):
+    """
+    styles a stroke chunk by chunk (see Pen.get_stroke_style), rounds the
+    styles (see quantize_style) and merges consecutive chunks whose style
+    is the same once written out, at every view scale of scales (see
+    ViewTransform).
+    Returns a list of (first, end, color, width, opacity) runs, where
+    segments[first:end] are the points of the run: every run after the
+    first one starts at the last point of the previous run, to join them.
+    """
+    segments = stroke.segments
+    nsegments = len(segments)
+    if nsegments == 0:
+        return []
+    widths, colors, opacities = stroke.pen.get_stroke_style(
+        segments['speed'], segments['tilt'], segments['width'], segments['pressure'])
+    if quantize is not None:
+        widths, colors, opacities = quantize_style(widths, colors, opacities, quantize)
+    changed = ((colors[1:] != colors[:-1]).any(axis=1) |
+               (opacities[1:] != opacities[:-1]))
+    for scale in scales:
+        # compare the widths as they are written: scaled, with 3 decimals
+        written = np.array(('%.3f ' * len(widths) % tuple((widths * scale).tolist())).split(),
+                           dtype=np.float64)
+        changed |= written[1:] != written[:-1]
+    starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+    segment_length = stroke.pen.segment_length
+    firsts = np.maximum(starts * segment_length - 1, 0).tolist()
+    lasts = np.minimum(np.append(starts[1:], len(widths)) * segment_length, nsegments).tolist()
+    return list(zip(firsts, lasts, map(tuple, colors[starts].tolist()),
+                    widths[starts].tolist(), opacities[starts].tolist()))
+
+
+def quantize_style(widths, colors, opacities, quantize):
+    """
+    rounds chunk styles: widths and opacities to multiples of the (width
+    step, opacity step, colour levels) of quantize, and every colour
+    channel to one of colour levels evenly spaced values (0: no rounding).
+    A visible line keeps a width of at least one step.
+    """
+    width_step, opacity_step, colour_levels = quantize
+    if width_step > 0:
+        widths = np.where(widths > 0, np.maximum(np.round(widths / width_step), 1) * width_step, 0)
+    if opacity_step > 0:
+        opacities = np.clip(np.round(opacities / opacity_step) * opacity_step, 0, 1)
+    if colour_levels > 1:
+        level = 255 / (colour_levels - 1)
+        colors = np.round(np.round(colors / level) * level).astype(np.int64)
+    return widths, colors, opacities
+
+
+def simplify_mask(xpos, ypos, fixed, tolerance):
+    """
+    simplifies a polyline (Ramer-Douglas-Peucker), splitting all its
+    intervals of the same depth at once. Returns a boolean mask of the
+    points to keep: the ends and the fixed indices are always kept.
+    """
+    npoints = len(xpos)
+    keep = np.zeros(npoints, dtype=bool)
+    if npoints == 0:
+        return keep
+    keep[[0, npoints - 1]] = True
+    keep[fixed] = True
+    kept = np.flatnonzero(keep)
+    starts, ends = kept[:-1], kept[1:]
+    while True:
+        inner = ends - starts - 1
+        pending = inner > 0
+        starts, ends, inner = starts[pending], ends[pending], inner[pending]
+        if len(starts) == 0:
+            return keep
+        # the inner points of all the intervals, one interval after the other
+        offsets = np.cumsum(inner) - inner
+        interval = np.repeat(np.arange(len(starts)), inner)
+        index = np.arange(len(interval)) - offsets[interval] + starts[interval] + 1
+        x0 = xpos[starts][interval]
+        y0 = ypos[starts][interval]
+        dx = xpos[ends][interval] - x0
+        dy = ypos[ends][interval] - y0
+        px = xpos[index] - x0
+        py = ypos[index] - y0
+        # distance to the chord (to its start if it is a single point)
+        chord = np.hypot(dx, dy)
+        distance = np.where(chord > 0, np.abs(dx * py - dy * px) / np.where(chord > 0, chord, 1),
+                            np.hypot(px, py))
+        farthest = np.maximum.reduceat(distance, offsets)
+        split = farthest > tolerance
+        # keep the (first) farthest point of every interval to split
+        position = np.arange(len(interval))
+        position = np.minimum.reduceat(np.where(distance == farthest[interval], position, len(position)),
+                                       offsets)
+        middles = index[position[split]]
+        keep[middles] = True
+        starts = np.concatenate((starts[split], middles))
+        ends = np.concatenate((middles, ends[split]))
+
+
+def simplified_indices(strokes, runs_list, tolerance):
+    """
+    simplifies strokes (see simplify_mask) in one pass: their points are
+    put end to end, the first and last points of every run being kept (so
+    the runs keep their styles, and no interval spans two strokes).
+    Returns the indices of the points to keep of every stroke
+    """
+    if not strokes:
+        return []
+    segment_list = [stroke.segments for stroke in strokes]
+    sizes = [len(segments) for segments in segment_list]
+    starts = np.cumsum(sizes) - sizes
+    fixed = [start + end for start, runs in zip(starts.tolist(), runs_list)
+             for first, last, *_ in runs for end in (first, last - 1)]
+    keep = simplify_mask(np.concatenate([segments['xpos'] for segments in segment_list]).astype(np.float64),
+                         np.concatenate([segments['ypos'] for segments in segment_list]).astype(np.float64),
+                         fixed, tolerance)
+    return [np.flatnonzero(keep[start:start + size]) for start, size in zip(starts.tolist(), sizes)]
+
+
+def layer_runs(strokes, options, scales=(1,)):
+    """
+    styles the strokes of a layer for the view scales they are written at
+    (see stroke_runs), and simplifies them all at once (see RenderOptions).
+    Returns a list of (stroke, runs, index), index being the points to
+    draw (see stroke_points)
+    """
+    runs_list = [stroke_runs(stroke, options.quantize, scales) for stroke in strokes]
+    if options.simplify > 0:
+        index_list = simplified_indices(strokes, runs_list, options.simplify)
+    else:
+        index_list = [None] * len(strokes)
+    return list(zip(strokes, runs_list, index_list))
+
+
+def stroke_points(stroke, runs, transform, options, index=None):
+    """
+    returns the output (xpos, ypos) of the points of a stroke to draw, and
+    their indices in the stroke: index if given (see layer_runs), else all
+    of them, or the simplified ones (see RenderOptions)
+    """
+    segments = stroke.segments
+    if index is None and options.simplify > 0 and len(segments) > 2:
+        index = simplified_indices([stroke], [runs], options.simplify)[0]
+    if index is None:
+        index = np.arange(len(segments))
+        xpos, ypos = transform.apply(segments['xpos'], segments['ypos'])
+    else:
+        xpos, ypos = transform.apply(segments['xpos'][index], segments['ypos'][index])
+    return xpos, ypos, index
+
+
+def run_slices(runs, index):
+    """the [start, end) of every run in the drawn points (see stroke_points)"""
+    bounds = np.searchsorted(index, [(first, last) for first, last, *_ in runs]).tolist()
+    return [slice(start, end) for start, end in bounds]
+
+
+def bezier_controls(xpos, ypos):
+    """
+    returns the cubic Bezier segments of the (Catmull-Rom) curve through
+    the points, as an (n - 1, 6) array of the two control points and the
+    end of every segment
+    """
+    x = np.concatenate((xpos[:1], xpos, xpos[-1:]))
+    y = np.concatenate((ypos[:1], ypos, ypos[-1:]))
+    return np.column_stack((x[1:-2] + (x[2:-1] - x[:-3]) / 6, y[1:-2] + (y[2:-1] - y[:-3]) / 6,
+                            x[2:-1] - (x[3:] - x[1:-2]) / 6, y[2:-1] - (y[3:] - y[1:-2]) / 6,
+                            x[2:-1], y[2:-1]))
+
+
+def stroke_bounds(stroke, pad=0):
+    """the (x0, y0, x1, y1) bounding box of the points of a stroke, padded"""
+    segments = stroke.segments
+    return (float(segments['xpos'].min()) - pad, float(segments['ypos'].min()) - pad,
+            float(segments['xpos'].max()) + pad, float(segments['ypos'].max()) + pad)
+
+
+def erased_mask(xpos, ypos, eraser):
+    """
+    returns which of the points (xpos, ypos) an eraser stroke covers: the
+    points within half its width of its line (Eraser), or inside the area
+    its line encloses (Erase_Area)
+    """
+    segments = eraser.segments
+    ex = segments['xpos'].astype(np.float64)
+    ey = segments['ypos'].astype(np.float64)
+    mask = np.zeros(len(xpos), dtype=bool)
+    area = isinstance(eraser.pen, Erase_Area)
+    if area and len(ex) < 3:
+        return mask
+    if area:
+        ax, ay, bx, by = ex, ey, np.roll(ex, -1), np.roll(ey, -1)
+    else:
+        radius = eraser.pen.base_width / 2
+        if len(ex) == 1:
+            ex, ey = np.repeat(ex, 2), np.repeat(ey, 2)
+        ax, ay, bx, by = ex[:-1], ey[:-1], ex[1:], ey[1:]
+    # points x eraser edges, a block of points at a time
+    block = max(1, (1 << 20) // len(ax))
+    for start in range(0, len(xpos), block):
+        px = xpos[start:start + block, np.newaxis]
+        py = ypos[start:start + block, np.newaxis]
+        if area:
+            # even-odd rule: count the edges a ray to the right crosses
+            dy = by - ay
+            crossing = ((ay > py) != (by > py)) & (
+                px < (bx - ax) * (py - ay) / np.where(dy != 0, dy, 1) + ax)
+            mask[start:start + block] = crossing.sum(axis=1) % 2 == 1
+        else:
+            sx, sy = bx - ax, by - ay
+            length2 = sx * sx + sy * sy
+            t = np.clip(((px - ax) * sx + (py - ay) * sy) / np.where(length2 > 0, length2, 1), 0, 1)
+            distance2 = (px - ax - t * sx) ** 2 + (py - ay - t * sy) ** 2
+            mask[start:start + block] = (distance2 <= radius * radius).any(axis=1)
+    return mask
+
+
+def resolve_erasers(page):
+    """
+    returns a Page of the ink of page its erasers leave visible: the
+    points of the earlier strokes of a layer an eraser covers are removed
+    (splitting the strokes around them), and the erasers are dropped
+    """
+    result = Page()
+    for layer in page.layers:
+        # the visible pieces of ink so far, with their bounding boxes
+        pieces = []
+        for stroke in layer.strokes:
+            if len(stroke.segments) == 0:
+                continue
+            if not isinstance(stroke.pen, (Eraser, Erase_Area)):
+                pieces.append((stroke, stroke_bounds(stroke)))
+                continue
+            pad = 0 if isinstance(stroke.pen, Erase_Area) else stroke.pen.base_width / 2
+            x0, y0, x1, y1 = stroke_bounds(stroke, pad)
+            remaining = []
+            for piece, box in pieces:
+                if box[0] > x1 or box[2] < x0 or box[1] > y1 or box[3] < y0:
+                    remaining.append((piece, box))
+                    continue
+                segments = piece.segments
+                erased = erased_mask(segments['xpos'].astype(np.float64),
+                                     segments['ypos'].astype(np.float64), stroke)
+                if not erased.any():
+                    remaining.append((piece, box))
+                    continue
+                # the runs of visible points (a single point draws nothing)
+                edges = np.diff(np.concatenate(([0], (~erased).astype(np.int8), [0])))
+                for first, last in zip(np.flatnonzero(edges == 1).tolist(),
+                                       np.flatnonzero(edges == -1).tolist()):
+                    if last - first < 2:
+                        continue
+                    part = Stroke(piece.id, piece.pen, piece.color, piece.width, piece.opacity,
+                                  None, 0, last - first, segments[first:last].copy())
+                    remaining.append((part, stroke_bounds(part)))
+            pieces = remaining
+        visible = Layer(layer.id)
+        for piece, _ in pieces:
+            visible.append_stroke(piece)
+        result.append_layer(visible)
+    return result
+
+
+def open_svg_output(output_name):
+    """
+    opens output_name for writing, gzip-compressed (streaming) for .svgz.
+    output_name can also be a writable text or binary stream, which is
+    written to (and left open)
+    """
+    if isinstance(output_name, (str, os.PathLike)):
+        if os.fspath(output_name).endswith('.svgz'):
+            return gzip.open(output_name, 'wt', encoding='utf-8')
+        return open(output_name, 'w')
+    if isinstance(output_name, io.TextIOBase):
+        return StreamOutput(output_name)
+    return StreamOutput(io.TextIOWrapper(output_name, encoding='utf-8'), True)
+
+
+class StreamOutput():
+    """A caller's stream: close() flushes it, and leaves it open."""
+    __slots__ = ('stream', 'wrapper')
+
+    def __init__(self, stream, wrapper=False):
+        self.stream = stream
+        # whether stream is our text wrapper around a binary stream
+        self.wrapper = wrapper
+
+    def write(self, text):
+        return self.stream.write(text)
+
+    def close(self):
+        self.stream.flush()
+        if self.wrapper:
+            self.stream.detach()
+
+
+def svg_stroke(stroke, runs, transform, options=default_options, classes=None, index=None):
+    """
+    returns the polylines (or paths) of a stroke, as a list of strings.
+    classes are the CSS classes of the runs (see write_layers), if the
+    styles are not written inline, and index the points to draw (see
+    stroke_points)
+    """
+    xpos, ypos, index = stroke_points(stroke, runs, transform, options, index)
+    parts = [f'        <!-- stroke: {stroke.id} pen: "{stroke.pen.name}" --> \n']
+    if not options.curves:
+        # format all the points of the stroke in one pass
+        points = (('%.3f,%.3f ' * len(xpos)) % tuple(np.column_stack((xpos, ypos)).ravel().tolist())).split()
+    for number, ((first, last, color, segment_width, segment_opacity), run) in enumerate(
+            zip(runs, run_slices(runs, index))):
+        if classes is not None:
+            style = f'class="{classes[number]}"'
+        else:
+            style = (f'style="fill:none; stroke:rgb{color} ;stroke-width:{segment_width * transform.scale:.3f};opacity:{segment_opacity:.12g}" '
+                     f'stroke-linecap="{stroke.pen.stroke_cap}"')
+        if not options.curves:
+            parts.append(f'        <polyline {style} points="{" ".join(points[run])}"/>\n')
+            continue
+        run_x, run_y = xpos[run], ypos[run]
+        if len(run_x) == 0:
+            continue
+        curves = bezier_controls(run_x, run_y)
+        path = (f'M{run_x[0]:.3f},{run_y[0]:.3f}' + (' C' if len(curves) else '')
+                + (' %.3f,%.3f %.3f,%.3f %.3f,%.3f' * len(curves)) % tuple(curves.ravel().tolist()))
+        parts.append(f'        <path {style} d="{path}"/>\n')
+    return parts
+
+
+def convert_to_svg(page, output_name, width, height, transform=None, options=None):
+    if transform is None:
+        transform = ViewTransform(width, height)
+    convert_to_svgs(page, [(output_name, transform)], options)
+
+
+def convert_to_svgs(page, targets, options=None):
+    """
+    renders a page to several SVG files at once: targets is a list of
+    (output_name, ViewTransform), output_name being a path or a stream
+    (see open_svg_output). Strokes are styled once for all targets, and
+    written out as options (a RenderOptions) say.
+    """
+    if options is None:
+        options = default_options
+    if options.erase:
+        page = resolve_erasers(page)
     svg_header = '''
     <script type="application/ecmascript"> <![CDATA[
         var visiblePage = 'p1';
@@ -253,77 +1147,98 @@ def convert_to_svg(page, output_name, width, height):
     ]]>
     </script>
     '''
-    with open(output_name, 'w') as output:
-        # BEGIN Notebook
-        output.write(f'<svg xmlns="http://www.w3.org/2000/svg" height="{height}" width="{width}">')
-        output.write(svg_header + '\n')
-
-        # Iterate through pages (There is at least one)
-        output.write('    <g id="p1" style="display:inline">\n')
-        output.write('        <filter id="blurMe"><feGaussianBlur in="SourceGraphic" stdDeviation="10" /></filter>\n')
-
+    outputs = []
+    try:
+        for output_name, transform in targets:
+            output = open_svg_output(output_name)
+            outputs.append((output, transform))
+            # BEGIN Notebook
+            output.write(f'<svg xmlns="http://www.w3.org/2000/svg" height="{transform.height}" width="{transform.width}">'
+                         + svg_header + '\n'
+                         # Iterate through pages (There is at least one)
+                         + '    <g id="p1" style="display:inline">\n'
+                         + '        <filter id="blurMe"><feGaussianBlur in="SourceGraphic" stdDeviation="10" /></filter>\n')
+
+        write_layers(page, outputs, options)
+
+        for output, transform in outputs:
+            # Overlay the page with a clickable rect to flip pages
+            output.write('\n'
+                         + '        <!-- clickable rect to flip pages -->\n'
+                         + f'        <rect x="0" y="0" width="{transform.width}" height="{transform.height}" fill-opacity="0"/>\n'
+                         # Closing page group
+                         + '    </g>\n'
+                         # END notebook
+                         + '</svg>')
+    finally:
+        for output, transform in outputs:
+            output.close()
+
+
+def write_layers(page, outputs, options=default_options, prefix=''):
+    """
+    writes the strokes of a page to outputs, a list of (output,
+    ViewTransform), styling every stroke once. With options.palette, the
+    distinct styles of the page are written first, as a <style> block of
+    CSS classes (named prefix + letters), and the lines only refer to them.
+    """
+    scales = [transform.scale for _, transform in outputs]
+    if not options.palette:
         for layer in page.layers:
-            # Iterate through the strokes in the layer (If there is any)
-            output.write(f'        <!-- layer: {layer.id} --> \n')
-            for stroke in layer.strokes:
-                last_x = -1.
-                last_y = -1.
-                last_width = 0
-                # BEGIN stroke
-                output.write(f'        <!-- stroke: {stroke.id} pen: "{stroke.pen.name}" --> \n')
-                output.write('        <polyline ')
-                output.write(f'style="fill:none;stroke:{stroke.color};stroke-width:{stroke.width};opacity:{stroke.opacity}" ')
-                output.write(f'stroke-linecap="{stroke.pen.stroke_cap}" ')
-
-                output.write('points="')
-
-                last_x = -1.
-                last_y = -1.
-                last_width = 0
-                # Iterate through the segments to form a polyline
-                for segment in stroke.segments:
-                    # output.write(f'        <!-- segment: {segment.id} --> \n')
-                    ratio = (height/width)/(1872/1404)
-                    if ratio > 1:
-                        segment.xpos = ratio*((segment.xpos*width)/1404)
-                        segment.ypos = (segment.ypos*height)/1872
-                    else:
-                        segment.xpos = (segment.xpos*width)/1404
-                        segment.ypos = (1/ratio)*(segment.ypos*height)/1872
-                    if segment.id % stroke.pen.segment_length == 0:
-                        segment_color = stroke.pen.get_segment_color(segment.speed, segment.tilt, segment.width, segment.pressure, last_width)
-                        segment_width = stroke.pen.get_segment_width(segment.speed, segment.tilt, segment.width, segment.pressure, last_width)
-                        segment_opacity = stroke.pen.get_segment_opacity(segment.speed, segment.tilt, segment.width, segment.pressure, last_width)
-                        # print(segment_color, segment_width, segment_opacity, stroke.pen.stroke_cap)
-                        # UPDATE stroke
-                        output.write('"/>\n')
-                        output.write('        <polyline ')
-                        output.write(f'style="fill:none; stroke:{segment_color} ;stroke-width:{segment_width:.3f};opacity:{segment_opacity}" ')
-                        output.write(f'stroke-linecap="{stroke.pen.stroke_cap}" ')
-                        output.write('points="')
-                        if last_x != -1.:
-                            # Join to previous segment
-                            output.write('{:.3f},{:.3f} '.format(last_x, last_y))
-
-                    last_x = segment.xpos
-                    last_y = segment.ypos
-                    last_width = segment_width
-
-                    # BEGIN and END polyline segment
-                    output.write('{:.3f},{:.3f} '.format(segment.xpos, segment.ypos))
-
-                # END stroke
-                output.write('" />\n')
-
-        # Overlay the page with a clickable rect to flip pages
-        output.write('\n')
-        output.write('        <!-- clickable rect to flip pages -->\n')
-        output.write(f'        <rect x="0" y="0" width="{width}" height="{height}" fill-opacity="0"/>\n')
-        # Closing page group
-        output.write('    </g>\n')
-        # END notebook
-        output.write('</svg>')
-        output.close()
+            # Iterate through the strokes in the layer (If there is any),
+            # and write the layer out at once
+            parts = [[f'        <!-- layer: {layer.id} --> \n'] for _ in outputs]
+            for stroke, runs, index in layer_runs(layer.strokes, options, scales):
+                for (output, transform), output_parts in zip(outputs, parts):
+                    output_parts.extend(svg_stroke(stroke, runs, transform, options, None, index))
+            for (output, transform), output_parts in zip(outputs, parts):
+                output.write(''.join(output_parts))
+        return
+    # style the whole page first: the palette goes before the lines.
+    # palette: (color, width, opacity, linecap) -> class name, the widths
+    # being compared as written at every scale
+    palette = {}
+    layers = []
+    for layer in page.layers:
+        strokes = []
+        for stroke, runs, index in layer_runs(layer.strokes, options, scales):
+            classes = []
+            for first, last, color, segment_width, segment_opacity in runs:
+                key = (color, tuple(f'{segment_width * scale:.3f}' for scale in scales),
+                       segment_opacity, stroke.pen.stroke_cap)
+                name = palette.get(key)
+                if name is None:
+                    name = palette[key] = class_name(len(palette), prefix)
+                classes.append(name)
+            strokes.append((stroke, runs, classes, index))
+        layers.append((layer, strokes))
+    for number, (output, transform) in enumerate(outputs):
+        output.write(svg_palette(palette, number))
+    for layer, strokes in layers:
+        parts = [[f'        <!-- layer: {layer.id} --> \n'] for _ in outputs]
+        for stroke, runs, classes, index in strokes:
+            for (output, transform), output_parts in zip(outputs, parts):
+                output_parts.extend(svg_stroke(stroke, runs, transform, options, classes, index))
+        for (output, transform), output_parts in zip(outputs, parts):
+            output.write(''.join(output_parts))
+
+
+def class_name(index, prefix=''):
+    """the CSS class name of a palette entry: a, b, ..., z, ba, bb, ..."""
+    letters = ''
+    while True:
+        index, digit = divmod(index, 26)
+        letters = chr(ord('a') + digit) + letters
+        if index == 0:
+            return prefix + letters
+
+
+def svg_palette(palette, number=0):
+    """the <style> block of a palette (see write_layers), for output number"""
+    rules = [f'.{name}{{fill:none;stroke:rgb{color};stroke-width:{widths[number]};'
+             f'opacity:{opacity:.12g};stroke-linecap:{linecap}}}\n'
+             for (color, widths, opacity, linecap), name in palette.items()]
+    return '        <style>\n' + ''.join(rules) + '        </style>\n'
 
 
 def extract_data(input_file):
@@ -336,8 +1251,6 @@ def extract_data(input_file):
     offset = 0
 
     # Is this a reMarkable .lines file?
-    expected_header_v3 = b'reMarkable .lines file, version=3          '
-    expected_header_v5 = b'reMarkable .lines file, version=5          '
     if len(data) < len(expected_header_v5) + 4:
         abort('File too short to be a valid file')
 
@@ -374,7 +1287,7 @@ def extract_data(input_file):
 class Pen:
     def __init__(self, base_width, base_color):
         self.base_width = base_width
-        self.base_color = stroke_colour[base_color]
+        self.base_color = colour_rgb(base_color)
         self.segment_length = 1000
         self.stroke_cap = "round"
         self.base_opacity = 1
@@ -395,6 +1308,46 @@ class Pen:
         value = 0 if value < 0 else value
         return value
 
+    # Batched versions of the get_segment_* methods: they take the values at
+    # the start of every chunk of a stroke as arrays, and return one
+    # width/colour/opacity per chunk.
+
+    def get_stroke_style(self, speed, tilt, width, pressure):
+        """
+        styles a whole stroke in one pass, from the stroke's per-point
+        arrays: returns the (widths, colors, opacities) of its chunks of
+        segment_length points, colors being an (n, 3) array of 0-255 ints
+        """
+        speed, tilt, width, pressure = (np.asarray(values, dtype=np.float64)[::self.segment_length]
+                                        for values in (speed, tilt, width, pressure))
+        return (self.get_stroke_widths(speed, tilt, width, pressure),
+                self.get_stroke_colors(speed, tilt, width, pressure),
+                self.get_stroke_opacities(speed, tilt, width, pressure))
+
+    def get_stroke_widths(self, speed, tilt, width, pressure):
+        return np.full(len(speed), self.base_width, dtype=np.float64)
+
+    def get_stroke_colors(self, speed, tilt, width, pressure):
+        return np.tile(np.array(self.base_color, dtype=np.int64), (len(speed), 1))
+
+    def get_stroke_opacities(self, speed, tilt, width, pressure):
+        return np.full(len(speed), self.base_opacity, dtype=np.float64)
+
+    def cutoffs(self, values):
+        """batched cutoff()"""
+        return np.clip(values, 0, 1)
+
+    def last_width_feedback(self, values, factor):
+        """
+        batched form of 'segment_width = value + factor * last_width', where
+        last_width is the width of the previous chunk (0 for the first one).
+        The terms older than factor**n < 1e-17 are below double precision,
+        so a truncated convolution is enough.
+        """
+        nterms = 1 + int(np.ceil(np.log(1e-17) / np.log(factor)))
+        weights = factor ** np.arange(min(nterms, len(values)))
+        return np.convolve(values, weights)[:len(values)]
+
 
 class Fineliner(Pen):
     def __init__(self, base_width, base_color):
@@ -421,6 +1374,14 @@ class Ballpoint(Pen):
         segment_color = [int(abs(intensity - 1) * 255)] * 3
         return "rgb"+str(tuple(segment_color))
 
+    def get_stroke_widths(self, speed, tilt, width, pressure):
+        return (0.5 + pressure) + (1 * width) - 0.5*(speed/50)
+
+    def get_stroke_colors(self, speed, tilt, width, pressure):
+        intensity = self.cutoffs((0.1 * -(speed / 35)) + (1.2 * pressure) + 0.5)
+        gray = (np.abs(intensity - 1) * 255).astype(np.int64)
+        return np.repeat(gray[:, np.newaxis], 3, axis=1)
+
     # def get_segment_opacity(self, speed, tilt, width, pressure, last_width):
     #     segment_opacity = (0.2 * -(speed / 35)) + (0.8 * pressure)
     #     segment_opacity *= segment_opacity
@@ -438,6 +1399,9 @@ class Marker(Pen):
         segment_width = 0.9 * (((1 * width)) - 0.4 * tilt) + (0.1 * last_width)
         return segment_width
 
+    def get_stroke_widths(self, speed, tilt, width, pressure):
+        return self.last_width_feedback(0.9 * (((1 * width)) - 0.4 * tilt), 0.1)
+
 
 class Pencil(Pen):
     def __init__(self, base_width, base_color):
@@ -457,6 +1421,13 @@ class Pencil(Pen):
         segment_opacity = self.cutoff(segment_opacity) - 0.1
         return segment_opacity
 
+    def get_stroke_widths(self, speed, tilt, width, pressure):
+        segment_width = 0.7 * ((((0.8*self.base_width) + (0.5 * pressure)) * (1 * width)) - (0.25 * tilt**1.8) - (0.6 * speed / 50))
+        return np.minimum(segment_width, self.base_width * 10)
+
+    def get_stroke_opacities(self, speed, tilt, width, pressure):
+        return self.cutoffs((0.1 * -(speed / 35)) + (1 * pressure)) - 0.1
+
 
 class Mechanical_Pencil(Pen):
     def __init__(self, base_width, base_color):
@@ -490,6 +1461,14 @@ class Brush(Pen):
 
         return "rgb"+str(tuple(segment_color))
 
+    def get_stroke_widths(self, speed, tilt, width, pressure):
+        return 0.7 * (((1 + (1.4 * pressure)) * (1 * width)) - (0.5 * tilt) - (0.5 * speed / 50))
+
+    def get_stroke_colors(self, speed, tilt, width, pressure):
+        intensity = self.cutoffs((pressure ** 1.5 - 0.2 * (speed / 50)) * 1.5)
+        rev_intensity = np.abs(intensity - 1)
+        return (rev_intensity[:, np.newaxis] * (255 - np.array(self.base_color))).astype(np.int64)
+
 
 class Highlighter(Pen):
     def __init__(self, base_width, base_color):
@@ -525,6 +1504,9 @@ class Caligraphy(Pen):
         segment_width = 0.9 * (((1 + pressure) * (1 * width)) - 0.3 * tilt) + (0.1 * last_width)
         return segment_width
 
+    def get_stroke_widths(self, speed, tilt, width, pressure):
+        return self.last_width_feedback(0.9 * (((1 + pressure) * (1 * width)) - 0.3 * tilt), 0.1)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#
+# Script for exporting a reMarkable tablet ".rm" page as a tile pyramid
+# (SVG or PNG tiles), for zoomable web viewers:
+#
+#   OUTDIR/tiles.json      the tile size, levels and page size
+#   OUTDIR/Z/X/Y.svg       tile X, Y (from the top left) of zoom level Z
+#
+# At level 0 the whole page fits in one tile, and every level doubles the
+# scale. Each tile only draws the strokes the page index (see page_index)
+# finds under it.
+import os
+import json
+import math
+import time
+import argparse
+
+try:
+    from . import rm2png
+    from . import rm2svg
+    from . import page_index
+except ImportError:
+    import rm2png
+    import rm2svg
+    import page_index
+
+
+__prog_name__ = "rm2tiles"
+__version__ = "0.0.1"
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=__prog_name__)
+    parser.add_argument("-i",
+                        "--input",
+                        help=".rm input file",
+                        required=True,
+                        metavar="FILENAME",
+                        )
+    parser.add_argument("-o",
+                        "--outdir",
+                        help="output directory",
+                        required=True,
+                        metavar="DIR",
+                        )
+    parser.add_argument("--levels",
+                        help="number of zoom levels (default: 4)",
+                        type=int,
+                        default=4,
+                        )
+    parser.add_argument("--tile-size",
+                        help="tile width and height, in pixels (default: 256)",
+                        type=int,
+                        default=256,
+                        )
+    parser.add_argument("--format",
+                        help="tile format (default: svg)",
+                        choices=('svg', 'png'),
+                        default='svg',
+                        )
+    parser.add_argument("-c",
+                        "--coloured_annotations",
+                        help="Colour annotations for document markup.",
+                        action='store_true',
+                        )
+    parser.add_argument("--simplify",
+                        help="Drop the points closer than TOLERANCE (page units) to the simplified strokes.",
+                        type=float,
+                        default=0,
+                        metavar="TOLERANCE",
+                        )
+    parser.add_argument("--curves",
+                        help="Draw the strokes as Bezier curves through their points: smoother, but larger (see --simplify).",
+                        action='store_true',
+                        )
+    parser.add_argument("--erase",
+                        help="Remove the erased ink instead of drawing the erasers over it.",
+                        action='store_true',
+                        )
+    parser.add_argument("--palette",
+                        help="SVG tiles: write the stroke styles once, as CSS classes, instead of on every line.",
+                        action='store_true',
+                        )
+    parser.add_argument("--quantize",
+                        help="Round the stroke widths (page units) and opacities to multiples of "
+                             "WIDTH_STEP and OPACITY_STEP, and the colours to COLOUR_LEVELS levels "
+                             "per channel (0: exact), e.g. 0.25,0.05,32.",
+                        type=rm2svg.parse_quantize,
+                        metavar="WIDTH_STEP,OPACITY_STEP,COLOUR_LEVELS",
+                        )
+    parser.add_argument('--version',
+                        action='version',
+                        version='%(prog)s {version}'.format(version=__version__))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        parser.error(f'The file "{args.input}" does not exist!')
+    start = time.perf_counter()
+    ntiles, nstrokes, total_strokes = rm2tiles(
+        args.input, args.outdir, args.levels, args.tile_size, args.format,
+        args.coloured_annotations, rm2svg.RenderOptions(args.simplify, args.curves, args.erase,
+                                                        palette=args.palette,
+                                                        quantize=args.quantize))
+    elapsed = time.perf_counter() - start
+    print(f'{args.outdir}: {ntiles} tiles in {elapsed:.2f} s, {nstrokes} strokes drawn '
+          f'({total_strokes} without the index)')
+
+
+def tile_transform(level, x, y, tile_size):
+    """the ViewTransform of tile x, y of a zoom level"""
+    # page units per tile side: the whole page fits in one tile at level 0
+    side = max(rm2svg.default_width, rm2svg.default_height) / 2 ** level
+    return rm2svg.ViewTransform(tile_size, tile_size, crop=(x * side, y * side, side, side))
+
+
+def level_size(level):
+    """the number of (columns, rows) of tiles of a zoom level"""
+    side = max(rm2svg.default_width, rm2svg.default_height) / 2 ** level
+    return math.ceil(rm2svg.default_width / side), math.ceil(rm2svg.default_height / side)
+
+
+def rm2tiles(input_file, outdir, levels=4, tile_size=256, tile_format='svg',
+             coloured_annotations=False, options=None):
+    """
+    writes the tile pyramid of a page. Returns the number of tiles, of
+    strokes drawn, and of strokes a full render of every tile would draw.
+    """
+    if coloured_annotations:
+        rm2svg.set_coloured_annots()
+    ntiles = nstrokes = total_strokes = 0
+    if options is None:
+        options = rm2svg.default_options
+    with rm2svg.RmPage.open(input_file, coloured_annotations) as page:
+        if options.erase:
+            # index the visible ink (the tiles draw the resolved strokes)
+            index = page_index.PageIndex(rm2svg.resolve_erasers(page), quantize=options.quantize)
+            options = rm2svg.RenderOptions(options.simplify, options.curves, False,
+                                           options.palette, options.quantize)
+        else:
+            index = page_index.PageIndex(page, quantize=options.quantize)
+        for level in range(levels):
+            ncolumns, nrows = level_size(level)
+            for x in range(ncolumns):
+                tiledir = os.path.join(outdir, str(level), str(x))
+                os.makedirs(tiledir, exist_ok=True)
+                for y in range(nrows):
+                    transform = tile_transform(level, x, y, tile_size)
+                    tile = index.crop_page(page_index.view_rect(transform))
+                    output_name = os.path.join(tiledir, f'{y}.{tile_format}')
+                    if tile_format == 'png':
+                        rm2png.write_png(output_name, rm2png.render_page(tile, transform, options))
+                    else:
+                        rm2svg.convert_to_svg(tile, output_name, tile_size, tile_size,
+                                              transform, options)
+                    ntiles += 1
+                    nstrokes += tile.stroke_count()
+                    total_strokes += page.stroke_count()
+    with open(os.path.join(outdir, 'tiles.json'), 'w') as f:
+        json.dump({
+            'format': tile_format,
+            'tile_size': tile_size,
+            'levels': levels,
+            'width': rm2svg.default_width,
+            'height': rm2svg.default_height,
+        }, f, indent=1)
+    return ntiles, nstrokes, total_strokes
+
+
+if __name__ == "__main__":
+    main()
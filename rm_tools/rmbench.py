@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+#
+# Benchmarks the conversion stages on synthetic data (see rmgen), and
+# compares the results with a stored baseline:
+#
+#   $ rm_tools/rmbench.py --save baseline.json
+#   ... (change the code)
+#   $ rm_tools/rmbench.py --baseline baseline.json
+#
+# Every stage is run --repeat times, and the best time is compared: a
+# stage more than --tolerance slower than in the baseline is reported as
+# a regression (and the exit code is 1).
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+
+try:
+    from . import rmgen
+    from . import rm2pdf
+    from . import rm2svg
+    from . import rmtool
+except ImportError:
+    import rmgen
+    import rm2pdf
+    import rm2svg
+    import rmtool
+
+
+__prog_name__ = "rmbench"
+__version__ = "0.0.1"
+
+
+# corpus sizes
+corpora = {
+    'default': {
+        'pages': 20,
+        'layers': 2,
+        'strokes': 200,
+        'points': 60,
+        'tree_documents': 5000,
+        'tree_folders': 200,
+        'convert_documents': 40,
+        'convert_pages': 3,
+        'convert_strokes': 100,
+    },
+    'quick': {
+        'pages': 4,
+        'layers': 1,
+        'strokes': 100,
+        'points': 40,
+        'tree_documents': 500,
+        'tree_folders': 20,
+        'convert_documents': 8,
+        'convert_pages': 2,
+        'convert_strokes': 50,
+    },
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=__prog_name__)
+    parser.add_argument('--corpus',
+                        help='corpus size (default: default)',
+                        choices=sorted(corpora),
+                        default='default')
+    parser.add_argument('--repeat',
+                        help='runs per stage (default: 3)',
+                        type=int,
+                        default=3)
+    parser.add_argument('--stages',
+                        help='comma-separated stages to run (default: all: %s)' %
+                        ','.join(stage_names),
+                        type=lambda text: text.split(','),
+                        default=stage_names)
+    parser.add_argument('--save',
+                        help='write the results to FILE (JSON)',
+                        metavar='FILE')
+    parser.add_argument('--baseline',
+                        help='compare the results with FILE (see --save)',
+                        metavar='FILE')
+    parser.add_argument('--tolerance',
+                        help='slowdown reported as a regression (default: 0.25, i.e. 25%%)',
+                        type=float,
+                        default=0.25)
+    parser.add_argument('--workdir',
+                        help='where to write the corpus (default: a temporary directory)',
+                        metavar='DIR')
+    parser.add_argument('--version',
+                        action='version',
+                        version='%(prog)s {version}'.format(version=__version__))
+    args = parser.parse_args()
+
+    for stage in args.stages:
+        if stage not in stage_names:
+            parser.error(f'unknown stage "{stage}" (stages: {", ".join(stage_names)})')
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='rmbench.')
+    try:
+        results = run_benchmarks(workdir, corpora[args.corpus], args.stages, args.repeat)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    results['corpus_name'] = args.corpus
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('corpus') != results['corpus']:
+            print('warning: the baseline was run on another corpus', file=sys.stderr)
+    regressions = print_results(results, baseline, args.tolerance)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if regressions:
+        print('regressions: %s' % ', '.join(regressions))
+        sys.exit(1)
+
+
+class Corpus():
+    """The synthetic data the stages run on (written on first use)."""
+
+    def __init__(self, workdir, params):
+        self.workdir = workdir
+        self.params = params
+        self._pages = {}
+        self._tree = None
+        self._convert_tree = None
+
+    def pages(self, version):
+        """returns the paths of the benchmark pages of a .rm version"""
+        if version not in self._pages:
+            p = self.params
+            page_dir = os.path.join(self.workdir, 'pages_v%d' % version)
+            os.makedirs(page_dir, exist_ok=True)
+            paths = []
+            for index in range(p['pages']):
+                path = os.path.join(page_dir, 'page%d.rm' % index)
+                with open(path, 'wb') as f:
+                    f.write(rmgen.make_page(version, p['layers'], p['strokes'], p['points'],
+                                            seed=index))
+                paths.append(path)
+            self._pages[version] = paths
+        return self._pages[version]
+
+    def tree(self):
+        # a large library (metadata only: no pages)
+        if self._tree is None:
+            self._tree = os.path.join(self.workdir, 'tree')
+            rmgen.make_tree(self._tree, self.params['tree_documents'],
+                            self.params['tree_folders'], 0, 5, 1, 0, 0)
+        return self._tree
+
+    def convert_tree(self):
+        # a small library with pages (half version=5, half version=6)
+        if self._convert_tree is None:
+            p = self.params
+            self._convert_tree = os.path.join(self.workdir, 'convert_tree')
+            for version, seed in ((5, 1), (6, 2)):
+                rmgen.make_tree(self._convert_tree, p['convert_documents'] // 2, 4,
+                                p['convert_pages'], version, 1, p['convert_strokes'],
+                                p['points'], seed=seed)
+        return self._convert_tree
+
+
+# Stages: name -> (function(corpus, workdir) -> (items, unit), needs a
+# fresh setup per run). Each function is timed as a whole.
+
+def stage_parse(version):
+    def run(corpus, workdir):
+        npoints = 0
+        for path in corpus.pages(version):
+            with rm2svg.RmPage.open(path) as page:
+                for layer in page.layers:
+                    for stroke in layer.strokes:
+                        npoints += len(stroke.segments)
+        return npoints, 'points'
+    return run
+
+
+def stage_style(corpus, workdir):
+    nstrokes = 0
+    for path in corpus.pages(5):
+        with rm2svg.RmPage.open(path) as page:
+            for layer in page.layers:
+                for stroke in layer.strokes:
+                    rm2svg.stroke_runs(stroke)
+                    nstrokes += 1
+    return nstrokes, 'strokes'
+
+
+def stage_svg(corpus, workdir):
+    paths = corpus.pages(5)
+    output = os.path.join(workdir, 'bench.svg')
+    for path in paths:
+        with rm2svg.RmPage.open(path) as page:
+            rm2svg.convert_to_svg(page, output, rm2svg.default_width, rm2svg.default_height)
+    return len(paths), 'pages'
+
+
+def stage_svg_simplify(corpus, workdir):
+    paths = corpus.pages(5)
+    output = os.path.join(workdir, 'bench.svg')
+    options = rm2svg.RenderOptions(simplify=1)
+    for path in paths:
+        with rm2svg.RmPage.open(path) as page:
+            rm2svg.convert_to_svg(page, output, rm2svg.default_width, rm2svg.default_height,
+                                  None, options)
+    return len(paths), 'pages'
+
+
+def stage_svg_palette(corpus, workdir):
+    paths = corpus.pages(5)
+    output = os.path.join(workdir, 'bench.svg')
+    options = rm2svg.RenderOptions(palette=True, quantize=(0.25, 0.05, 32))
+    for path in paths:
+        with rm2svg.RmPage.open(path) as page:
+            rm2svg.convert_to_svg(page, output, rm2svg.default_width, rm2svg.default_height,
+                                  None, options)
+    return len(paths), 'pages'
+
+
+def stage_pdf(corpus, workdir):
+    paths = corpus.pages(5)
+    transform = rm2svg.ViewTransform()
+    with rm2pdf.PdfWriter(os.path.join(workdir, 'bench.pdf')) as writer:
+        for path in paths:
+            with rm2svg.RmPage.open(path) as page:
+                writer.add_page(rm2pdf.render_page(page, transform))
+    return len(paths), 'pages'
+
+
+def stage_tree(corpus, workdir):
+    rootnode = rmtool.get_repo_info(corpus.tree(), 0)
+    nitems = 0
+    node_stack = [rootnode]
+    while node_stack:
+        node = node_stack.pop()
+        nitems += len(node.children)
+        node_stack.extend(node.children)
+    return nitems, 'items'
+
+
+def convert_all(corpus, outdir):
+    rmtool.convert_all(corpus.convert_tree(), outdir, rm2svg.default_width,
+                       rm2svg.default_height, 'pdf', 'inkscape', None, 1, None, None, 0)
+    p = corpus.params
+    return p['convert_documents'] // 2 * 2 * p['convert_pages'], 'pages'
+
+
+def stage_convert_all(corpus, workdir):
+    # from scratch: no output, no page cache
+    outdir = os.path.join(workdir, 'convert_all')
+    shutil.rmtree(outdir, ignore_errors=True)
+    os.makedirs(outdir)
+    return convert_all(corpus, outdir)
+
+
+def stage_convert_all_noop(corpus, workdir):
+    # nothing changed since the last run
+    outdir = os.path.join(workdir, 'convert_all_noop')
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+        convert_all(corpus, outdir)
+    return convert_all(corpus, outdir)
+
+
+stages = {
+    'parse_v5': stage_parse(5),
+    'parse_v6': stage_parse(6),
+    'style': stage_style,
+    'svg': stage_svg,
+    'svg_simplify': stage_svg_simplify,
+    'svg_palette': stage_svg_palette,
+    'pdf': stage_pdf,
+    'tree': stage_tree,
+    'convert_all': stage_convert_all,
+    'convert_all_noop': stage_convert_all_noop,
+}
+stage_names = list(stages)
+
+
+def run_benchmarks(workdir, params, stage_list, repeat):
+    corpus = Corpus(workdir, params)
+    results = {
+        'version': 1,
+        'corpus': params,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+        },
+        'stages': {},
+    }
+    for name in stage_list:
+        times = []
+        for _ in range(repeat + 1):
+            start = time.perf_counter()
+            items, unit = stages[name](corpus, workdir)
+            times.append(time.perf_counter() - start)
+        # the first run writes the corpus (and warms the caches)
+        times = times[1:]
+        results['stages'][name] = {
+            'best': min(times),
+            'median': statistics.median(times),
+            'items': items,
+            'unit': unit,
+        }
+    return results
+
+
+def print_results(results, baseline, tolerance):
+    """prints the results table, and returns the stages that regressed"""
+    regressions = []
+    print('%-18s %12s %10s %14s %10s %8s' % ('stage', 'items', 'best (s)', 'items/s',
+                                           'base (s)', 'change'))
+    for name, stage in results['stages'].items():
+        line = '%-18s %12s %10.4f %14.1f' % (
+            name, '%d %s' % (stage['items'], stage['unit']), stage['best'],
+            stage['items'] / stage['best'] if stage['best'] > 0 else 0)
+        base = (baseline or {}).get('stages', {}).get(name)
+        if base is not None:
+            change = stage['best'] / base['best'] - 1 if base['best'] > 0 else 0
+            line += ' %10.4f %+7.1f%%' % (base['best'], 100 * change)
+            if change > tolerance:
+                line += ' REGRESSION'
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
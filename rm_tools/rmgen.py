@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+#
+# Generates synthetic reMarkable data, for benchmarks: ".rm" pages
+# (version=3, 5 or 6) with a chosen number of layers, strokes, points per
+# stroke and pen mix, and whole xochitl directories (.metadata, .content,
+# .pagedata and page directories) with many documents and folders.
+#
+# The output only depends on the arguments (and the seed).
+import os
+import json
+import uuid
+import struct
+import argparse
+
+import numpy as np
+
+try:
+    from . import lines_v6
+except ImportError:
+    import lines_v6
+
+
+__prog_name__ = "rmgen"
+__version__ = "0.0.1"
+
+
+# pen numbers (v5 and later tools): ballpoint, fineliner, pencil,
+# mechanical pencil, marker, highlighter, brush, calligraphy
+default_pens = [15, 17, 14, 13, 16, 18, 12, 21]
+# colour numbers: black, gray, white
+default_colours = [0, 1, 2]
+# base widths (the tablet's 3 sizes)
+pen_widths = [1.875, 2.0, 2.125]
+
+headers = {
+    3: b'reMarkable .lines file, version=3          ',
+    5: b'reMarkable .lines file, version=5          ',
+    6: lines_v6.header_v6,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=__prog_name__)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    page_parser = subparsers.add_parser('page', help='write one .rm file')
+    page_parser.add_argument("-o",
+                             "--output",
+                             help=".rm output file",
+                             required=True,
+                             metavar="NAME",
+                             )
+    tree_parser = subparsers.add_parser('tree', help='write a xochitl directory')
+    tree_parser.add_argument("-o",
+                             "--output",
+                             help="output (root) directory",
+                             required=True,
+                             metavar="DIR",
+                             )
+    tree_parser.add_argument('--documents',
+                             help='number of documents (default: 100)',
+                             type=int,
+                             default=100)
+    tree_parser.add_argument('--folders',
+                             help='number of folders (default: 10)',
+                             type=int,
+                             default=10)
+    tree_parser.add_argument('--pages',
+                             help='pages per document (default: 3)',
+                             type=int,
+                             default=3)
+    for subparser in (page_parser, tree_parser):
+        subparser.add_argument('--format',
+                               help='.rm file version (default: 5)',
+                               type=int,
+                               choices=sorted(headers),
+                               default=5)
+        subparser.add_argument('--layers',
+                               help='layers per page (default: 1)',
+                               type=int,
+                               default=1)
+        subparser.add_argument('--strokes',
+                               help='strokes per layer (default: 100)',
+                               type=int,
+                               default=100)
+        subparser.add_argument('--points',
+                               help='points per stroke (default: 50)',
+                               type=int,
+                               default=50)
+        subparser.add_argument('--pens',
+                               help='comma-separated pen numbers to pick from (default: %s)' %
+                               ','.join(str(pen) for pen in default_pens),
+                               type=lambda text: [int(pen) for pen in text.split(',')],
+                               default=default_pens)
+        subparser.add_argument('--colours',
+                               help='comma-separated colour numbers to pick from (default: %s)' %
+                               ','.join(str(colour) for colour in default_colours),
+                               type=lambda text: [int(colour) for colour in text.split(',')],
+                               default=default_colours)
+        subparser.add_argument('--words',
+                               help='version=6: words of typed text per page (default: 0)',
+                               type=int,
+                               default=0)
+        subparser.add_argument('--seed',
+                               help='random seed (default: 0)',
+                               type=int,
+                               default=0)
+    parser.add_argument('--version',
+                        action='version',
+                        version='%(prog)s {version}'.format(version=__version__))
+    args = parser.parse_args()
+
+    if args.command == 'page':
+        with open(args.output, 'wb') as f:
+            f.write(make_page(args.format, args.layers, args.strokes,
+                              args.points, args.pens, args.seed, args.words,
+                              args.colours))
+    else:
+        make_tree(args.output, args.documents, args.folders, args.pages,
+                  args.format, args.layers, args.strokes, args.points,
+                  args.pens, args.seed, args.words, args.colours)
+
+
+def make_strokes(rng, nlayers, nstrokes, npoints, pens, colours=default_colours):
+    """
+    returns [[(pen_nr, colour, width, points)]] (strokes per layer), where
+    points is a lines_v6.point_v1_dtype array (the version=3/5 layout)
+    """
+    layers = []
+    for _ in range(nlayers):
+        strokes = []
+        for _ in range(nstrokes):
+            points = np.empty(npoints, dtype=lines_v6.point_v1_dtype)
+            # a random walk from a random start, inside the page
+            steps = rng.normal(0, 3, size=(npoints, 2))
+            steps[0] = rng.uniform((50, 50), (1354, 1822))
+            xy = np.cumsum(steps, axis=0)
+            points['xpos'] = np.clip(xy[:, 0], 0, 1404)
+            points['ypos'] = np.clip(xy[:, 1], 0, 1872)
+            points['speed'] = rng.uniform(0, 10, npoints)
+            points['tilt'] = rng.uniform(0, 2 * np.pi, npoints)
+            points['width'] = rng.uniform(1, 6, npoints)
+            points['pressure'] = rng.uniform(0.1, 1, npoints)
+            pen_nr = pens[rng.integers(len(pens))]
+            colour = colours[rng.integers(len(colours))]
+            width = pen_widths[rng.integers(len(pen_widths))]
+            strokes.append((pen_nr, colour, width, points))
+        layers.append(strokes)
+    return layers
+
+
+def make_page(version, nlayers, nstrokes, npoints, pens=default_pens, seed=0,
+              nwords=0, colours=default_colours):
+    """
+    returns the bytes of a .rm file of the given version (version=6 pages
+    also get nwords words of typed text)
+    """
+    rng = np.random.default_rng(seed)
+    layers = make_strokes(rng, nlayers, nstrokes, npoints, pens, colours)
+    if version == 6:
+        text = make_text(rng, nwords) if nwords else None
+        return headers[6] + b''.join(v6_blocks(layers, text))
+    parts = [headers[version], struct.pack('<I', nlayers)]
+    for strokes in layers:
+        parts.append(struct.pack('<I', len(strokes)))
+        for pen_nr, colour, width, points in strokes:
+            if version == 3:
+                parts.append(struct.pack('<IIIfI', pen_nr, colour, 0, width, len(points)))
+            else:
+                parts.append(struct.pack('<IIIffI', pen_nr, colour, 0, width, 0, len(points)))
+            parts.append(points.tobytes())
+    return b''.join(parts)
+
+
+# version=6 writer: the few blocks the tablet writes for a page of lines
+
+def v6_varuint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def v6_tag(index, tag_type):
+    return v6_varuint((index << 4) | tag_type)
+
+
+def v6_id(index, crdt_id):
+    return v6_tag(index, lines_v6.TAG_ID) + bytes([crdt_id[0]]) + v6_varuint(crdt_id[1])
+
+
+def v6_int(index, value):
+    return v6_tag(index, lines_v6.TAG_BYTE4) + struct.pack('<I', value)
+
+
+def v6_float(index, value):
+    return v6_tag(index, lines_v6.TAG_BYTE4) + struct.pack('<f', value)
+
+
+def v6_double(index, value):
+    return v6_tag(index, lines_v6.TAG_BYTE8) + struct.pack('<d', value)
+
+
+def v6_bool(index, value):
+    return v6_tag(index, lines_v6.TAG_BYTE1) + bytes([value])
+
+
+def v6_subblock(index, data):
+    return v6_tag(index, lines_v6.TAG_LENGTH4) + struct.pack('<I', len(data)) + data
+
+
+def v6_string(index, text):
+    data = text.encode('utf-8')
+    return v6_subblock(index, v6_varuint(len(data)) + b'\x01' + data)
+
+
+def v6_block(block_type, payload, version=1, min_version=1):
+    return struct.pack('<IBBBB', len(payload), 0, min_version, version, block_type) + payload
+
+
+def v6_points(points):
+    """packs version=3/5 points as block version 2 point records"""
+    raw = np.empty(len(points), dtype=lines_v6.point_v2_dtype)
+    raw['xpos'] = points['xpos'] - lines_v6.x_offset
+    raw['ypos'] = points['ypos']
+    raw['speed'] = np.clip(np.round(points['speed'] * 4), 0, 0xffff)
+    raw['width'] = np.clip(np.round(points['width'] * 4), 0, 0xffff)
+    raw['tilt'] = np.clip(np.round(points['tilt'] * (255 / (2 * np.pi))), 0, 0xff)
+    raw['pressure'] = np.clip(np.round(points['pressure'] * 255), 0, 0xff)
+    return raw.tobytes()
+
+
+def v6_text_items(text, first_id, chunk_length=16):
+    """
+    the items of a text, in chunks of chunk_length characters (as typed),
+    every chunk after the previous one
+    """
+    items = []
+    left = (0, 0)
+    item_id = first_id
+    for start in range(0, len(text), chunk_length):
+        chunk = text[start:start + chunk_length]
+        items.append(v6_subblock(0, v6_id(2, item_id) + v6_id(3, left) + v6_id(4, (0, 0)) +
+                                 v6_int(5, 0) + v6_string(6, chunk)))
+        left = (item_id[0], item_id[1] + len(chunk) - 1)
+        item_id = (item_id[0], item_id[1] + len(chunk))
+    return v6_varuint(len(items)) + b''.join(items)
+
+
+def v6_root_text(text, first_id):
+    """a root text block (typed text), at the top of the page"""
+    return v6_block(lines_v6.BLOCK_ROOT_TEXT,
+                    v6_id(1, (0, 0)) +
+                    v6_subblock(2, v6_subblock(1, v6_subblock(1, v6_text_items(text, first_id))) +
+                                v6_subblock(2, v6_subblock(1, v6_varuint(0)))) +
+                    v6_subblock(3, struct.pack('<dd', -468, 234)) + v6_float(4, 936))
+
+
+def make_text(rng, nwords):
+    """returns nwords random words (from a small vocabulary), as lines"""
+    words = [words_list[index] for index in rng.integers(len(words_list), size=nwords)]
+    return '\n'.join(' '.join(words[start:start + 10]) for start in range(0, nwords, 10))
+
+
+# vocabulary of make_text
+words_list = ('alpha bravo charlie delta echo foxtrot golf hotel india juliett kilo lima '
+              'mike november oscar papa quebec romeo sierra tango uniform victor whiskey '
+              'xray yankee zulu meeting notes todo idea project draft review').split()
+
+
+def v6_blocks(layers, text=None):
+    root = (0, 1)
+    author = uuid.UUID(int=0).bytes
+    yield v6_block(lines_v6.BLOCK_AUTHOR_IDS,
+                   v6_varuint(1) + v6_subblock(0, v6_varuint(len(author)) + author + struct.pack('<H', 1)))
+    yield v6_block(lines_v6.BLOCK_MIGRATION_INFO, v6_id(1, (1, 1)) + v6_bool(2, True))
+    yield v6_block(lines_v6.BLOCK_PAGE_INFO,
+                   v6_int(1, 1) + v6_int(2, 0) + v6_int(3, 0) + v6_int(4, 0))
+    # ids: (1, n), in creation order
+    next_id = [16]
+
+    def new_id():
+        next_id[0] += 1
+        return (1, next_id[0])
+
+    layer_ids = [new_id() for _ in layers]
+    yield v6_block(lines_v6.BLOCK_TREE_NODE,
+                   v6_id(1, root) + v6_subblock(2, v6_id(1, (0, 0)) + v6_string(2, '')) +
+                   v6_subblock(3, v6_id(1, (0, 0)) + v6_bool(2, True)))
+    for index, layer_id in enumerate(layer_ids):
+        yield v6_block(lines_v6.BLOCK_SCENE_TREE,
+                       v6_id(1, layer_id) + v6_id(2, (0, 0)) + v6_bool(3, True) +
+                       v6_subblock(4, v6_id(1, root)))
+        yield v6_block(lines_v6.BLOCK_TREE_NODE,
+                       v6_id(1, layer_id) +
+                       v6_subblock(2, v6_id(1, new_id()) + v6_string(2, 'Layer %d' % (index + 1))) +
+                       v6_subblock(3, v6_id(1, (0, 0)) + v6_bool(2, True)))
+    left = (0, 0)
+    for layer_id in layer_ids:
+        item_id = new_id()
+        yield v6_block(lines_v6.BLOCK_SCENE_GROUP_ITEM,
+                       v6_id(1, root) + v6_id(2, item_id) + v6_id(3, left) + v6_id(4, (0, 0)) +
+                       v6_int(5, 0) + v6_subblock(6, bytes([lines_v6.ITEM_GROUP]) + v6_id(2, layer_id)))
+        left = item_id
+    for layer_id, strokes in zip(layer_ids, layers):
+        left = (0, 0)
+        for stroke in strokes:
+            item_id = new_id()
+            yield v6_line_block(layer_id, item_id, left, (0, 0), *stroke)
+            left = item_id
+    if text:
+        yield v6_root_text(text, new_id())
+
+
+def v6_line_block(layer_id, item_id, left_id, right_id, pen_nr, colour, width, points):
+    """a line item block: the line goes between left_id and right_id in its layer"""
+    value = (bytes([lines_v6.ITEM_LINE]) + v6_int(1, pen_nr) + v6_int(2, colour) +
+             v6_double(3, width) + v6_float(4, 0) + v6_subblock(5, v6_points(points)) +
+             v6_id(6, (0, 1)))
+    return v6_block(lines_v6.BLOCK_SCENE_LINE_ITEM,
+                    v6_id(1, layer_id) + v6_id(2, item_id) + v6_id(3, left_id) + v6_id(4, right_id) +
+                    v6_int(5, 0) + v6_subblock(6, value), version=2)
+
+
+def make_uuid(rng):
+    return str(uuid.UUID(bytes=rng.bytes(16), version=4))
+
+
+def make_tree(rootdir, ndocuments, nfolders, npages, version, nlayers,
+              nstrokes, npoints, pens=default_pens, seed=0, nwords=0,
+              colours=default_colours):
+    """
+    writes a xochitl directory with nfolders (nested) folders and
+    ndocuments notebooks of npages pages each (see make_page for nwords).
+    Returns the document uuids.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(rootdir, exist_ok=True)
+    last_modified = 1673648113535
+
+    def write_json(name, value):
+        with open(os.path.join(rootdir, name), 'w') as f:
+            json.dump(value, f, indent=4)
+
+    def write_metadata(item_uuid, parent, item_type, name):
+        write_json(item_uuid + '.metadata', {
+            'deleted': False,
+            'lastModified': str(last_modified + int(rng.integers(10 ** 9))),
+            'lastOpened': str(last_modified),
+            'lastOpenedPage': 0,
+            'metadatamodified': False,
+            'modified': False,
+            'parent': parent,
+            'pinned': False,
+            'synced': True,
+            'type': item_type,
+            'version': 1,
+            'visibleName': name,
+        })
+
+    folders = ['']
+    for index in range(nfolders):
+        folder_uuid = make_uuid(rng)
+        # nest under the root or an existing folder
+        write_metadata(folder_uuid, folders[rng.integers(len(folders))],
+                       'CollectionType', 'folder %d' % index)
+        write_json(folder_uuid + '.content', {})
+        folders.append(folder_uuid)
+
+    document_list = []
+    for index in range(ndocuments):
+        document_uuid = make_uuid(rng)
+        page_uuid_list = [make_uuid(rng) for _ in range(npages)]
+        write_metadata(document_uuid, folders[rng.integers(len(folders))],
+                       'DocumentType', 'document %d' % index)
+        write_json(document_uuid + '.content', {
+            'coverPageNumber': -1,
+            'fileType': 'notebook',
+            'formatVersion': 1,
+            'orientation': 'portrait',
+            'pageCount': npages,
+            'pages': page_uuid_list,
+        })
+        with open(os.path.join(rootdir, document_uuid + '.pagedata'), 'w') as f:
+            f.write('Blank\n' * npages)
+        page_dir = os.path.join(rootdir, document_uuid)
+        os.makedirs(page_dir, exist_ok=True)
+        for page_uuid in page_uuid_list:
+            with open(os.path.join(page_dir, page_uuid + '.rm'), 'wb') as f:
+                f.write(make_page(version, nlayers, nstrokes, npoints, pens,
+                                  int(rng.integers(2 ** 32)), nwords, colours))
+        document_list.append(document_uuid)
+    return document_list
+
+
+if __name__ == "__main__":
+    main()
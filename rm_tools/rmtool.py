@@ -3,12 +3,14 @@
 """Script for operating on reMarkable tablet ".rm" files."""
 
 import argparse
+import atexit
+import concurrent.futures
 import datetime
-import glob
 import json
 import subprocess
 import sys
 import tempfile
+import time
 import os
 import os.path
 
@@ -16,19 +18,28 @@ dirname = os.path.dirname(sys.modules[__name__].__file__)
 test_dir = os.path.abspath(dirname)
 sys.path.append(test_dir)
 
+import catalog
+import inkscape_shell
+import page_cache
+import profiling
+import rm2pdf
 import rm2svg
+import watcher
 
-# try to add the rmscene repo
-VERSION_6_SUPPORT = False
-rmscene_dirname = os.path.join(dirname, "..", "..", "rmscene", "src")
-rmscene_test_dir = os.path.abspath(rmscene_dirname)
-if os.path.isdir(rmscene_test_dir):
-    sys.path.append(rmscene_test_dir)
-    import rmscene.rm2svg as rm2svgv6
-    VERSION_6_SUPPORT = True
 
+ENUM_COMMANDS = ['list', 'convert', 'convert-all', 'watch', 'index', 'query',
+                 'search']
+ENUM_BACKENDS = ['pdf', 'inkscape']
 
-ENUM_COMMANDS = ['list', 'convert', 'convert-all']
+# default catalog file (in the root directory)
+CATALOG_NAME = '.rmtool-catalog.sqlite'
+
+# inkscape pages larger than this (bytes) are passed on as files, smaller
+# ones in memory
+SPILL_SIZE = 8 * 1024 * 1024
+
+# watch: longest time (seconds) changes are collected before converting
+WATCH_MAX_WAIT = 60
 
 default_values = {
     'debug': 0,
@@ -36,6 +47,25 @@ default_values = {
     'outdir': None,
     'width': 1404,
     'height': 1872,
+    'backend': 'pdf',
+    'inkscape': 'inkscape',
+    'jobs': 1,
+    'catalog': None,
+    'name': None,
+    'folder': None,
+    'since': None,
+    'until': None,
+    'type': None,
+    'limit': 20,
+    'simplify': 0,
+    'curves': False,
+    'erase': False,
+    'quantize': None,
+    'profile_json': None,
+    'cprofile': None,
+    'cprofile_output': None,
+    'debounce': 2.0,
+    'poll': False,
     'command': None,
     'infile': None,
     'outfile': None,
@@ -80,76 +110,86 @@ class Node:
 
 # parses the (raw) root directory
 def get_repo_info(rootdir, debug):
-    # create an unordered node list
-    node_list = []
-    metadata_list = glob.glob(os.path.join(rootdir, '*.metadata'))
-    for metadata_file in metadata_list:
-        uuid, _ = os.path.basename(metadata_file).split('.')
-        metadata = read_metadata(rootdir, uuid)
-        node_list.append([uuid, metadata])
-
-    # add the node list into a tree
+    uuid_list, metadata_list = scan_metadata(rootdir)
+    return build_tree(uuid_list, metadata_list, debug)
+
+
+def scan_metadata(rootdir):
+    """returns the uuids and the metadata of all the items of rootdir"""
+    # list the directory once
+    uuid_list = []
+    with os.scandir(rootdir) as it:
+        for entry in it:
+            uuid, ext = os.path.splitext(entry.name)
+            if ext == '.metadata' and entry.is_file():
+                uuid_list.append(uuid)
+
+    # read the metadata files concurrently (this is I/O bound), in
+    # batches to keep the per-task overhead low
+    def read_metadata_batch(uuid_batch):
+        return [read_metadata(rootdir, uuid) for uuid in uuid_batch]
+
+    batch = 512
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        metadata_list = []
+        for metadata_batch in executor.map(
+                read_metadata_batch, [uuid_list[start:start + batch] for
+                                      start in range(0, len(uuid_list), batch)]):
+            metadata_list.extend(metadata_batch)
+    return uuid_list, metadata_list
+
+
+def build_tree(uuid_list, metadata_list, debug):
+
+    # add the nodes into a tree: link every node to its parent. Nodes in
+    # the trash (and their children) are not linked to the root
     rootnode = Node('', None)
-    cur_uuid_list = [rootnode.uuid]
-    cur_node = [rootnode]
-    prev_node = None
-    while node_list:
-        new_cur_uuid_list = []
-        new_cur_node = []
-        new_node_list = []
-        for uuid, metadata in node_list:
-            if metadata['parent'] == 'trash':
-                # ignore it
-                pass
-            elif metadata['parent'] in cur_uuid_list:
-                # found the parent
-                index = cur_uuid_list.index(metadata['parent'])
-                node = Node(uuid, metadata)
-                cur_node[index].children.append(node)
-                new_cur_uuid_list.append(uuid)
-                new_cur_node.append(node)
-                if prev_node is not None:
-                    prev_node.next = node
-                prev_node = node
-            else:
-                # keep looking
-                new_node_list.append([uuid, metadata])
-        # reset status
-        cur_uuid_list = new_cur_uuid_list
-        cur_node = new_cur_node
-        node_list = new_node_list
-
-    # sort nodes alphabetically (visibleName)
-    # using bubble-sort as sizes should be small
-    # TODO(chemag): use some interview-acceptable sort here
-    def do_bubble_sort(node):
-        for indexl in range(len(node.children)):
-            for indexr in range(indexl + 1, len(node.children)):
-                vall = node.children[indexl].metadata['visibleName']
-                valr = node.children[indexr].metadata['visibleName']
-                if vall > valr:
-                    # swap nodes
-                    tmp = node.children[indexl]
-                    node.children[indexl] = node.children[indexr]
-                    node.children[indexr] = tmp
-        # fix next pointers
-        for index in range(len(node.children) - 1):
-            node.children[index].next = node.children[index + 1]
-        if len(node.children) > 0:
-            node.children[len(node.children) - 1].next = None
-
-    def node_sort(node):
-        # start with the node itself
-        do_bubble_sort(node)
-        for node in node.children:
-            node_sort(node)
+    node_dict = {rootnode.uuid: rootnode}
+    for uuid, metadata in zip(uuid_list, metadata_list):
+        node_dict[uuid] = Node(uuid, metadata)
+    orphan_list = []
+    for uuid, metadata in zip(uuid_list, metadata_list):
+        parent = metadata['parent']
+        if parent == 'trash':
+            # ignore it
+            pass
+        elif parent in node_dict:
+            node_dict[parent].children.append(node_dict[uuid])
+        else:
+            orphan_list.append(node_dict[uuid])
+    if orphan_list:
+        print('warning: ignoring %i items with a missing parent' %
+              len(orphan_list), file=sys.stderr)
+        if debug > 0:
+            for node in orphan_list:
+                print('  %s %s (parent: %s)' % (
+                    node.uuid, node.metadata.get('visibleName'),
+                    node.metadata['parent']), file=sys.stderr)
 
-    node_sort(rootnode)
+    # sort nodes alphabetically (visibleName), and fix next pointers
+    node_stack = [rootnode]
+    while node_stack:
+        node = node_stack.pop()
+        node.children.sort(key=lambda child: (child.metadata['visibleName'],
+                                              child.uuid))
+        for left, right in zip(node.children, node.children[1:]):
+            left.next = right
+        node_stack.extend(node.children)
     return rootnode
 
 
-def list_repo(rootdir, debug):
-    rootnode = get_repo_info(rootdir, debug)
+def get_tree(rootdir, catalog_path, debug):
+    # the tree of the root directory, or of the catalog (if any)
+    if catalog_path is None:
+        return get_repo_info(rootdir, debug)
+    with catalog.Catalog(catalog_path) as cat:
+        item_list = cat.get_metadata()
+    return build_tree([uuid for uuid, _ in item_list],
+                      [metadata for _, metadata in item_list], debug)
+
+
+def list_repo(rootdir, catalog_path, debug):
+    rootnode = get_tree(rootdir, catalog_path, debug)
 
     # dump lines
     def print_node(node, tab):
@@ -170,6 +210,43 @@ def list_repo(rootdir, debug):
     print_node(rootnode, tab)
 
 
+def index_repo(rootdir, catalog_path, debug):
+    with catalog.Catalog(catalog_path) as cat:
+        start = time.time()
+        updated, removed = cat.refresh(rootdir, debug)
+        if debug > 0:
+            print('..indexed %s into %s: %i items read, %i removed '
+                  '(%.2f s)' % (rootdir, catalog_path, updated, removed,
+                                time.time() - start))
+
+
+def query_repo(catalog_path, name, folder, since, until, item_type, debug):
+    with catalog.Catalog(catalog_path) as cat:
+        result_list = cat.query(name, folder, since, until, item_type)
+    for uuid, t, file_type, last_modified, page_count, path in result_list:
+        unix_dt = datetime.datetime.fromtimestamp(last_modified / 1000)
+        unix_str = unix_dt.strftime("%Y%m%d-%H:%M:%S.%f")
+        if t == 'CollectionType':
+            kind = 'folder'
+        elif page_count is None:
+            kind = file_type or 'document'
+        else:
+            kind = '%s:%i' % (file_type or 'document', page_count)
+        print('%s %s %s %s' % (uuid, unix_str, kind, path))
+
+
+def search_repo(catalog_path, text, limit, debug):
+    with catalog.Catalog(catalog_path) as cat:
+        start = time.time()
+        result_list = cat.search(text, limit)
+        elapsed = time.time() - start
+    for uuid, page_index, path, snippet in result_list:
+        print('%s page %i %s: %s' % (uuid, page_index + 1, path,
+                                     ' '.join(snippet.split())))
+    if debug > 0:
+        print('..%i results in %.3f s' % (len(result_list), elapsed))
+
+
 def run(command, dry_run, **kwargs):
     env = kwargs.get('env', None)
     stdin = subprocess.PIPE if kwargs.get('stdin', False) else None
@@ -196,89 +273,518 @@ def run(command, dry_run, **kwargs):
     return returncode, out, err
 
 
-def convert_file(infile, outfile, rootdir, width, height, debug):
+def get_page_list(rootdir, uuid, cat=None):
+    """returns the .rm files of the pages of a document, in order"""
+    # get page list (from the catalog if any)
+    if cat is not None:
+        page_uuid_list = cat.get_page_uuids(uuid)
+    else:
+        page_uuid_list = catalog.content_page_uuids(read_content(rootdir, uuid))
+    pagerm_list = []
+    for page_uuid in page_uuid_list:
+        # ensure the file exists
+        page_path = os.path.join(rootdir, uuid, page_uuid + '.rm')
+        if not os.path.exists(page_path):
+            raise FileNotFoundError('missing page %s' % page_path)
+        pagerm_list.append(page_path)
+    return pagerm_list
+
+
+def is_native_page(pagerm, backend):
+    # whether the built-in pdf backend can convert a page
+    return backend == 'pdf' and rm2svg.read_lines_version(pagerm) in (3, 5, 6)
+
+
+# inkscape shell sessions of this process, by command
+inkscape_sessions = {}
+
+
+def get_inkscape_session(command):
+    # one session per (worker) process. Sessions of worker processes are
+    # not closed explicitly: the shell exits when its stdin is closed
+    if command not in inkscape_sessions:
+        session = inkscape_shell.InkscapeShell(command)
+        inkscape_sessions[command] = session
+        atexit.register(session.close)
+    return inkscape_sessions[command]
+
+
+def convert_page(pagerm, spilldir, width, height, backend, inkscape,
+                 render_options, trace_memory=False):
+    """converts one page (the unit of work of convert-all).
+
+    Returns:
+        (page, stats) - page is the rendered page: a rm2pdf.PdfPage (with
+            the built-in pdf backend), or a one-page pdf (inkscape), as
+            bytes, or as a file in spilldir if it is larger than
+            SPILL_SIZE. stats are the page timings and counts (see
+            profiling.Profile.add_page)
+    """
+    colored_annotations = True
+    if colored_annotations:
+        rm2svg.set_coloured_annots()
+    if trace_memory:
+        profiling.reset_memory_peak()
+    timer = profiling.StageTimes()
+    stats = {
+        'page': pagerm,
+        'rm_bytes': os.path.getsize(pagerm),
+    }
+    native = is_native_page(pagerm, backend)
+    with timer.stage('parse'):
+        page = rm2svg.RmPage.open(pagerm, colored_annotations)
+    with page:
+        stats['points'] = sum(stroke.nsegments for layer in page.layers
+                              for stroke in layer.strokes)
+        if native:
+            with timer.stage('render'):
+                result = rm2pdf.render_page(
+                    page, rm2svg.ViewTransform(width, height), render_options)
+        else:
+            # inkscape only reads and writes files: in a scratch directory
+            # removed as soon as the page is read back
+            tmpdir = tempfile.TemporaryDirectory(prefix='rmtool.tmp.',
+                                                 dir=spilldir)
+            page_uuid = os.path.basename(pagerm).split('.')[0]
+            pagesvg = os.path.join(tmpdir.name, page_uuid + '.svg')
+            with timer.stage('svg'):
+                rm2svg.convert_to_svg(page, pagesvg, width, height, None,
+                                      render_options)
+            stats['svg_bytes'] = os.path.getsize(pagesvg)
+    if not native:
+        with tmpdir:
+            pagepdf = os.path.join(tmpdir.name, page_uuid + '.pdf')
+            with timer.stage('inkscape'):
+                get_inkscape_session(inkscape).export(pagesvg, pagepdf)
+            if spilldir is not None and os.path.getsize(pagepdf) > SPILL_SIZE:
+                result = os.path.join(spilldir, page_uuid + '.pdf')
+                os.replace(pagepdf, result)
+            else:
+                with open(pagepdf, 'rb') as f:
+                    result = f.read()
+    stats['stages'] = timer.stages
+    stats['seconds'] = timer.total()
+    stats['peak_memory'] = profiling.memory_peak() if trace_memory else None
+    return result, stats
+
+
+def assemble_document(page_list, outfile):
+    """puts the converted pages (see convert_page) of a document together"""
+    if all(isinstance(page, rm2pdf.PdfPage) for page in page_list):
+        # write the whole document directly
+        with rm2pdf.PdfWriter(outfile) as writer:
+            for page in page_list:
+                writer.add_page(page)
+        return
+    # pdfunite only reads files: write the in-memory pages to a scratch
+    # directory, removed when done
+    with tempfile.TemporaryDirectory(prefix='rmtool.tmp.') as tmpdir:
+        pagepdf_list = []
+        for index, page in enumerate(page_list):
+            if not isinstance(page, str):
+                pagepdf = os.path.join(tmpdir, 'page%d.pdf' % index)
+                if isinstance(page, rm2pdf.PdfPage):
+                    with rm2pdf.PdfWriter(pagepdf) as writer:
+                        writer.add_page(page)
+                else:
+                    with open(pagepdf, 'wb') as f:
+                        f.write(page)
+                page = pagepdf
+            pagepdf_list.append(page)
+        # put all the pages together
+        command = 'pdfunite %s "%s"' % (' '.join(pagepdf_list), outfile)
+        returncode, out, err = run(command, False)
+        if returncode != 0:
+            raise RuntimeError('%s: %s' % (
+                command, err.decode('utf-8', 'replace').strip()))
+
+
+def needs_spilldir(pagerm_list, backend):
+    # only the inkscape path can spill pages to disk
+    return not all(is_native_page(pagerm, backend) for pagerm in pagerm_list)
+
+
+def convert_file(infile, outfile, rootdir, width, height, backend, inkscape,
+                 render_options, debug):
     # get uuid
     uuid = os.path.basename(infile).split('.')[0]
     if not rootdir:
         rootdir = os.path.dirname(infile)
     # get file info
     # metadata = read_metadata(rootdir, uuid)
-    content = read_content(rootdir, uuid)
     # pagedata = read_pagedata(rootdir, uuid)
-    # create tempdir
-    tmpdir = tempfile.mkdtemp(prefix='rmtool.tmp.', dir='/tmp')
-    # convert pages to pdf
-    pagepdf_list = []
+    pagerm_list = get_page_list(rootdir, uuid)
+    spilldir = None
+    if needs_spilldir(pagerm_list, backend):
+        spilldir = tempfile.TemporaryDirectory(prefix='rmtool.tmp.')
+    try:
+        # convert pages to pdf
+        page_list = [convert_page(pagerm, spilldir and spilldir.name, width,
+                                  height, backend, inkscape, render_options)[0]
+                     for pagerm in pagerm_list]
+        assemble_document(page_list, outfile)
+    finally:
+        if spilldir is not None:
+            spilldir.cleanup()
 
-    # get page list
-    if content['formatVersion'] == 1:
-        page_uuid_list = content['pages']
-    elif content['formatVersion'] == 2:
-        page_uuid_list = [page['id'] for page in content['cPages']['pages'] if 'deleted' not in page]
 
-    for page_uuid in page_uuid_list:
-        # ensure the file exists
-        page_path = os.path.join(rootdir, uuid, page_uuid + '.rm')
-        assert(os.path.exists(page_path))
-        pagerm = page_path
-        pagesvg = os.path.join(tmpdir, page_uuid + '.svg')
-        colored_annotations = True
-        try:
-            rm2svg.rm2svg(pagerm, pagesvg, colored_annotations, width, height)
-        except:
-            rm2svgv6.rm2svg(pagerm, pagesvg)
-        pagepdf = os.path.join(tmpdir, page_uuid + '.pdf')
-        command = 'inkscape %s --export-filename=%s' % (pagesvg, pagepdf)
-        returncode, out, err = run(command, False)
-        assert(returncode == 0), command
-        pagepdf_list.append(pagepdf)
-    # put all the pages together
-    command = 'pdfunite %s "%s"' % (' '.join(pagepdf_list), outfile)
-    returncode, out, err = run(command, False)
-    assert(returncode == 0), command
+def convert_pages(task_list, jobs):
+    """
+    converts pages (task_list: (task, convert_page arguments) pairs), in
+    jobs processes. Yields (task, (page, stats), error) as the pages are
+    done.
+    """
+    if jobs <= 1:
+        for task, args in task_list:
+            try:
+                yield task, convert_page(*args), None
+            except (Exception, SystemExit) as e:
+                # the parsers abort() (sys.exit) on invalid files
+                yield task, None, e
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        future_list = {executor.submit(convert_page, *args): task
+                       for task, args in task_list}
+        for future in concurrent.futures.as_completed(future_list):
+            task = future_list.pop(future)
+            try:
+                yield task, future.result(), None
+            except (Exception, SystemExit) as e:
+                yield task, None, e
 
 
-def convert_all(rootdir, outdir, width, height, debug):
-    rootnode = get_repo_info(rootdir, debug)
+def list_documents(rootnode, outdir):
+    """
+    returns the (uuid, output pdf) of the documents of a tree, and makes
+    sure the output directories of its folders exist
+    """
+    document_list = []
 
-    # traverse the tree
-    def traverse_node(node, rootdir, outdir, width, height, debug):
+    def traverse_node(node, outdir):
         if node.uuid == '':
             # ignore the root node
             pass
         else:
             uuid = node.uuid
-            unix_ts_ms = int(node.metadata['lastModified'])
-            unix_ts = unix_ts_ms / 1000
             visible_name = node.metadata['visibleName']
             visible_name = visible_name.replace(' ', '_')
             t = node.metadata['type']
             if t == 'CollectionType':
                 # folder: make sure the directory exists
                 outdir = os.path.join(outdir, visible_name)
-                if not os.path.exists(outdir):
-                    os.mkdir(outdir, mode=0o755)
+                os.makedirs(outdir, mode=0o755, exist_ok=True)
             elif t == 'DocumentType':
                 # file: convert the file into a pdf
-                # check whether the file already exists (with right timestamp)
-                infile = os.path.join(rootdir, uuid)
                 outfile = os.path.join(outdir, visible_name + '.pdf')
-                do_convert = True
-                if os.path.exists(outfile):
-                    # output file already exists: check mtime
-                    file_mtime = os.stat(outfile).st_mtime
-                    if file_mtime > unix_ts:
-                        # output file exists and is younger
-                        do_convert = False
-                if do_convert:
-                    if debug > 0:
-                        print('..converting %s -> %s' % (infile, outfile))
-                    convert_file(infile, outfile, rootdir, width,
-                                 height, debug)
+                document_list.append((uuid, outfile))
         for node in node.children:
-            traverse_node(node, rootdir, outdir, width, height, debug)
+            traverse_node(node, outdir)
+
+    traverse_node(rootnode, outdir)
+    return document_list
+
+
+def get_page_keys(pagerm_list, settings, page_keys=None):
+    """
+    returns the cache keys of pages (see page_cache.page_key). page_keys
+    (pagerm -> ((mtime, size), key)) keeps the keys between runs: a page is
+    only hashed again if its mtime or size changed
+    """
+    if page_keys is None:
+        return [page_cache.page_key(pagerm, settings)
+                for pagerm in pagerm_list]
+    keys = []
+    for pagerm in pagerm_list:
+        stat = catalog.file_stat(pagerm)
+        entry = page_keys.get(pagerm)
+        if entry is None or entry[0] != stat:
+            entry = (stat, page_cache.page_key(pagerm, settings))
+            page_keys[pagerm] = entry
+        keys.append(entry[1])
+    return keys
+
+
+def convert_all(rootdir, outdir, width, height, backend, inkscape,
+                render_options, jobs, catalog_path, profile, debug,
+                document_list=None, cache=None, page_keys=None,
+                tree_document_list=None):
+    """
+    converts all the documents of rootdir (or document_list, see
+    list_documents) into outdir. cache (a page_cache.PageCache) and
+    page_keys (see get_page_keys) are kept between runs by watch, which
+    converts only some documents of the tree (tree_document_list)
+    """
+    # timings (see profiling), always collected
+    if profile is None:
+        profile = profiling.Profile()
+    cat = None
+    with profile.times.stage('scan'):
+        if catalog_path is not None:
+            # bring the catalog up to date first: its documents and page
+            # lists must be the ones of the root directory
+            cat = catalog.Catalog(catalog_path)
+            cat.refresh(rootdir, debug)
+        if document_list is None:
+            rootnode = get_tree(rootdir, catalog_path, debug)
+            document_list = list_documents(rootnode, outdir)
+    if tree_document_list is None:
+        tree_document_list = document_list
+
+    # a document is converted again only if its pages changed, and only
+    # its changed pages are rendered (see page_cache)
+    colored_annotations = True
+    if cache is None:
+        cache = page_cache.PageCache(outdir)
+    settings = page_cache.render_settings(width, height, colored_annotations,
+                                          backend, render_options)
+    start = time.time()
+    document_state = []
+    # page key -> [(document index, page index)] (identical pages are
+    # rendered once)
+    pending_keys = {}
+    task_list = []
+    # large inkscape pages are written here, until they are in the cache
+    spilldir = None
+    # the pages of the document run under cProfile (if any) are converted
+    # in this process, first
+    profiled_task_list = []
+    total_pages = 0
+    for uuid, outfile in document_list:
+        timer = profiling.StageTimes()
+        state = {
+            'uuid': uuid,
+            'outfile': outfile,
+            'keys': [],
+            'page_list': [],
+            'pending': 0,
+            'errors': [],
+        }
+        try:
+            with timer.stage('hash'):
+                pagerm_list = get_page_list(rootdir, uuid, cat)
+                keys = get_page_keys(pagerm_list, settings, page_keys)
+        except FileNotFoundError as e:
+            # only this document fails (see assemble)
+            state['errors'].append(str(e))
+            document_state.append(state)
+            continue
+        profile.document(uuid, outfile)
+        profile.add_document_stage(uuid, 'hash', timer.total())
+        if cache.is_current(outfile, keys):
+            if debug > 1:
+                print('..up to date %s -> %s' % (uuid, outfile))
+            continue
+        index = len(document_state)
+        state['keys'] = keys
+        document_state.append(state)
+        with timer.stage('cache'):
+            state['page_list'] = [cache.get(key) for key in keys]
+        profile.add_document_stage(uuid, 'cache', timer.stages['cache'])
+        for page_index, (pagerm, key) in enumerate(zip(pagerm_list, keys)):
+            if state['page_list'][page_index] is not None:
+                continue
+            if spilldir is None and needs_spilldir([pagerm], backend):
+                spilldir = tempfile.TemporaryDirectory(prefix='rmtool.tmp.')
+            state['pending'] += 1
+            if key not in pending_keys:
+                pending_keys[key] = []
+                task = (key, (pagerm, spilldir and spilldir.name, width,
+                              height, backend, inkscape, render_options,
+                              profile.trace_memory))
+                if uuid == profile.cprofile_uuid:
+                    profiled_task_list.append(task)
+                else:
+                    task_list.append(task)
+                total_pages += 1
+            pending_keys[key].append((index, page_index))
+
+    done_pages = 0
+    failed = []
+
+    def assemble(state):
+        if state['errors']:
+            failed.append(state['uuid'])
+            print('error: cannot convert %s: %s' % (
+                state['uuid'], '; '.join(state['errors'])), file=sys.stderr)
+            return
+        if profile.trace_memory:
+            profiling.reset_memory_peak()
+        timer = profiling.StageTimes()
+        try:
+            with timer.stage('assemble'):
+                assemble_document(state['page_list'], state['outfile'])
+        except Exception as e:
+            # e.g. pdfunite failed: the other documents are still converted
+            failed.append(state['uuid'])
+            state['page_list'] = None
+            print('error: cannot assemble %s: %r' % (state['uuid'], e),
+                  file=sys.stderr)
+            return
+        uuid = state['uuid']
+        profile.add_document_stage(uuid, 'assemble', timer.total())
+        if profile.trace_memory:
+            profile.add_memory_peak(uuid, profiling.memory_peak())
+        profile.document(uuid)['output_bytes'] = os.path.getsize(
+            state['outfile'])
+        cache.record(state['outfile'], state['uuid'], state['keys'])
+        state['page_list'] = None
+        if debug > 0:
+            elapsed = time.time() - start
+            print('..converted %s -> %s [%i/%i pages, %.1f pages/s]' % (
+                state['uuid'], state['outfile'], done_pages, total_pages,
+                done_pages / elapsed if elapsed > 0 else 0))
+
+    def page_done(key, result, error):
+        nonlocal done_pages
+        if error is None:
+            page, page_stats = result
+            timer = profiling.StageTimes()
+            with timer.stage('cache'):
+                cached_page = cache.put(key, page)
+            if isinstance(page, str):
+                # a spilled page: it is in the cache now
+                os.remove(page)
+            page = cached_page
+        done_pages += 1
+        for index, page_index in pending_keys.pop(key):
+            state = document_state[index]
+            if error is None:
+                state['page_list'][page_index] = page
+                profile.add_page(state['uuid'], page_stats)
+                profile.add_document_stage(state['uuid'], 'cache',
+                                           timer.total())
+                # identical pages are only counted once
+                page_stats = dict(page_stats, seconds=0, stages={})
+                timer = profiling.StageTimes()
+            else:
+                state['errors'].append('page %i: %r' % (page_index, error))
+            state['pending'] -= 1
+            if state['pending'] == 0:
+                assemble(state)
+
+    try:
+        for state in document_state:
+            if state['pending'] == 0:
+                # nothing to render
+                with profile.cprofile(state['uuid']):
+                    assemble(state)
+        # (the profiled document is put together as its last page is done)
+        with profile.cprofile(profile.cprofile_uuid):
+            for key, result, error in convert_pages(profiled_task_list, 1):
+                page_done(key, result, error)
+        # convert all the pages (in a process pool with jobs > 1), and put
+        # every document together (in the main process) as soon as all its
+        # pages are done
+        for key, result, error in convert_pages(task_list, jobs):
+            page_done(key, result, error)
+    finally:
+        # keep what was done, even if interrupted
+        with profile.times.stage('manifest'):
+            cache.save()
+        if spilldir is not None:
+            spilldir.cleanup()
+    with profile.times.stage('manifest'):
+        # (the pages of the documents no longer in the tree too)
+        removed = cache.prune(outfile for uuid, outfile in tree_document_list)
+        cache.save()
+    if cat is not None:
+        cat.close()
+    profile.write_json()
+    if debug > 0 or profile.json_path is not None:
+        profile.print_summary()
+    if debug > 0:
+        elapsed = time.time() - start
+        print('..converted %i documents (%i pages rendered) in %.2f s '
+              '[%.1f pages/s], %i up to date, %i failed, %i cached pages '
+              'removed' % (
+                  len(document_state) - len(failed), total_pages, elapsed,
+                  total_pages / elapsed if elapsed > 0 else 0,
+                  len(document_list) - len(document_state), len(failed),
+                  removed))
 
-    traverse_node(rootnode, rootdir, outdir, width, height, debug)
+
+def watch_repo(rootdir, outdir, width, height, backend, inkscape,
+               render_options, jobs, debounce, poll, debug):
+    """
+    converts all the documents of rootdir into outdir, and then again the
+    documents whose files change, until interrupted. The metadata, the
+    page keys and the page cache stay in memory between runs
+    """
+    uuid_list, metadata_list = scan_metadata(rootdir)
+    metadata_dict = dict(zip(uuid_list, metadata_list))
+    cache = page_cache.PageCache(outdir)
+    page_keys = {}
+    # uuid -> output pdf, of the last run
+    outfile_dict = {}
+    file_watcher = watcher.make_watcher(rootdir, poll)
+    if debug > 0:
+        print('..watching %s (%s)' % (rootdir, (
+            'inotify' if isinstance(file_watcher, watcher.InotifyWatcher)
+            else 'polling')))
+    # the documents to convert (None: all of them)
+    uuid_set = None
+    try:
+        while True:
+            rootnode = build_tree(list(metadata_dict),
+                                  list(metadata_dict.values()), debug)
+            tree_document_list = list_documents(rootnode, outdir)
+            document_list = tree_document_list
+            # a document is converted if its files changed, or if it got
+            # another output name (renamed or moved, with its folder too)
+            if uuid_set is not None:
+                uuid_set.update(uuid for uuid, outfile in document_list
+                                if outfile_dict.get(uuid) != outfile)
+                document_list = [(uuid, outfile) for uuid, outfile
+                                 in document_list if uuid in uuid_set]
+            try:
+                convert_all(rootdir, outdir, width, height, backend, inkscape,
+                            render_options, jobs, None, None, debug,
+                            document_list, cache, page_keys,
+                            tree_document_list)
+                outfile_dict.update(document_list)
+                retry_set = set()
+            except Exception as e:
+                # e.g. a document read in the middle of a sync
+                print('error: %r (trying again on the next change)' % e,
+                      file=sys.stderr)
+                retry_set = set(uuid for uuid, _ in document_list)
+            changed = watcher.wait_changes(file_watcher, debounce,
+                                           WATCH_MAX_WAIT)
+            if file_watcher.overflow:
+                # changes were lost: read everything again
+                print('warning: too many changes, reading %s again' % rootdir,
+                      file=sys.stderr)
+                file_watcher.reset()
+                uuid_list, metadata_list = scan_metadata(rootdir)
+                metadata_dict = dict(zip(uuid_list, metadata_list))
+                uuid_set = None
+                continue
+            uuid_set = retry_set
+            for path in changed:
+                dirname, name = os.path.split(path)
+                uuid, ext = os.path.splitext(name)
+                if dirname == rootdir and ext == '.metadata':
+                    try:
+                        metadata_dict[uuid] = read_metadata(rootdir, uuid)
+                    except FileNotFoundError:
+                        metadata_dict.pop(uuid, None)
+                    except ValueError:
+                        print('warning: cannot read %s' % path,
+                              file=sys.stderr)
+                    uuid_set.add(uuid)
+                elif dirname == rootdir and ext == '.content':
+                    uuid_set.add(uuid)
+                elif os.path.dirname(dirname) == rootdir and ext == '.rm':
+                    # (its mtime and size may be the same)
+                    page_keys.pop(path, None)
+                    uuid_set.add(os.path.basename(dirname))
+            if debug > 0:
+                print('..%i files changed, %i documents affected' % (
+                    len(changed), len(uuid_set)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        file_watcher.close()
 
 
 def get_options(argv):
@@ -324,6 +830,118 @@ def get_options(argv):
             dest='height', default=default_values['height'],
             metavar='HEIGHT',
             help=('HEIGHT height (default: %i)' % default_values['height']),)
+    parser.add_argument(
+            '--backend', action='store', type=str,
+            dest='backend', default=default_values['backend'],
+            choices=ENUM_BACKENDS,
+            metavar='[%s]' % (' | '.join(ENUM_BACKENDS,)),
+            help=('PDF writer: pdf (built-in) or inkscape (inkscape and '
+                  'pdfunite) (default: %s)' % default_values['backend']),)
+    parser.add_argument(
+            '--inkscape', action='store', type=str,
+            dest='inkscape', default=default_values['inkscape'],
+            metavar='COMMAND',
+            help=('inkscape command, run as "COMMAND --shell" (default: %s)' %
+                  default_values['inkscape']),)
+    parser.add_argument(
+            '--simplify', action='store', type=float,
+            dest='simplify', default=default_values['simplify'],
+            metavar='TOLERANCE',
+            help=('simplify the strokes, dropping the points closer than '
+                  'TOLERANCE (page units) to them (default: %g, keep all '
+                  'the points)' % default_values['simplify']),)
+    parser.add_argument(
+            '--curves', action='store_true',
+            dest='curves', default=default_values['curves'],
+            help=('draw the strokes as Bezier curves through their points: '
+                  'smoother, but larger (see --simplify)'),)
+    parser.add_argument(
+            '--erase', action='store_true',
+            dest='erase', default=default_values['erase'],
+            help=('remove the erased ink instead of drawing the erasers '
+                  'over it'),)
+    parser.add_argument(
+            '--quantize', action='store', type=rm2svg.parse_quantize,
+            dest='quantize', default=default_values['quantize'],
+            metavar='WIDTH_STEP,OPACITY_STEP,COLOUR_LEVELS',
+            help=('round the stroke widths (page units) and opacities to '
+                  'multiples of WIDTH_STEP and OPACITY_STEP, and the colours '
+                  'to COLOUR_LEVELS levels per channel (0: exact), e.g. '
+                  '0.25,0.05,32'),)
+    parser.add_argument(
+            '-j', '--jobs', action='store', type=int,
+            dest='jobs', default=default_values['jobs'],
+            metavar='N',
+            help=('convert-all: convert pages in N processes (default: %i)' %
+                  default_values['jobs']),)
+    parser.add_argument(
+            '--catalog', action='store', type=str,
+            dest='catalog', default=default_values['catalog'],
+            metavar='FILE',
+            help=('use the FILE catalog (see index) instead of scanning the '
+                  'root directory (default for index and query: ROOT/%s)' %
+                  CATALOG_NAME),)
+    parser.add_argument(
+            '--name', action='store', type=str,
+            dest='name', default=default_values['name'],
+            metavar='TEXT',
+            help='query: names containing TEXT',)
+    parser.add_argument(
+            '--folder', action='store', type=str,
+            dest='folder', default=default_values['folder'],
+            metavar='PATH',
+            help='query: items inside the PATH folder (e.g. /Work/2023)',)
+    parser.add_argument(
+            '--since', action='store', type=catalog.parse_date,
+            dest='since', default=default_values['since'],
+            metavar='DATE',
+            help='query: items modified on or after DATE (YYYYMMDD or ISO)',)
+    parser.add_argument(
+            '--until', action='store', type=catalog.parse_date,
+            dest='until', default=default_values['until'],
+            metavar='DATE',
+            help='query: items modified before DATE (YYYYMMDD or ISO)',)
+    parser.add_argument(
+            '--type', action='store', type=str,
+            dest='type', default=default_values['type'],
+            metavar='TYPE',
+            help=('query: folder, document, or a file type (notebook, pdf, '
+                  'epub)'),)
+    parser.add_argument(
+            '--limit', action='store', type=int,
+            dest='limit', default=default_values['limit'],
+            metavar='N',
+            help=('search: print the N best pages (default: %i)' %
+                  default_values['limit']),)
+    parser.add_argument(
+            '--profile-json', action='store', type=str,
+            dest='profile_json', default=default_values['profile_json'],
+            metavar='FILE',
+            help=('convert-all: write the time per stage, byte and point '
+                  'counts and peak memory of every document and page to '
+                  'FILE (JSON)'),)
+    parser.add_argument(
+            '--cprofile', action='store', type=str,
+            dest='cprofile', default=default_values['cprofile'],
+            metavar='UUID',
+            help=('convert-all: run the conversion of the UUID document '
+                  'under cProfile (stats printed to stderr)'),)
+    parser.add_argument(
+            '--cprofile-output', action='store', type=str,
+            dest='cprofile_output', default=default_values['cprofile_output'],
+            metavar='FILE',
+            help='write the --cprofile stats to FILE (see pstats)',)
+    parser.add_argument(
+            '--debounce', action='store', type=float,
+            dest='debounce', default=default_values['debounce'],
+            metavar='SECONDS',
+            help=('watch: convert once no file changed for SECONDS '
+                  '(default: %g)' % default_values['debounce']),)
+    parser.add_argument(
+            '--poll', action='store_true',
+            dest='poll', default=default_values['poll'],
+            help=('watch: poll the files for changes (default: inotify, '
+                  'where available)'),)
     # add command
     parser.add_argument(
             'command', action='store', type=str,
@@ -336,7 +954,7 @@ def get_options(argv):
             'infile', type=str, nargs='?',
             default=default_values['infile'],
             metavar='input-file',
-            help='input file',)
+            help='input file (search: the words to search for)',)
     parser.add_argument(
             'outfile', type=str, nargs='?',
             default=default_values['outfile'],
@@ -355,15 +973,63 @@ def main(argv):
         print(options)
     # need a valid infile or root directory
 
+    # the catalog (index/query: in the root directory by default)
+    catalog_path = options.catalog
+    if (options.command in ('index', 'query', 'search') and
+            catalog_path is None):
+        if options.rootdir is None:
+            print('error: %s needs --catalog or --root' % options.command,
+                  file=sys.stderr)
+            sys.exit(1)
+        catalog_path = os.path.join(options.rootdir, CATALOG_NAME)
+    if (options.command != 'index' and catalog_path is not None and
+            not os.path.exists(catalog_path)):
+        # (opening it would create an empty one)
+        print('error: no catalog %s (see index)' % catalog_path,
+              file=sys.stderr)
+        sys.exit(1)
+    if options.rootdir is None and catalog_path is not None:
+        with catalog.Catalog(catalog_path) as cat:
+            options.rootdir = cat.rootdir
+
+    render_options = rm2svg.RenderOptions(options.simplify, options.curves,
+                                          options.erase,
+                                          quantize=options.quantize)
+
     # do something
     if options.command == 'list':
-        list_repo(options.rootdir, options.debug)
+        list_repo(options.rootdir, catalog_path, options.debug)
     elif options.command == 'convert':
         convert_file(options.infile, options.outfile, options.rootdir,
-                     options.width, options.height, options.debug)
+                     options.width, options.height, options.backend,
+                     options.inkscape, render_options,
+                     options.debug)
     elif options.command == 'convert-all':
+        profile = profiling.Profile(
+            options.profile_json, options.profile_json is not None,
+            options.cprofile, options.cprofile_output)
         convert_all(options.rootdir, options.outdir, options.width,
-                    options.height, options.debug)
+                    options.height, options.backend, options.inkscape,
+                    render_options, options.jobs, catalog_path, profile,
+                    options.debug)
+    elif options.command == 'watch':
+        watch_repo(os.path.normpath(options.rootdir),
+                   options.outdir, options.width, options.height,
+                   options.backend, options.inkscape, render_options,
+                   options.jobs, options.debounce, options.poll,
+                   options.debug)
+    elif options.command == 'index':
+        index_repo(options.rootdir, catalog_path, options.debug)
+    elif options.command == 'query':
+        query_repo(catalog_path, options.name, options.folder,
+                   options.since, options.until, options.type, options.debug)
+    elif options.command == 'search':
+        if options.infile is None:
+            print('error: search needs the words to search for',
+                  file=sys.stderr)
+            sys.exit(1)
+        search_repo(catalog_path, options.infile, options.limit,
+                    options.debug)
 
 
 if __name__ == '__main__':
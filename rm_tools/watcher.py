@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+#
+# Change notifications for a (raw) root directory: the files written,
+# renamed or removed in it and in its document directories (one level
+# down), for rmtool watch.
+#
+# inotify (through ctypes) is used where available. Elsewhere, the tree
+# is polled: every poll stats the files, and reports the ones whose mtime
+# or size changed.
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+# inotify event masks (see <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+# default seconds between two polls
+POLL_INTERVAL = 2.0
+
+
+def load_libc():
+    # the libc, if it has inotify (Linux), or None
+    name = ctypes.util.find_library('c')
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+class InotifyWatcher():
+    """Changes reported by inotify."""
+
+    def __init__(self, rootdir, libc):
+        self.rootdir = rootdir
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # watch descriptor -> directory
+        self.watches = {}
+        # set when events were lost: everything must be read again
+        self.overflow = False
+        # changes are reported as they come
+        self.interval = 0
+        try:
+            self.add_watch(rootdir)
+            self.watch_dirs()
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def watch_dirs(self):
+        # watch the document directories not watched yet
+        watched = set(self.watches.values())
+        with os.scandir(self.rootdir) as it:
+            for entry in it:
+                if entry.is_dir() and entry.path not in watched:
+                    self.add_watch(entry.path)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOENT:
+                # already gone
+                return
+            raise OSError(error, 'cannot watch %s' % path)
+        self.watches[wd] = path
+
+    def changes(self, timeout):
+        """
+        waits up to timeout seconds for changes. Returns the set of paths
+        changed (empty if none)
+        """
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            dirname = self.watches.get(wd)
+            if dirname is None or not name:
+                continue
+            path = os.path.join(dirname, name)
+            if mask & IN_ISDIR:
+                if dirname == self.rootdir and mask & (IN_CREATE | IN_MOVED_TO):
+                    # a new document directory: its files may have been
+                    # written before the watch was added
+                    self.add_watch(path)
+                    try:
+                        with os.scandir(path) as it:
+                            changed.update(entry.path for entry in it if entry.is_file())
+                    except FileNotFoundError:
+                        pass
+                continue
+            changed.add(path)
+        return changed
+
+    def reset(self):
+        """clears overflow (after everything was read again)"""
+        self.overflow = False
+        self.watch_dirs()
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher():
+    """Changes found by comparing the (mtime, size) of the files."""
+
+    def __init__(self, rootdir, interval=POLL_INTERVAL):
+        self.rootdir = rootdir
+        self.interval = interval
+        self.overflow = False
+        self.snapshot = self.scan()
+        self.last_poll = time.monotonic()
+
+    def scan(self):
+        # path -> (mtime in ns, size), for the root and document directories
+        snapshot = {}
+        dir_list = [self.rootdir]
+        for dirname in dir_list:
+            try:
+                it = os.scandir(dirname)
+            except FileNotFoundError:
+                continue
+            with it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if dirname == self.rootdir:
+                                dir_list.append(entry.path)
+                            continue
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    snapshot[entry.path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def changes(self, timeout):
+        """see InotifyWatcher.changes"""
+        wait = self.last_poll + self.interval - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        if wait > 0:
+            time.sleep(wait)
+        snapshot = self.scan()
+        self.last_poll = time.monotonic()
+        changed = {path for path, stat in snapshot.items()
+                   if self.snapshot.get(path) != stat}
+        changed.update(path for path in self.snapshot if path not in snapshot)
+        self.snapshot = snapshot
+        return changed
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_watcher(rootdir, poll=False, interval=POLL_INTERVAL):
+    """an InotifyWatcher where available (and poll is False), or a PollingWatcher"""
+    libc = None if poll else load_libc()
+    if libc is not None:
+        try:
+            return InotifyWatcher(rootdir, libc)
+        except OSError:
+            # e.g. out of watches (fs.inotify.max_user_watches)
+            pass
+    return PollingWatcher(rootdir, interval)
+
+
+def wait_changes(watcher, debounce, max_wait=None):
+    """
+    blocks until something changes, then collects the changes until none
+    came for debounce seconds (or for max_wait seconds in all, if given).
+    Returns the set of paths changed
+    """
+    changed = set()
+    while not changed and not watcher.overflow:
+        changed = watcher.changes(3600)
+    # a poll only sees the changes made since the previous one
+    debounce = max(debounce, watcher.interval)
+    start = time.monotonic()
+    while True:
+        timeout = debounce
+        if max_wait is not None:
+            timeout = min(timeout, start + max_wait - time.monotonic())
+            if timeout <= 0:
+                break
+        more = watcher.changes(timeout)
+        if not more:
+            break
+        changed.update(more)
+    return changed
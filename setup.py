@@ -8,5 +8,5 @@ setup(
     author='Lisa Schwetlick',
     author_email='lisa.schwetlick@uni-potsdam.de',
     packages=find_packages(),
-    install_requires=["PyPDF2"]
+    install_requires=["PyPDF2", "numpy"]
 )
\ No newline at end of file
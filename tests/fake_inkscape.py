@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+#
+# A stand-in for "inkscape --shell", speaking the same line protocol (see
+# rm_tools/inkscape_shell.py): it prints a "> " prompt, reads one line of
+# ";"-separated actions, and runs them. export-do copies the opened file
+# to the export file name, with a "%PDF-" header.
+#
+# To test the error handling, it can exit (--crash-after) or stop
+# answering (--hang-after) instead of running the command after N ones,
+# and append every command it gets to a --log file, with its pid.
+import os
+import sys
+import time
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shell', action='store_true')
+    parser.add_argument('--crash-after', type=int, metavar='N')
+    parser.add_argument('--hang-after', type=int, metavar='N')
+    parser.add_argument('--log', metavar='FILE')
+    args = parser.parse_args()
+
+    infile = outfile = None
+    ncommands = 0
+    out = sys.stdout.buffer
+    while True:
+        out.write(b'> ')
+        out.flush()
+        line = sys.stdin.readline()
+        if not line or line.strip() == 'quit':
+            return
+        if args.log:
+            with open(args.log, 'a') as f:
+                f.write('%d %s' % (os.getpid(), line))
+        if args.crash_after is not None and ncommands >= args.crash_after:
+            os._exit(1)
+        if args.hang_after is not None and ncommands >= args.hang_after:
+            time.sleep(3600)
+        ncommands += 1
+        for action in line.split(';'):
+            name, _, value = action.strip().partition(':')
+            if name == 'file-open':
+                infile = value
+            elif name == 'export-filename':
+                outfile = value
+            elif name == 'export-do':
+                if infile is None or not os.path.exists(infile):
+                    out.write(b'file-open: cannot open %s\n' % str(infile).encode())
+                    continue
+                with open(infile, 'rb') as f, open(outfile, 'wb') as g:
+                    g.write(b'%PDF-1.4\n' + f.read())
+            elif name == 'file-close':
+                infile = None
+
+
+if __name__ == "__main__":
+    main()
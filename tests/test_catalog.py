@@ -0,0 +1,38 @@
+import json
+import os
+
+import pytest
+
+from rm_tools import rmgen
+from rm_tools import rmtool
+
+
+def test_convert_all_stale_catalog(tmp_path):
+    rootdir = str(tmp_path / 'raw')
+    catalog_path = str(tmp_path / 'catalog.sqlite')
+    uuid = rmgen.make_tree(rootdir, 1, 0, 2, 5, 1, 5, 10)[0]
+    rmtool.main(['rmtool', '--root', rootdir, '--catalog', catalog_path, 'index'])
+    # the second page is replaced after the catalog was made
+    content_path = os.path.join(rootdir, uuid + '.content')
+    with open(content_path) as f:
+        content = json.load(f)
+    old_page, new_page = content['pages'][1], '00000000-0000-4000-8000-000000000001'
+    os.rename(os.path.join(rootdir, uuid, old_page + '.rm'),
+              os.path.join(rootdir, uuid, new_page + '.rm'))
+    content['pages'][1] = new_page
+    with open(content_path, 'w') as f:
+        json.dump(content, f)
+
+    outdir = str(tmp_path / 'out')
+    rmtool.main(['rmtool', '--root', rootdir, '--catalog', catalog_path,
+                 'convert-all', '--outdir', outdir])
+    assert os.path.exists(os.path.join(outdir, 'document_0.pdf'))
+
+
+@pytest.mark.parametrize('command', ['list', 'query', 'search', 'convert-all'])
+def test_missing_catalog(tmp_path, command, capsys):
+    catalog_path = str(tmp_path / 'missing.sqlite')
+    with pytest.raises(SystemExit):
+        rmtool.main(['rmtool', '--catalog', catalog_path, command, 'word'])
+    assert 'no catalog' in capsys.readouterr().err
+    assert not os.path.exists(catalog_path)
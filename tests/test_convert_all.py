@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+
+from rm_tools import page_cache
+from rm_tools import rmgen
+from rm_tools import rmtool
+
+
+def page_path(rootdir, uuid, index):
+    with open(os.path.join(rootdir, uuid + '.content')) as f:
+        page_uuid = json.load(f)['pages'][index]
+    return os.path.join(rootdir, uuid, page_uuid + '.rm')
+
+
+def test_convert_all_broken_documents(tmp_path, capsys):
+    rootdir = str(tmp_path / 'raw')
+    outdir = str(tmp_path / 'out')
+    uuid_list = rmgen.make_tree(rootdir, 4, 0, 2, 5, 1, 5, 10)
+    # a missing page, and a corrupt page
+    os.remove(page_path(rootdir, uuid_list[0], 1))
+    with open(page_path(rootdir, uuid_list[1], 0), 'wb') as f:
+        f.write(b'reMarkable .lines file, version=5          ' + b'\xff' * 7)
+    rmtool.main(['rmtool', '--root', rootdir, 'convert-all',
+                 '--outdir', outdir])
+    err = capsys.readouterr().err
+    assert uuid_list[0] in err and 'missing page' in err
+    assert uuid_list[1] in err
+    assert sorted(name for name in os.listdir(outdir)
+                  if name.endswith('.pdf')) == ['document_2.pdf',
+                                                'document_3.pdf']
+
+
+def test_convert_all_assemble_error(tmp_path, monkeypatch, capsys):
+    rootdir = str(tmp_path / 'raw')
+    outdir = str(tmp_path / 'out')
+    uuid_list = rmgen.make_tree(rootdir, 3, 0, 1, 5, 1, 5, 10)
+    assemble_document = rmtool.assemble_document
+
+    def failing_assemble(page_list, outfile):
+        # e.g. pdfunite failing
+        if outfile.endswith('document_0.pdf'):
+            raise RuntimeError('pdfunite failed')
+        assemble_document(page_list, outfile)
+
+    monkeypatch.setattr(rmtool, 'assemble_document', failing_assemble)
+    rmtool.main(['rmtool', '--root', rootdir, 'convert-all',
+                 '--outdir', outdir])
+    err = capsys.readouterr().err
+    assert uuid_list[0] in err and 'pdfunite failed' in err
+    assert sorted(name for name in os.listdir(outdir)
+                  if name.endswith('.pdf')) == ['document_1.pdf',
+                                                'document_2.pdf']
+
+
+def test_convert_all_prune_deleted_document(tmp_path):
+    rootdir = str(tmp_path / 'raw')
+    outdir = str(tmp_path / 'out')
+    uuid_list = rmgen.make_tree(rootdir, 2, 0, 2, 5, 1, 5, 10)
+    argv = ['rmtool', '--root', rootdir, 'convert-all', '--outdir', outdir]
+    rmtool.main(argv)
+    cachedir = os.path.join(outdir, page_cache.CACHE_DIRNAME)
+    cache = page_cache.PageCache(outdir)
+    deleted_keys = cache.manifest['document_0.pdf']['pages']
+    kept_keys = cache.manifest['document_1.pdf']['pages']
+    assert len(os.listdir(cachedir)) > len(kept_keys)
+    # the first document is deleted
+    shutil.rmtree(os.path.join(rootdir, uuid_list[0]))
+    for ext in ('.metadata', '.content'):
+        os.remove(os.path.join(rootdir, uuid_list[0] + ext))
+    rmtool.main(argv)
+    cache = page_cache.PageCache(outdir)
+    assert list(cache.manifest) == ['document_1.pdf']
+    keys = set(os.path.splitext(name)[0] for name in os.listdir(cachedir))
+    assert keys.isdisjoint(deleted_keys)
+    assert keys.issuperset(kept_keys)
@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+
+import pytest
+
+from rm_tools import inkscape_shell
+
+
+fake_inkscape = os.path.join(os.path.dirname(__file__), 'fake_inkscape.py')
+
+
+def make_shell(tmp_path, *options, timeout=10):
+    command = [sys.executable, fake_inkscape, '--log', str(tmp_path / 'log')] + list(options)
+    return inkscape_shell.InkscapeShell(command, timeout)
+
+
+def make_svg(tmp_path, name):
+    path = tmp_path / (name + '.svg')
+    path.write_text('<svg xmlns="http://www.w3.org/2000/svg"/>')
+    return str(path), str(tmp_path / (name + '.pdf'))
+
+
+def session_pids(tmp_path):
+    # the pid of the shell that got every command, in order
+    return [line.split()[0] for line in (tmp_path / 'log').read_text().splitlines()]
+
+
+def test_export(tmp_path):
+    with make_shell(tmp_path) as shell:
+        for name in ('a', 'b', 'c'):
+            infile, outfile = make_svg(tmp_path, name)
+            shell.export(infile, outfile)
+            with open(outfile, 'rb') as f:
+                assert f.read().startswith(b'%PDF-')
+    # one session for all the files
+    assert len(set(session_pids(tmp_path))) == 1
+
+
+def test_export_error(tmp_path):
+    with make_shell(tmp_path) as shell:
+        with pytest.raises(inkscape_shell.InkscapeError, match='cannot export'):
+            shell.export(str(tmp_path / 'missing.svg'), str(tmp_path / 'missing.pdf'))
+        # the session is still usable
+        infile, outfile = make_svg(tmp_path, 'a')
+        shell.export(infile, outfile)
+    assert len(set(session_pids(tmp_path))) == 1
+
+
+def test_crash_restart(tmp_path):
+    # every session exits on its second command
+    with make_shell(tmp_path, '--crash-after', '1') as shell:
+        for name in ('a', 'b', 'c'):
+            infile, outfile = make_svg(tmp_path, name)
+            shell.export(infile, outfile)
+            assert os.path.exists(outfile)
+    # a, b (dies), b again in a new session, c (dies), c again
+    pids = session_pids(tmp_path)
+    assert len(pids) == 5
+    assert len(set(pids)) == 3
+
+
+def test_crash_retry_once(tmp_path):
+    # every session exits on its first command: one retry, then the error
+    with make_shell(tmp_path, '--crash-after', '0') as shell:
+        infile, outfile = make_svg(tmp_path, 'a')
+        with pytest.raises(inkscape_shell.InkscapeError, match='exited'):
+            shell.export(infile, outfile)
+    assert len(set(session_pids(tmp_path))) == 2
+
+
+def test_hang_timeout(tmp_path):
+    # every session stops answering on its second command
+    with make_shell(tmp_path, '--hang-after', '1', timeout=0.5) as shell:
+        for name in ('a', 'b'):
+            infile, outfile = make_svg(tmp_path, name)
+            shell.export(infile, outfile)
+            assert os.path.exists(outfile)
+    # b timed out in the first session, and was done in a new one
+    assert len(set(session_pids(tmp_path))) == 2
+
+
+def test_hang_timeout_error(tmp_path):
+    with make_shell(tmp_path, '--hang-after', '0', timeout=0.5) as shell:
+        infile, outfile = make_svg(tmp_path, 'a')
+        start = time.monotonic()
+        with pytest.raises(inkscape_shell.InkscapeError, match='no answer'):
+            shell.export(infile, outfile)
+        # two attempts, and the hung shells are killed
+        assert time.monotonic() - start < 5
+        assert not shell.running()
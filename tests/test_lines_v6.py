@@ -0,0 +1,52 @@
+import numpy as np
+
+from rm_tools import lines_v6
+from rm_tools import rmgen
+
+
+def make_page(nstrokes):
+    # a one layer page, and its strokes (layer id (1, 17), line ids from (1, 20))
+    layers = rmgen.make_strokes(np.random.default_rng(0), 1, nstrokes, 10, [15])
+    blocks = list(rmgen.v6_blocks(layers))
+    return blocks, layers[0]
+
+
+def line_points(layer_list):
+    # the first x of every line (as written: 2 decimals)
+    (_, lines), = layer_list
+    return [round(float(line.points['xpos'][0]), 2) for line in lines]
+
+
+def stroke_points(strokes):
+    return [round(float(points['xpos'][0]), 2) for *_, points in strokes]
+
+
+def test_file_order():
+    blocks, strokes = make_page(3)
+    layer_list = lines_v6.read_layers(lines_v6.header_v6 + b''.join(blocks))
+    assert line_points(layer_list) == stroke_points(strokes)
+
+
+def test_inserted_line():
+    # a line drawn between the first two, written last
+    blocks, strokes = make_page(3)
+    new_stroke = rmgen.make_strokes(np.random.default_rng(1), 1, 1, 10, [17])[0][0]
+    blocks.append(rmgen.v6_line_block((1, 17), (1, 30), (1, 20), (1, 21), *new_stroke))
+    layer_list = lines_v6.read_layers(lines_v6.header_v6 + b''.join(blocks))
+    order = [strokes[0], new_stroke, strokes[1], strokes[2]]
+    assert line_points(layer_list) == stroke_points(order)
+
+
+def test_blocks_out_of_order():
+    blocks, strokes = make_page(4)
+    # the line blocks come last (v6_blocks): write them backwards
+    blocks = blocks[:-4] + blocks[-4:][::-1]
+    layer_list = lines_v6.read_layers(lines_v6.header_v6 + b''.join(blocks))
+    assert line_points(layer_list) == stroke_points(strokes)
+
+
+def test_order_text():
+    # "ac", then "b" inserted between a and c
+    items = [((1, 10), (0, 0), (0, 0), 2, 'ac'),
+             ((1, 20), (1, 10), (1, 11), 1, 'b')]
+    assert lines_v6.order_text(items) == 'abc'
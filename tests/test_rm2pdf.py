@@ -0,0 +1,32 @@
+import io
+import os
+
+import pytest
+
+from rm_tools import rm2pdf
+
+
+page = os.path.join(os.path.dirname(__file__), '..', 'data', 'writing_tools.rm')
+
+
+def test_abort(tmp_path):
+    # the second page cannot be read: no (truncated) pdf is left behind
+    corrupt = tmp_path / 'corrupt.rm'
+    corrupt.write_bytes(b'reMarkable .lines file, version=5          ' + b'\xff' * 7)
+    output = tmp_path / 'part.pdf'
+    # (the parsers abort() with sys.exit)
+    with pytest.raises(SystemExit):
+        rm2pdf.rm2pdf([page, str(corrupt)], str(output))
+    assert not output.exists()
+
+
+def test_abort_stream():
+    # a stream given by the caller is left open, without a trailer
+    output = io.BytesIO()
+    with pytest.raises(ValueError):
+        with rm2pdf.PdfWriter(output) as writer:
+            writer.add_page(rm2pdf.render_file(page))
+            raise ValueError
+    assert not output.closed
+    assert output.getvalue().startswith(b'%PDF')
+    assert b'trailer' not in output.getvalue()
@@ -0,0 +1,122 @@
+import struct
+
+import numpy as np
+import pytest
+
+from rm_tools import lines_v6
+from rm_tools import rm2png
+from rm_tools import rm2svg
+from rm_tools import rmgen
+
+
+def line(x0, y0, x1, y1, width=4.0, npoints=50):
+    # a straight stroke, in page coordinates
+    points = np.zeros(npoints, dtype=lines_v6.point_v1_dtype)
+    points['xpos'] = np.linspace(x0, x1, npoints)
+    points['ypos'] = np.linspace(y0, y1, npoints)
+    points['width'] = width
+    points['pressure'] = 0.5
+    return points
+
+
+def make_page(layers):
+    # layers: [[(pen_nr, points)]], as a version=5 page
+    parts = [rmgen.headers[5], struct.pack('<I', len(layers))]
+    for strokes in layers:
+        parts.append(struct.pack('<I', len(strokes)))
+        for pen_nr, points in strokes:
+            parts.append(struct.pack('<IIIffI', pen_nr, 0, 0, 2.0, 0, len(points)))
+            parts.append(points.tobytes())
+    return b''.join(parts)
+
+
+def random_page():
+    # two ballpoint strokes
+    layers = rmgen.make_strokes(np.random.default_rng(0), 1, 2, 50, [15])
+    return make_page([[(pen_nr, points) for pen_nr, _, _, points in layers[0]]])
+
+
+def render(data, options=None, transform=None):
+    if transform is None:
+        transform = rm2svg.ViewTransform(702, 936)
+    with rm2svg.RmPage.open(data, False) as page:
+        return rm2png.render_page(page, transform, options)
+
+
+def ink(image):
+    return (image < 250).any(axis=2)
+
+
+def bounding_box(mask):
+    ys, xs = np.nonzero(mask)
+    return xs.min(), ys.min(), xs.max(), ys.max()
+
+
+def near(mask, other, radius):
+    # whether every pixel of mask is within radius pixels of other
+    padded = np.pad(other, radius)
+    grown = np.zeros_like(other)
+    for dy in range(2 * radius + 1):
+        for dx in range(2 * radius + 1):
+            grown |= padded[dy:dy + other.shape[0], dx:dx + other.shape[1]]
+    return not (mask & ~grown).any()
+
+
+def test_erase():
+    # a vertical stroke in the first layer, and in the second one a
+    # horizontal stroke erased along its length, across the first stroke
+    vertical = (15, line(700, 300, 700, 1300))
+    horizontal = (15, line(200, 800, 1200, 800))
+    eraser = (6, line(200, 800, 1200, 800, width=40))
+    data = make_page([[vertical], [horizontal, eraser]])
+    erased = render(data, rm2svg.RenderOptions(erase=True))
+    # the erased stroke is gone, and the eraser (of another layer) leaves
+    # the vertical stroke whole
+    assert (erased == render(make_page([[vertical], []]))).all()
+    crossing = (slice(399, 401), slice(345, 356))
+    assert ink(erased)[crossing].any()
+    # (painted over, the eraser hides the vertical stroke there)
+    assert not ink(render(data))[crossing].any()
+
+
+@pytest.mark.parametrize('scale', [0.25, 0.5, 1])
+def test_scale(scale):
+    data = make_page([[(15, line(700, 300, 700, 1300))]])
+    image = render(data, transform=rm2svg.ViewTransform(1404 * scale, 1872 * scale))
+    assert image.shape == (round(1872 * scale), round(1404 * scale), 3)
+    # the stroke lands where the page coordinates say, scaled (give or
+    # take its half width)
+    x0, y0, x1, y1 = bounding_box(ink(image))
+    pad = 4 * scale + 1
+    assert 700 * scale - pad <= x0 <= x1 <= 700 * scale + pad
+    assert 300 * scale - pad <= y0 <= 300 * scale + 1
+    assert 1300 * scale - 1 <= y1 <= 1300 * scale + pad
+
+
+@pytest.mark.parametrize('options', [
+    rm2svg.RenderOptions(simplify=2),
+    rm2svg.RenderOptions(curves=True),
+])
+def test_shape_options(options):
+    # a straight stroke is drawn the same
+    data = make_page([[(15, line(200, 300, 1200, 1500))]])
+    assert np.abs(render(data, options).astype(int) - render(data)).max() <= 64
+    # any other stroke changes, but stays within a few pixels of its points
+    data = random_page()
+    image, reference = render(data, options), render(data)
+    assert (image != reference).any()
+    assert near(ink(image), ink(reference), 2) and near(ink(reference), ink(image), 2)
+
+
+@pytest.mark.parametrize('colour_levels', [2, 4])
+def test_quantize(colour_levels):
+    # a wide stroke, harder and harder (a darker and darker ballpoint)
+    points = line(200, 800, 1200, 800, width=8.0, npoints=100)
+    points['pressure'] = np.linspace(0.1, 1, len(points))
+    data = make_page([[(15, points)]])
+    # the colours along its middle
+    middle = (400, slice(110, 590))
+    colours = set(map(tuple, render(data)[middle]))
+    options = rm2svg.RenderOptions(quantize=(0.5, 0.25, colour_levels))
+    quantized = set(map(tuple, render(data, options)[middle]))
+    assert len(quantized) <= colour_levels < len(colours)
@@ -0,0 +1,20 @@
+import numpy as np
+
+from rm_tools import rm2svg
+from rm_tools import rmgen
+
+
+def test_layer_simplified_like_strokes():
+    # one pass over a layer keeps the points of simplifying every stroke
+    data = rmgen.make_page(5, 1, 50, 40)
+    with rm2svg.RmPage.open(data) as page:
+        strokes = page.layers[0].strokes
+        runs_list = [rm2svg.stroke_runs(stroke) for stroke in strokes]
+        index_list = rm2svg.simplified_indices(strokes, runs_list, 1)
+        for stroke, runs, index in zip(strokes, runs_list, index_list):
+            segments = stroke.segments
+            fixed = [first for first, *_ in runs] + [last - 1 for _, last, *_ in runs]
+            keep = rm2svg.simplify_mask(segments['xpos'].astype(np.float64),
+                                        segments['ypos'].astype(np.float64), fixed, 1)
+            assert np.array_equal(index, np.flatnonzero(keep))
+            assert len(index) < len(segments)
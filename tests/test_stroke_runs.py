@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from rm_tools import rm2svg
+from rm_tools import rmgen
+
+
+@pytest.mark.parametrize('scale', [1, 0.5, 0.37, 2])
+def test_runs_merged_as_written(scale):
+    # one run per group of consecutive chunks written with the same style
+    data = rmgen.make_page(5, 1, 100, 60)
+    with rm2svg.RmPage.open(data) as page:
+        for stroke in page.layers[0].strokes:
+            segments = stroke.segments
+            widths, colors, opacities = stroke.pen.get_stroke_style(
+                segments['speed'], segments['tilt'], segments['width'], segments['pressure'])
+            written = [(tuple(color), f'{width * scale:.3f}', opacity)
+                       for width, color, opacity in zip(widths.tolist(), colors.tolist(),
+                                                        opacities.tolist())]
+            ngroups = 1 + sum(a != b for a, b in zip(written, written[1:]))
+            runs = rm2svg.stroke_runs(stroke, scales=[scale])
+            assert len(runs) == ngroups
+            styles = [(color, f'{width * scale:.3f}', opacity) for _, _, color, width, opacity in runs]
+            assert all(a != b for a, b in zip(styles, styles[1:]))
+
+
+def test_runs_several_scales():
+    data = rmgen.make_page(5, 1, 100, 60)
+    with rm2svg.RmPage.open(data) as page:
+        for stroke in page.layers[0].strokes:
+            runs = rm2svg.stroke_runs(stroke, scales=[0.5, 2])
+            assert len(runs) >= max(len(rm2svg.stroke_runs(stroke, scales=[0.5])),
+                                    len(rm2svg.stroke_runs(stroke, scales=[2])))
+            assert np.all(np.diff([first for first, *_ in runs]) > 0)
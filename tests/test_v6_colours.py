@@ -0,0 +1,43 @@
+import io
+import os
+
+import pytest
+
+from rm_tools import rm2pdf
+from rm_tools import rm2svg
+
+
+# a version=6 page (rmgen --pens 15,17,14,18 --colours 5,6,7,8,9): pink,
+# blue, red, gray-overlap and highlight strokes
+colours_page = os.path.join(os.path.dirname(__file__), '..', 'data', 'v6_colours.rm')
+
+
+@pytest.fixture(autouse=True)
+def restore_colours(monkeypatch):
+    # set_coloured_annots replaces the module-global table
+    monkeypatch.setattr(rm2svg, 'stroke_colour', dict(rm2svg.stroke_colour))
+
+
+@pytest.mark.parametrize('coloured_annotations, colour_list', [
+    (False, ['rgb(255, 192, 203)', 'rgb(78, 105, 201)', 'rgb(179, 62, 57)']),
+    # the highlighter strokes get the annotation colour
+    (True, ['rgb(150, 0, 0)', 'rgb(179, 62, 57)', 'rgb(125, 125, 125)']),
+])
+def test_svg(coloured_annotations, colour_list):
+    output = io.StringIO()
+    rm2svg.rm2svg(colours_page, output, coloured_annotations)
+    svg = output.getvalue()
+    for rgb in colour_list:
+        assert rgb in svg
+
+
+@pytest.mark.parametrize('coloured_annotations', [False, True])
+def test_pdf(coloured_annotations):
+    output = io.BytesIO()
+    rm2pdf.rm2pdf([colours_page], output, coloured_annotations)
+    assert output.getvalue().startswith(b'%PDF')
+
+
+def test_unknown_colour():
+    pen = rm2svg.Pen(2, 99)
+    assert pen.base_color == rm2svg.stroke_colour[0]